@@ -1,7 +1,11 @@
+from botzone_preloader import BackgroundPreloader
 from random_mahjong_agent import RandomMahjongAgent
 from chinese_standard_mahjong_botzone_adapter import ChineseStandardMahjongBotzoneAdapter
 
 if __name__ == '__main__':
+    preloader = BackgroundPreloader()
+    # 首回合只需确定风圈，numpy等到等待后续request时再于后台导入
+    preloader.preload_modules('numpy')
     agent = RandomMahjongAgent()
     adapter = ChineseStandardMahjongBotzoneAdapter()
     adapter.load_botzone_request_and_generate_response(agent, input)
\ No newline at end of file
@@ -0,0 +1,187 @@
+import sys
+import time
+from typing import Dict, Sequence, Tuple, Union
+
+import numpy as np
+
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+
+# 对局结束后的后处理：把一批对局按座位拆成轨迹，计算GAE优势和回报，整批写入样本池
+# 每局的决策按时间顺序交错存储，seat为每一步决策的座位；只有一个合法动作的决策（被动的Pass等）不作为样本
+# 奖励只在对局结束时给出：每个座位最后一个决策的奖励为该座位的最终得分乘以reward_scale，其余为0
+# 所有轨迹补齐到同一长度后整批计算：优势A_t = sum_{k>=t} (gamma*lambda)^(k-t) * delta_k 是delta与上三角矩阵的乘积
+class ChineseStandardMahjongAdvantageEstimator:
+
+    # 一局游戏：字段名 -> 第一维为这一局决策数的数组（observation、mask、action、log_prob、value、seat），
+    # 以及scores：每个座位的最终得分
+    GameType = Dict[str, np.ndarray]
+    # 一批样本：字段名 -> 第一维为样本数的数组
+    BatchType = Dict[str, np.ndarray]
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+    # 写入样本池的字段，reward为该座位的最终得分（已乘reward_scale）
+    _sample_fields = ('observation', 'mask', 'action', 'log_prob', 'value')
+
+    _default_gamma = 1.0
+    _default_gae_lambda = 0.95
+    _default_reward_scale = 0.01
+
+    def __init__(self, config:Union[Dict, None]=None):
+        self.config = dict() if config is None else config
+        # 缓存的折扣矩阵，长度不够时重新生成
+        self._discounts = np.zeros((0, 0))
+
+    # 折扣因子
+    @property
+    def gamma(self) -> float:
+        return self.config.get('gamma', self._default_gamma)
+
+    # GAE的lambda
+    @property
+    def gae_lambda(self) -> float:
+        return self.config.get('gae_lambda', self._default_gae_lambda)
+
+    # 得分到奖励的缩放
+    @property
+    def reward_scale(self) -> float:
+        return self.config.get('reward_scale', self._default_reward_scale)
+
+    # 上三角矩阵M[k, t] = (gamma*lambda)^(k-t)（k >= t），至少length阶
+    def _discount_matrix(self, length:int) -> np.ndarray:
+        if len(self._discounts) < length:
+            size = max(length, 2 * len(self._discounts))
+            exponents = np.arange(size)[:, None] - np.arange(size)[None, :]
+            self._discounts = np.where(exponents >= 0, (self.gamma * self.gae_lambda) ** np.maximum(exponents, 0), 0.0)
+        return self._discounts[:length, :length]
+
+    # 补齐的轨迹(n_trajectories, max_length)：rewards、values在轨迹结束后为0，对局结束后的价值为0
+    # 返回补齐的优势和回报
+    def advantages(self, rewards:np.ndarray, values:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        next_values = np.zeros_like(values)
+        next_values[:, :-1] = values[:, 1:]
+        deltas = rewards + self.gamma * next_values - values
+        advantages = deltas @ self._discount_matrix(values.shape[1])
+        return advantages, advantages + values
+
+    # 把一批对局拆成每个座位的轨迹并计算优势和回报
+    # 返回的样本按(对局, 座位, 时间)排列，game为对局在games中的位置，seat为座位
+    def process(self, games:Sequence[GameType]) -> BatchType:
+        n_steps = np.array([len(game['seat']) for game in games], dtype=np.int64)
+        steps = {name : np.concatenate([game[name] for game in games]) for name in self._sample_fields + ('seat',)}
+        scores = np.array([game['scores'] for game in games], dtype=np.float64).reshape(len(games), self._n_players)
+        game_ids = np.repeat(np.arange(len(games)), n_steps)
+
+        # 去掉被动决策后按(对局, 座位)稳定排序，同一条轨迹内保持时间顺序
+        trajectory_ids = game_ids * self._n_players + steps['seat']
+        decisions = np.flatnonzero(steps['mask'].sum(axis=1) > 1)
+        order = decisions[np.argsort(trajectory_ids[decisions], kind='stable')]
+        trajectory_ids = trajectory_ids[order]
+        trajectories, starts, lengths = np.unique(trajectory_ids, return_index=True, return_counts=True)
+        n_trajectories = len(trajectories)
+        rows = np.repeat(np.arange(n_trajectories), lengths)
+        columns = np.arange(len(order)) - np.repeat(starts, lengths)
+
+        max_length = int(lengths.max()) if n_trajectories > 0 else 0
+        values = np.zeros((n_trajectories, max_length))
+        values[rows, columns] = steps['value'][order]
+        final_rewards = scores[trajectories // self._n_players, trajectories % self._n_players] * self.reward_scale
+        rewards = np.zeros((n_trajectories, max_length))
+        rewards[np.arange(n_trajectories), lengths - 1] = final_rewards
+        advantages, returns = self.advantages(rewards, values)
+
+        samples = {name : steps[name][order] for name in self._sample_fields}
+        samples['reward'] = final_rewards[rows].astype(np.float32)
+        samples['advantage'] = advantages[rows, columns].astype(np.float32)
+        samples['return'] = returns[rows, columns].astype(np.float32)
+        samples['game'] = game_ids[order]
+        samples['seat'] = steps['seat'][order]
+        return samples
+
+    # 处理一批对局并整批写入样本池，返回写入的样本数（样本池丢弃时为0）
+    def save_games(self, games:Sequence[GameType], sample_pool, tag:str='') -> int:
+        samples = self.process(games)
+        n = len(samples['action'])
+        if n == 0:
+            return 0
+        saved = sample_pool.save_samples(samples, tag)
+        # 只有共享内存样本池返回是否写入
+        return 0 if saved is False else n
+
+# 逐步计算的对照实现：每个座位的轨迹从后向前递推
+def _reference_process(estimator:ChineseStandardMahjongAdvantageEstimator, games:Sequence[ChineseStandardMahjongAdvantageEstimator.GameType]) -> Dict[str, np.ndarray]:
+    advantages, returns = list(), list()
+    for game in games:
+        for seat in range(estimator._n_players):
+            steps = [i for i in range(len(game['seat'])) if game['seat'][i] == seat and game['mask'][i].sum() > 1]
+            advantage, next_value, trajectory = 0.0, 0.0, list()
+            for i, step in enumerate(reversed(steps)):
+                reward = game['scores'][seat] * estimator.reward_scale if i == 0 else 0.0
+                value = float(game['value'][step])
+                delta = reward + estimator.gamma * next_value - value
+                advantage = delta + estimator.gamma * estimator.gae_lambda * advantage
+                trajectory.append((advantage, advantage + value))
+                next_value = value
+            for advantage, return_ in reversed(trajectory):
+                advantages.append(advantage)
+                returns.append(return_)
+    return {'advantage' : np.array(advantages, dtype=np.float32), 'return' : np.array(returns, dtype=np.float32)}
+
+# 用RandomMahjongAgent进行一局游戏，记录所有决策（包括被动的Pass），价值为随机数
+def _play_random_game(seed:int) -> ChineseStandardMahjongAdvantageEstimator.GameType:
+    from random_mahjong_agent import RandomMahjongAgent
+    from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+    encoder = ChineseStandardMahjongEncoder
+    agent = RandomMahjongAgent()
+    env = ChineseStandardMahjongEnv({'seed' : seed})
+    rng = np.random.default_rng(seed)
+    steps = {'observation' : [], 'mask' : [], 'action' : [], 'seat' : []}
+    while not env.done:
+        player = env.active_player
+        action = agent.select_action(env.observation)
+        steps['observation'].append(encoder.encode_observation(env._observation, player))
+        steps['mask'].append(encoder.encode_action_mask(env.action_space))
+        steps['action'].append(env.action_id(action))
+        steps['seat'].append(player)
+        env.step(action)
+    game = {name : np.array(values) for name, values in steps.items()}
+    game['action'] = game['action'].astype(np.int16)
+    game['seat'] = game['seat'].astype(np.int64)
+    game['log_prob'] = np.log(rng.random(len(game['seat']), dtype=np.float32))
+    game['value'] = rng.standard_normal(len(game['seat']), dtype=np.float32)
+    game['scores'] = np.array(env.scores)
+    return game
+
+if __name__ == '__main__':
+    # 吞吐基准：python advantage_estimator.py [对局数] [每批对局数]
+    from ring_buffer_sample_pool import ChineseStandardMahjongRingBufferSamplePool
+
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    games_per_batch = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    games = [_play_random_game(seed) for seed in range(n_games)]
+    estimator = ChineseStandardMahjongAdvantageEstimator({'gamma' : 0.99})
+
+    samples = estimator.process(games)
+    expected = _reference_process(estimator, games)
+    assert np.allclose(samples['advantage'], expected['advantage'], atol=1e-5)
+    assert np.allclose(samples['return'], expected['return'], atol=1e-5)
+    n_samples = len(samples['action'])
+    print(f'{n_games} games, {sum(len(game["seat"]) for game in games)} steps, {n_samples} samples')
+
+    n_repeats = 5
+    start_time = time.perf_counter()
+    for _ in range(n_repeats):
+        _reference_process(estimator, games)
+    print(f'per-step loop: {n_repeats * n_samples / (time.perf_counter() - start_time):.0f} samples/s')
+
+    start_time = time.perf_counter()
+    for _ in range(n_repeats):
+        for i in range(0, n_games, games_per_batch):
+            estimator.process(games[i : i + games_per_batch])
+    print(f'vectorized, {games_per_batch} games per batch: {n_repeats * n_samples / (time.perf_counter() - start_time):.0f} samples/s')
+
+    pool = ChineseStandardMahjongRingBufferSamplePool({'size' : 1 << 16})
+    start_time = time.perf_counter()
+    for _ in range(n_repeats):
+        for i in range(0, n_games, games_per_batch):
+            estimator.save_games(games[i : i + games_per_batch], pool)
+    print(f'vectorized + ring buffer save_samples: {n_repeats * n_samples / (time.perf_counter() - start_time):.0f} samples/s')
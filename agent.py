@@ -1,3 +1,4 @@
+from typing import Any, Sequence, Union
 from abc import ABCMeta, abstractmethod  
 
 from multiagent_env import MultiAgentEnv
@@ -6,4 +7,24 @@ class Agent(metaclass=ABCMeta):
 
     @abstractmethod
     def select_action(self, obs:MultiAgentEnv.ObservationType) -> MultiAgentEnv.ActionType:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    # 批量决策：obs_batch为编码后的观测(batch, observation_size)，mask_batch为合法动作掩码(batch, n_actions)，返回每个决策的动作编号
+    # 默认逐个调用select_action，此时需要通过observations给出每个决策对应的原始观测
+    def select_actions(self, obs_batch:Any, mask_batch:Any, observations:Union[Sequence[MultiAgentEnv.ObservationType], None]=None) -> Any:
+        if observations is None:
+            raise NotImplementedError(f'{type(self).__name__} has no batched select_actions, pass observations to fall back to select_action')
+        # 在第一次批量决策时才导入，缩短Botzone首回合的启动时间
+        import numpy as np
+        from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+        return np.array([ChineseStandardMahjongEnv.action_id(self.select_action(obs)) for obs in observations], dtype=np.int64)
+
+# 支持随时停止的agent（如搜索类agent），在deadline（time.perf_counter()的时刻）之前返回当前最优的动作
+class AnytimeAgent(Agent):
+
+    @abstractmethod
+    def select_action_before(self, obs:MultiAgentEnv.ObservationType, deadline:float) -> MultiAgentEnv.ActionType:
+        raise NotImplementedError
+
+    def select_action(self, obs:MultiAgentEnv.ObservationType) -> MultiAgentEnv.ActionType:
+        return self.select_action_before(obs, float('inf'))
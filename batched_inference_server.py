@@ -0,0 +1,357 @@
+import sys
+import time
+import threading
+import multiprocessing
+from collections import deque
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from agent import Agent
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+
+# 集中的批量推理服务：多个环境（线程或actor进程）的决策请求合并为一次前向计算
+# 每个客户端在共享数组中有一个槽位：写入观测编码和合法动作掩码后标记为待处理，并释放请求信号量
+# 服务线程等到第一个请求后继续收集，直到凑满max_batch_size或等待超过max_wait秒，再对所有待处理的槽位做一次前向计算，
+# 把(动作编号, log概率, 价值)写回各自的槽位，释放每个客户端自己的信号量
+# 服务在创建它的进程中以线程运行，客户端对象可以作为参数传给actor进程
+class ChineseStandardMahjongInferenceServer:
+
+    _default_n_clients = 64
+    _default_max_batch_size = 64
+    _default_max_wait = 0.002
+    _default_refresh_interval = 1.0
+    # 保留的最近请求的排队延迟个数
+    _n_latency_records = 1 << 16
+
+    def __init__(self, network:torch.nn.Module, config:Union[Dict, None]=None):
+        self.config = dict() if config is None else config
+        self.network = network.eval()
+        encoder = ChineseStandardMahjongEncoder
+        context = multiprocessing.get_context(self.start_method)
+        n = self.n_clients
+        self._shared = {
+            'observation' : context.RawArray('B', n * encoder.observation_size),
+            'mask' : context.RawArray('B', n * encoder.n_actions),
+            # 0：空闲，1：待处理
+            'pending' : context.RawArray('b', n),
+            # 提交请求的时刻（time.monotonic，各进程一致）
+            'request_time' : context.RawArray('d', n),
+            # 动作编号、log概率、价值
+            'result' : context.RawArray('d', n * 3)
+        }
+        self._request_semaphore = context.Semaphore(0)
+        self._response_semaphores = [context.Semaphore(0) for _ in range(n)]
+        self._arrays = _map_arrays(self._shared, n)
+        self._network_lock = threading.Lock()
+        self._thread = None
+        self._stop = False
+        self._n_batches = 0
+        self._n_requests = 0
+        self._batch_sizes = np.zeros(self.max_batch_size + 1, dtype=np.int64)
+        self._latencies = deque(maxlen=self._n_latency_records)
+        self._model_pool = None
+        self._model_version = None
+        self._refresh_time = 0.0
+        # 记录每批大小和前向计算耗时的MetricsSink，为None时不记录
+        self.metrics = None
+
+    # 最多的客户端数
+    @property
+    def n_clients(self) -> int:
+        return self.config.get('n_clients', self._default_n_clients)
+
+    # 一次前向计算的最大批量
+    @property
+    def max_batch_size(self) -> int:
+        return self.config.get('max_batch_size', self._default_max_batch_size)
+
+    # 收到第一个请求后最多再等待多久（秒）收集更多请求
+    @property
+    def max_wait(self) -> float:
+        return self.config.get('max_wait', self._default_max_wait)
+
+    # 是否选择概率最大的动作，否则按策略采样
+    @property
+    def greedy(self) -> bool:
+        return self.config.get('greedy', False)
+
+    # 客户端进程的启动方式，信号量需要在同一方式下创建
+    @property
+    def start_method(self) -> Union[str, None]:
+        return self.config.get('start_method', None)
+
+    # 给出ChineseStandardMahjongModelPool的配置时，每隔refresh_interval秒切换到模型池中最新的模型
+    @property
+    def model_pool_config(self) -> Union[Dict, None]:
+        return self.config.get('model_pool', None)
+
+    @property
+    def refresh_interval(self) -> float:
+        return self.config.get('refresh_interval', self._default_refresh_interval)
+
+    # 第client_id个客户端，每个客户端同时只能有一个请求，不同的环境应使用不同的客户端
+    def client(self, client_id:int) -> 'ChineseStandardMahjongInferenceClient':
+        assert 0 <= client_id < self.n_clients
+        return ChineseStandardMahjongInferenceClient(
+            client_id, self.n_clients, self._shared, self._request_semaphore, self._response_semaphores[client_id]
+        )
+
+    # 替换网络参数，在两次前向计算之间生效
+    def load_state_dict(self, state_dict:Dict[str, torch.Tensor]):
+        with self._network_lock:
+            self.network.load_state_dict(state_dict)
+
+    def _refresh_model(self):
+        now = time.monotonic()
+        if self.model_pool_config is None or now - self._refresh_time < self.refresh_interval:
+            return
+        self._refresh_time = now
+        if self._model_pool is None:
+            from folder_model_pool import ChineseStandardMahjongModelPool
+            self._model_pool = ChineseStandardMahjongModelPool(self.model_pool_config)
+        self._model_pool.refresh()
+        versions = self._model_pool.versions
+        if versions and versions[-1] != self._model_version:
+            self.load_state_dict(self._model_pool.load_model(versions[-1]))
+            self._model_version = versions[-1]
+
+    # 在后台线程中运行服务
+    def start(self):
+        if self._thread is None:
+            self._stop = False
+            self._refresh_model()
+            self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop = True
+            # 唤醒等待请求的服务线程
+            self._request_semaphore.release()
+            self._thread.join()
+            self._thread = None
+        if self._model_pool is not None:
+            self._model_pool.close()
+            self._model_pool = None
+
+    def serve_forever(self):
+        arrays = self._arrays
+        while not self._stop:
+            # 等待第一个请求，之后在max_wait内收集更多请求
+            if not self._request_semaphore.acquire(timeout=self.refresh_interval):
+                self._refresh_model()
+                continue
+            n_acquired = 1
+            deadline = time.monotonic() + self.max_wait
+            while n_acquired < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                # stop释放的信号量也会结束收集
+                if remaining <= 0 or not self._request_semaphore.acquire(timeout=remaining) or self._stop:
+                    break
+                n_acquired += 1
+            if self._stop:
+                break
+            client_ids = np.flatnonzero(arrays['pending'])[:self.max_batch_size]
+            # 上一次停止时残留的信号量
+            if len(client_ids) == 0:
+                continue
+            # 已标记待处理但还没释放信号量的请求也在这一批中处理，补上对应的信号量
+            for _ in range(len(client_ids) - n_acquired):
+                self._request_semaphore.acquire()
+            self._serve(client_ids)
+            self._refresh_model()
+        self._drain()
+
+    # 停止前处理所有已提交的请求，否则这些客户端会一直等待响应；之后取回剩余的请求信号量
+    # 停止之后才提交的请求不会被处理
+    def _drain(self):
+        while True:
+            client_ids = np.flatnonzero(self._arrays['pending'])[:self.max_batch_size]
+            if len(client_ids) == 0:
+                break
+            self._serve(client_ids)
+        while self._request_semaphore.acquire(block=False):
+            pass
+
+    # 对一批客户端的请求做一次前向计算并返回结果
+    def _serve(self, client_ids:np.ndarray):
+        arrays = self._arrays
+        start_time = time.monotonic()
+        observations = torch.from_numpy(arrays['observation'][client_ids])
+        masks = torch.from_numpy(arrays['mask'][client_ids].view(np.bool_))
+        with self._network_lock, torch.no_grad():
+            logits, values = self.network(observations, masks)
+            log_probs = F.log_softmax(logits, dim=-1)
+            if self.greedy:
+                actions = log_probs.argmax(dim=-1)
+            else:
+                actions = torch.multinomial(log_probs.exp(), 1).squeeze(1)
+            selected_log_probs = log_probs.gather(1, actions[:, None]).squeeze(1)
+        results = arrays['result']
+        results[client_ids, 0] = actions.numpy()
+        results[client_ids, 1] = selected_log_probs.numpy()
+        results[client_ids, 2] = values.numpy()
+        self._latencies.extend((start_time - arrays['request_time'][client_ids]).tolist())
+        arrays['pending'][client_ids] = 0
+        for client_id in client_ids.tolist():
+            self._response_semaphores[client_id].release()
+        self._n_batches += 1
+        self._n_requests += len(client_ids)
+        self._batch_sizes[len(client_ids)] += 1
+        if self.metrics is not None:
+            self.metrics.record('inference_batch_size', len(client_ids))
+            self.metrics.record('inference_seconds', time.monotonic() - start_time)
+
+    # 批量大小和排队延迟（从提交请求到开始前向计算，毫秒）的统计
+    def stats(self) -> Dict[str, float]:
+        sizes = np.arange(len(self._batch_sizes))
+        n_batches = max(self._n_batches, 1)
+        cumulative = np.cumsum(self._batch_sizes) / n_batches
+        latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+        return {
+            'n_batches' : self._n_batches,
+            'n_requests' : self._n_requests,
+            'mean_batch_size' : self._n_requests / n_batches,
+            'median_batch_size' : int(sizes[np.searchsorted(cumulative, 0.5)]) if self._n_batches else 0,
+            'max_batch_size' : int(sizes[self._batch_sizes > 0].max()) if self._n_batches else 0,
+            'mean_queue_latency_ms' : float(latencies.mean()),
+            'p50_queue_latency_ms' : float(np.percentile(latencies, 50)),
+            'p99_queue_latency_ms' : float(np.percentile(latencies, 99))
+        }
+
+def _map_arrays(shared:Dict[str, Any], n_clients:int) -> Dict[str, np.ndarray]:
+    encoder = ChineseStandardMahjongEncoder
+    return {
+        'observation' : np.frombuffer(shared['observation'], dtype=encoder.observation_dtype).reshape(n_clients, encoder.observation_size),
+        'mask' : np.frombuffer(shared['mask'], dtype=np.uint8).reshape(n_clients, encoder.n_actions),
+        'pending' : np.frombuffer(shared['pending'], dtype=np.int8),
+        'request_time' : np.frombuffer(shared['request_time'], dtype=np.float64),
+        'result' : np.frombuffer(shared['result'], dtype=np.float64).reshape(n_clients, 3)
+    }
+
+# 推理服务的客户端：可以在线程中使用，也可以作为参数传给actor进程
+class ChineseStandardMahjongInferenceClient:
+
+    def __init__(self, client_id:int, n_clients:int, shared:Dict[str, Any], request_semaphore:Any, response_semaphore:Any):
+        self.client_id = client_id
+        self._n_clients = n_clients
+        self._shared = shared
+        self._request_semaphore = request_semaphore
+        self._response_semaphore = response_semaphore
+        self._arrays = _map_arrays(shared, n_clients)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        del state['_arrays']
+        return state
+
+    def __setstate__(self, state:Dict):
+        self.__dict__.update(state)
+        self._arrays = _map_arrays(self._shared, self._n_clients)
+
+    # 提交一个决策请求并等待结果，返回(动作编号, log概率, 价值)
+    def infer(self, observation:np.ndarray, mask:np.ndarray) -> Tuple[int, float, float]:
+        arrays, i = self._arrays, self.client_id
+        arrays['observation'][i] = observation
+        arrays['mask'][i] = mask
+        arrays['request_time'][i] = time.monotonic()
+        arrays['pending'][i] = 1
+        self._request_semaphore.release()
+        self._response_semaphore.acquire()
+        action, log_prob, value = arrays['result'][i].tolist()
+        return int(action), log_prob, value
+
+# 通过推理服务决策的agent，可以直接替换现有对局循环中的agent
+# 环境的观测不包含座位，编码观测需要知道agent所在的座位player
+class BatchedInferenceMahjongAgent(Agent):
+
+    def __init__(self, client:ChineseStandardMahjongInferenceClient, player:int):
+        super().__init__()
+        self.client = client
+        self.player = player
+
+    def select_action(self, obs:ChineseStandardMahjongEnv.ObservationType) -> ChineseStandardMahjongEnv.ActionNameType:
+        encoder = ChineseStandardMahjongEncoder
+        action_space = obs['action_space']
+        if len(action_space) == 1:
+            return action_space[0]
+        action, _, _ = self.client.infer(encoder.encode_observation(obs, self.player), encoder.encode_action_mask(action_space))
+        return ChineseStandardMahjongEnv.action_name(action)
+
+# 用agents进行对局直到deadline，返回网络决策数
+def _play_until(agents:List[Agent], deadline:float, counter:Union[Any, None]=None) -> int:
+    n_decisions = 0
+    while time.time() < deadline:
+        env = ChineseStandardMahjongEnv({})
+        while not env.done:
+            obs = env.observation
+            n_decisions += len(obs['action_space']) > 1
+            env.step(agents[env.active_player].select_action(obs))
+    if counter is not None:
+        with counter.get_lock():
+            counter.value += n_decisions
+    return n_decisions
+
+# 逐个决策的对照：每个进程有自己的网络，批量为1
+class _LocalNetworkAgent(Agent):
+
+    def __init__(self, network:torch.nn.Module, player:int):
+        super().__init__()
+        self.network = network
+        self.player = player
+
+    def select_action(self, obs:ChineseStandardMahjongEnv.ObservationType) -> ChineseStandardMahjongEnv.ActionNameType:
+        from ppo_trainer import ChineseStandardMahjongPPOTrainer
+        encoder = ChineseStandardMahjongEncoder
+        action_space = obs['action_space']
+        if len(action_space) == 1:
+            return action_space[0]
+        action, _, _ = ChineseStandardMahjongPPOTrainer._select_action(self.network, encoder.encode_observation(obs, self.player), encoder.encode_action_mask(action_space))
+        return ChineseStandardMahjongEnv.action_name(action)
+
+def _server_actor(clients:List[ChineseStandardMahjongInferenceClient], deadline:float, counter:Any):
+    torch.set_num_threads(1)
+    _play_until([BatchedInferenceMahjongAgent(client, player) for player, client in enumerate(clients)], deadline, counter)
+
+def _local_actor(network:torch.nn.Module, deadline:float, counter:Any):
+    torch.set_num_threads(1)
+    _play_until([_LocalNetworkAgent(network, player) for player in range(ChineseStandardMahjongEnv._n_players)], deadline, counter)
+
+if __name__ == '__main__':
+    # 吞吐基准：python batched_inference_server.py [actor进程数] [运行秒数]
+    from chinese_standard_mahjong_model import ChineseStandardMahjongPolicyNetwork
+
+    n_actors = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10.0
+    n_players = ChineseStandardMahjongEnv._n_players
+    network = ChineseStandardMahjongPolicyNetwork()
+
+    counter = multiprocessing.Value('q', 0)
+    deadline = time.time() + duration
+    actors = [multiprocessing.Process(target=_local_actor, args=(network, deadline, counter)) for _ in range(n_actors)]
+    for actor in actors:
+        actor.start()
+    for actor in actors:
+        actor.join()
+    print(f'{n_actors} actors, local batch-1 inference: {counter.value / duration:.0f} decisions/s')
+
+    server = ChineseStandardMahjongInferenceServer(network, {'n_clients' : n_actors * n_players})
+    server.start()
+    counter = multiprocessing.Value('q', 0)
+    deadline = time.time() + duration
+    actors = [
+        multiprocessing.Process(target=_server_actor, args=([server.client(i * n_players + player) for player in range(n_players)], deadline, counter))
+        for i in range(n_actors)
+    ]
+    for actor in actors:
+        actor.start()
+    for actor in actors:
+        actor.join()
+    server.stop()
+    print(f'{n_actors} actors, batched inference server: {counter.value / duration:.0f} decisions/s')
+    for name, value in server.stats().items():
+        print(f'{name}: {value:.3f}' if isinstance(value, float) else f'{name}: {value}')
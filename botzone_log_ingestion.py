@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import zlib
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+import numpy as np
+
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+from chinese_standard_mahjong_botzone_adapter import ChineseStandardMahjongBotzoneAdapter
+
+# 将Botzone的Chinese-Standard-Mahjong对局记录离线转换为训练样本
+# 对局记录为Botzone导出的json格式，.json文件为单局，其余文件每行一局：
+# {"log": [裁判输出, 玩家回应, 裁判输出, 玩家回应, ...]}
+# 裁判输出形如 {"output": {"content": {"0": request, "1": request, ...}}}，玩家回应形如 {"0": {"response": response}, ...}
+# 对每个座位，逐行复用ChineseStandardMahjongBotzoneAdapter加载request，将该座位的response作为所选动作
+class BotzoneLogIngestion:
+
+    # 对局记录类型
+    MatchType = Dict[str, Any]
+    # 决策点：(观测编码, 合法动作掩码, 动作编号, Botzone座位号)
+    DecisionType = Tuple[np.ndarray, np.ndarray, int, int]
+
+    _default_output_path = './botzone_samples'
+    _index_file_name = 'index.json'
+    _shard_file_name_format = '{name}.npz'
+
+    def __init__(self, config:Dict):
+        self.config = config
+
+    # 输出样本分片和进度索引的目录
+    @property
+    def output_path(self) -> str:
+        return self.config.get('output_path', self._default_output_path)
+
+    # 并行处理文件的进程数
+    @property
+    def n_processes(self) -> int:
+        return self.config.get('n_processes', os.cpu_count())
+
+    # 是否跳过只有一个合法动作的决策点（如只能Pass）
+    @property
+    def skip_forced(self) -> bool:
+        return self.config.get('skip_forced', True)
+
+    # 惰性读取对局记录：.json文件为单局，其余文件每行一局
+    @staticmethod
+    def iterate_matches(path:str) -> Iterator[MatchType]:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.json'):
+                yield json.load(f)
+                return
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    # 从一局对局记录中重建每个座位的决策点
+    @classmethod
+    def extract_decisions(cls, match:MatchType, skip_forced:bool=True) -> Iterator[DecisionType]:
+        log = match['log']
+        encoder = ChineseStandardMahjongEncoder
+        for seat in range(ChineseStandardMahjongEnv._n_players):
+            adapter = ChineseStandardMahjongBotzoneAdapter()
+            for i in range(0, len(log) - 1, 2):
+                request = log[i].get('output', dict()).get('content', dict()).get(str(seat))
+                response = log[i+1].get(str(seat), dict()).get('response')
+                if request is None or response is None:
+                    continue
+                adapter._load_botzone_request_line(request)
+                # 确定风圈、发初始手牌不需要决策
+                if request.startswith('0') or request.startswith('1'):
+                    continue
+                adapter._update_action_space_and_fan()
+                action, play_action = adapter._parse_botzone_response(response)
+                states = [(adapter, action)]
+                if play_action is not None:
+                    states.append((adapter._simulate_chi_or_peng(action), play_action))
+                for state, a in states:
+                    # 记录中的动作不合法，说明该座位的回应出错，Botzone会判负，后续记录不可信
+                    if a not in state.action_space:
+                        raise ValueError(f'illegal action {a} for seat {seat} in action space {state.action_space}')
+                    if skip_forced and len(state.action_space) == 1:
+                        continue
+                    yield (
+                        encoder.encode_observation(state._observation_view, state._my_id),
+                        encoder.encode_action_mask(state.action_space),
+                        encoder.encode_action(a),
+                        seat
+                    )
+
+    # 处理一个对局记录文件，写出一个样本分片，返回该文件的统计信息
+    @classmethod
+    def _process_file(cls, args:Tuple[str, str, bool]) -> Tuple[str, Dict[str, Any]]:
+        path, output_path, skip_forced = args
+        encoder = ChineseStandardMahjongEncoder
+        observations, masks, actions, seats, match_ids = list(), list(), list(), list(), list()
+        n_matches, n_errors = 0, 0
+        for match_id, match in enumerate(cls.iterate_matches(path)):
+            n_matches += 1
+            # 一局出错则丢弃该局全部决策点
+            try:
+                decisions = list(cls.extract_decisions(match, skip_forced))
+            except (ValueError, KeyError, IndexError, AssertionError, TypeError):
+                n_errors += 1
+                continue
+            for obs, mask, action, seat in decisions:
+                observations.append(obs)
+                masks.append(mask)
+                actions.append(action)
+                seats.append(seat)
+                match_ids.append(match_id)
+
+        name = os.path.splitext(os.path.basename(path))[0] + f'_{zlib.crc32(path.encode()):08x}'
+        shard_file_name = cls._shard_file_name_format.format(name=name)
+        shard_path = os.path.join(output_path, shard_file_name)
+        # 先写临时文件再重命名，中断时不会留下不完整的分片
+        tmp_path = shard_path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            observations=np.array(observations, dtype=encoder.observation_dtype).reshape(-1, encoder.observation_size),
+            masks=np.array(masks, dtype=np.bool_).reshape(-1, encoder.n_actions),
+            actions=np.array(actions, dtype=np.int16),
+            seats=np.array(seats, dtype=np.int8),
+            match_ids=np.array(match_ids, dtype=np.int32)
+        )
+        os.replace(tmp_path, shard_path)
+        return path, {
+            'shard' : shard_file_name,
+            'n_matches' : n_matches,
+            'n_errors' : n_errors,
+            'n_decisions' : len(actions)
+        }
+
+    # 读取进度索引：已处理的文件 -> 统计信息
+    def load_index(self) -> Dict[str, Dict[str, Any]]:
+        index_path = os.path.join(self.output_path, self._index_file_name)
+        if not os.path.exists(index_path):
+            return dict()
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    # 原子地写入进度索引
+    def _save_index(self, index:Dict[str, Dict[str, Any]]):
+        index_path = os.path.join(self.output_path, self._index_file_name)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+
+    # 多进程处理所有文件，已在索引中的文件会被跳过，因此中断后可以直接重新运行
+    def run(self, paths:Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        os.makedirs(self.output_path, exist_ok=True)
+        index = self.load_index()
+        todo = [path for path in map(os.path.abspath, paths) if path not in index]
+        args = ((path, self.output_path, self.skip_forced) for path in todo)
+        start_time = time.time()
+        n_decisions = 0
+        with Pool(self.n_processes) as pool:
+            for path, info in pool.imap_unordered(self._process_file, args):
+                index[path] = info
+                self._save_index(index)
+                n_decisions += info['n_decisions']
+        elapsed = time.time() - start_time
+        print(f'{len(todo)} files, {n_decisions} decisions, {n_decisions / max(elapsed, 1e-9) * 3600:.0f} decisions/hour', file=sys.stderr)
+        return index
+
+    # 依次读出所有样本分片
+    def load_shards(self) -> Iterator[Dict[str, np.ndarray]]:
+        for info in self.load_index().values():
+            with np.load(os.path.join(self.output_path, info['shard'])) as shard:
+                yield dict(shard)
+
+if __name__ == '__main__':
+    # python botzone_log_ingestion.py output_path log_file_1 log_file_2 ...
+    ingestion = BotzoneLogIngestion({'output_path' : sys.argv[1]})
+    ingestion.run(sys.argv[2:])
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import threading
+import importlib
+import subprocess
+from typing import Any, Callable, List
+
+# 在进程阻塞等待request时，于后台线程中预先导入重型模块、加载模型参数
+class BackgroundPreloader:
+
+    def __init__(self):
+        self._threads = dict()
+        self._results = dict()
+        self._errors = dict()
+
+    # 在后台线程中执行fn，结果通过get(name)取得
+    def submit(self, name:str, fn:Callable[[], Any]) -> None:
+        def run():
+            try:
+                self._results[name] = fn()
+            except Exception as e:
+                self._errors[name] = e
+        thread = threading.Thread(target=run, name=f'preload-{name}', daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+    # 后台导入模块
+    def preload_modules(self, *module_names:str) -> None:
+        for module_name in module_names:
+            self.submit(module_name, lambda module_name=module_name : importlib.import_module(module_name))
+
+    # 后台加载torch.save保存的模型参数
+    def preload_state_dict(self, name:str, path:str) -> None:
+        def load():
+            import torch
+            return torch.load(path, map_location='cpu')
+        self.submit(name, load)
+
+    # 等待后台任务完成并返回结果，后台任务的异常在这里抛出
+    def get(self, name:str, timeout:float=None) -> Any:
+        self._threads[name].join(timeout)
+        if name in self._errors:
+            raise self._errors[name]
+        return self._results[name]
+
+# 在新的解释器中导入entry_modules所需的时间
+def _measure_import_time(entry_modules:List[str], n_repeats:int) -> float:
+    code = f'import {", ".join(entry_modules)}'
+    times = list()
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start_time)
+    return sorted(times)[len(times) // 2]
+
+# 启动__main__.py到返回首回合response所需的时间
+def _measure_first_response_time(n_repeats:int) -> float:
+    times = list()
+    for _ in range(n_repeats):
+        start_time = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, '-u', '__main__.py'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        process.stdin.write('1\n0 0 0\n')
+        process.stdin.flush()
+        while process.stdout.readline().strip() != '>>>BOTZONE_REQUEST_KEEP_RUNNING<<<':
+            pass
+        times.append(time.perf_counter() - start_time)
+        process.kill()
+        process.wait()
+    return sorted(times)[len(times) // 2]
+
+if __name__ == '__main__':
+    # 导入时间基准：python botzone_preloader.py [重复次数]
+    n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    entry_modules = ['random_mahjong_agent', 'chinese_standard_mahjong_botzone_adapter']
+    results = {
+        'interpreter' : _measure_import_time(['sys'], n_repeats),
+        'entry_modules' : _measure_import_time(entry_modules, n_repeats),
+        # 等价于之前在导入时就加载numpy和算番库
+        'entry_modules_eager' : _measure_import_time(entry_modules + ['numpy', 'MahjongGB'], n_repeats),
+        'first_response' : _measure_first_response_time(n_repeats)
+    }
+    for name, seconds in results.items():
+        print(f'{name}: {seconds * 1000:.1f}ms')
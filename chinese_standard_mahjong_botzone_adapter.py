@@ -1,22 +1,72 @@
 import re
 import sys
+import time
 from copy import deepcopy
-from typing import List, Tuple, Counter, Iterable, Callable
+from typing import Dict, List, Tuple, Counter, Iterable, Callable, Union
 from collections import Counter
 
-from agent import Agent
+from agent import Agent, AnytimeAgent
 from botzone_adapter import BotzoneAdapter
 from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
 
 # 适配Botzone简单交互长时运行模式，交互格式参考https://wiki.botzone.org.cn/index.php?title=Chinese-Standard-Mahjong
+# 每回合的计时：从读到request开始计时，扣除安全余量后作为agent的deadline，时间不足时改用fallback_agent快速决策
 class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
 
-    def __init__(self):
+    # Botzone长时运行模式下每回合的时限（秒）
+    _default_time_limit = 1.0
+    # 首回合包含解释器启动，时限更长
+    _default_first_turn_time_limit = 6.0
+    # 为输出和评测机开销预留的时间
+    _default_safety_margin = 0.1
+    # deadline前剩余时间少于此值时改用fallback_agent
+    _default_fallback_threshold = 0.05
+
+    # 内置环境的配置
+    _env_config = {
+        'cards' : ChineseStandardMahjongEnv._card_names * ChineseStandardMahjongEnv._n_duplicate_cards,
+        'prevalent_wind' : 1
+    }
+
+    def __init__(self, config:Union[Dict, None]=None):
+        self.config = dict() if config is None else config
+        # 时间不足时使用的快速策略，未指定时在第一次用到时才创建
+        self._fallback_agent = self.config.get('fallback_agent', None)
         self.reset()
+
+    @property
+    def time_limit(self) -> float:
+        return self.config.get('time_limit', self._default_time_limit)
+
+    @property
+    def first_turn_time_limit(self) -> float:
+        return self.config.get('first_turn_time_limit', self._default_first_turn_time_limit)
+
+    @property
+    def safety_margin(self) -> float:
+        return self.config.get('safety_margin', self._default_safety_margin)
+
+    @property
+    def fallback_threshold(self) -> float:
+        return self.config.get('fallback_threshold', self._default_fallback_threshold)
+
+    # 是否将每回合的计时输出到sys.stderr
+    @property
+    def log_timing(self) -> bool:
+        return self.config.get('log_timing', False)
     
+    # 开始新的一局：重置内置环境和每局的状态，包括回合计时
     def reset(self):
-        # 内置环境
-        self._env = ChineseStandardMahjongEnv(config=dict())
+        # 本局已经处理的回合数，第一回合使用first_turn_time_limit
+        self._n_turns = 0
+        # 当前回合的deadline
+        self._deadline = float('inf')
+        # 当前回合是否使用了fallback_agent
+        self._used_fallback = False
+        # 上一回合的计时信息
+        self.last_turn_timing = None
+        # 内置环境，牌墙和风向之后由request覆盖，这里使用固定的牌墙和风向以免随机初始化
+        self._env = ChineseStandardMahjongEnv(config=self._env_config)
         # 我方的id，按照ChineseStandardMahjongEnv的表示
         self._my_id = None
         # 我方的门风，按照Botzone的表示方式
@@ -37,7 +87,12 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
     # 返回我方观测信息，同ChineseStandardMahjongEnv中的observation
     @property
     def observation(self) -> ChineseStandardMahjongEnv.ObservationType:
-        return deepcopy({
+        return deepcopy(self._observation_view)
+
+    # 不复制的我方观测信息，仅供只读的编码等场景使用
+    @property
+    def _observation_view(self) -> ChineseStandardMahjongEnv.ObservationType:
+        return {
             # 圈风
             'prevalent_wind' : self._env.prevalent_wind,
             # 门风
@@ -56,8 +111,8 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
             'action_space' : self.action_space,
             # 自己的手牌
             'hand_card' : self._env._hand_card_counters[self._my_id],
-            # 每个玩家的手牌数目
-            'n_hand_cards' : tuple(self._n_hand_cards),
+            # 每个玩家的手牌数目，同ChineseStandardMahjongEnv，不计入刚摸到、尚未打出的牌
+            'n_hand_cards' : self._n_hand_cards_without_drawn_card,
             # 每个玩家的副露
             'shown_packs' : self._env._shown_packs,
             # 我方暗杠
@@ -70,8 +125,15 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
             'current_card' : self._env._current_card,
             # 当前待决策的牌的来源，如果为None则为环境发牌
             'current_card_from' : self._env._current_card_from
-        })
+        }
     
+    # 各方手牌数目，摸牌后待决策时不计入摸到的牌
+    @property
+    def _n_hand_cards_without_drawn_card(self) -> Tuple[int]:
+        if self._env._current_card is None or self._env._current_card_from is not None:
+            return tuple(self._n_hand_cards)
+        return tuple(n - (i == self._env._active_player) for i, n in enumerate(self._n_hand_cards))
+
     # 更新动作空间和成番情况
     def _update_action_space_and_fan(self):
         
@@ -286,8 +348,8 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
             if action_type == 'GANG':
                 self._env._is_about_kong = True
                 self._env._active_player = player
-                # 如果杠的上一回合是从环境摸牌，那么就是暗杠
-                if self._env._current_card_from is None and self._env._current_card is not None:
+                # 如果杠的上一回合是从环境摸牌，那么就是暗杠（别人摸的牌我方不知道，current_card为None）
+                if self._env._current_card_from is None:
                     # 如果是我的暗杠，需要从self._last_anganged_card读取暗杠的是哪一张牌
                     if player == self._my_id:
                         self._env._add_hidden_pack(f'AnGang{self._last_anganged_card}')
@@ -298,8 +360,8 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
                     
                     # 暗杠个数增加
                     self._n_hidden_packs[player] += 1
-                    # 修改手牌数目：摸进1张，杠掉4张
-                    self._n_hand_cards[player] -= self._env._gang_tile_length - 1
+                    # 修改手牌数目：摸牌时已经计入摸到的牌，杠掉4张
+                    self._n_hand_cards[player] -= self._env._gang_tile_length
                     self._env._set_current_card_and_source(None, None)
                     self._is_my_gang = True
 
@@ -330,7 +392,7 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
                     self._add_to_my_hand_card_counter(self._env._current_card)
                     self._is_my_gang = True
                 
-                self._n_hand_cards[player] += 1
+                # 手牌数目不变：摸牌时已经计入摸到的牌，补杠成功后再减去补杠的牌
                 self._env._unprocessed_actions.clear()
                 self._env._unprocessed_actions.append(f'BuGang{buganged_card}')
                 self._env._set_current_card_and_source(buganged_card, player)
@@ -340,29 +402,72 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
     def load_botzone_request_and_generate_response(self, agent:Agent, request_loader:Callable) -> None:
         
         while True:
-            request = request_loader().strip()
-            if not request or len(request.split()) == 1:
+            response = self.process_request(agent, request_loader())
+            if response is None:
                 continue
-
-            # 确定风圈、发初始手牌
-            if request.startswith('0') or request.startswith('1'):
-                self._load_botzone_request_line(request)
-                print('PASS')
-            
-            # 行牌过程request
-            else:
-                self._load_botzone_request_line(request)
-                self._update_action_space_and_fan()
-                print(self._generate_botzone_response(agent))
-            
+            print(response)
             # Botzone长时运行标记
             print('>>>BOTZONE_REQUEST_KEEP_RUNNING<<<')
             sys.stdout.flush()
+
+    # 处理一行request，返回对应的response；对于不需要回应的行（空行、首回合的回合数）返回None
+    # turn_start为本回合开始计时的时刻（time.perf_counter()），默认为调用时刻
+    def process_request(self, agent:Agent, request:str, turn_start:Union[float, None]=None) -> Union[str, None]:
+        turn_start = time.perf_counter() if turn_start is None else turn_start
+        request = request.strip()
+        if not request or len(request.split()) == 1:
+            return None
+
+        time_limit = self.first_turn_time_limit if self._n_turns == 0 else self.time_limit
+        self._deadline = turn_start + time_limit - self.safety_margin
+        self._n_turns += 1
+        self._used_fallback = False
+
+        # 确定风圈、发初始手牌
+        if request.startswith('0') or request.startswith('1'):
+            self._load_botzone_request_line(request)
+            response = 'PASS'
+            parse_end = decide_end = time.perf_counter()
+        
+        # 行牌过程request
+        else:
+            self._load_botzone_request_line(request)
+            self._update_action_space_and_fan()
+            parse_end = time.perf_counter()
+            response = self._generate_botzone_response(agent)
+            decide_end = time.perf_counter()
+
+        self.last_turn_timing = {
+            'turn' : self._n_turns,
+            'parse' : parse_end - turn_start,
+            'decide' : decide_end - parse_end,
+            'total' : decide_end - turn_start,
+            'remaining' : turn_start + time_limit - decide_end,
+            'fallback' : self._used_fallback
+        }
+        if self.log_timing:
+            print(
+                'turn {turn}: parse {parse:.6f}s, decide {decide:.6f}s, total {total:.6f}s, remaining {remaining:.6f}s, fallback {fallback}'.format(**self.last_turn_timing),
+                file=sys.stderr
+            )
+        return response
+
+    # 根据剩余时间选择动作：时间充足时支持deadline的agent可以用满时间，时间不足时改用fallback_agent
+    def _select_action(self, agent:Agent, obs:ChineseStandardMahjongEnv.ObservationType) -> ChineseStandardMahjongEnv.ActionNameType:
+        if self._deadline - time.perf_counter() < self.fallback_threshold:
+            self._used_fallback = True
+            if self._fallback_agent is None:
+                from random_mahjong_agent import RandomMahjongAgent
+                self._fallback_agent = RandomMahjongAgent()
+            return self._fallback_agent.select_action(obs)
+        if isinstance(agent, AnytimeAgent):
+            return agent.select_action_before(obs, self._deadline)
+        return agent.select_action(obs)
         
     # 如果动作选择了暗杠，会将动作记录在self._last_anganged_card中，以备后续加载状态
     def _generate_botzone_response(self, agent:Agent) -> str:
 
-        action = agent.select_action(self.observation)
+        action = self._select_action(agent, self.observation)
 
         action_type, card = self._env.action_to_tuple(action)
 
@@ -383,36 +488,75 @@ class ChineseStandardMahjongBotzoneAdapter(BotzoneAdapter):
             return f'BUGANG {card}'
         
         if action_type == 'Chi':
-            # 复制一份环境，假装吃牌成功了
-            new_adapter = deepcopy(self)
-            new_adapter._env._active_player = self._my_id
-            new_adapter._env._add_shown_pack(action, card_from=new_adapter._env._current_card_from)
-            # 修改手牌
-            new_adapter._add_to_my_hand_card_counter(new_adapter._env._current_card)
-            for i in range(-1, -1+new_adapter._env._chi_tile_length):
-                new_adapter._add_to_my_hand_card_counter(new_adapter._env.card_name(new_adapter._env.card_id(card)+i), -1)
-            new_adapter._env._set_current_card_and_source(None, None)
-            new_adapter._n_hand_cards[new_adapter._my_id] -= new_adapter._env._chi_tile_length - 1
-            new_adapter._env._unprocessed_actions.clear()
-            new_adapter._update_action_space_and_fan()
-            # 生成新的observation再调用agent决策吃完打什么牌
-            play_action = agent.select_action(new_adapter.observation)
+            # 假装吃牌成功了，生成新的observation再调用agent决策吃完打什么牌
+            new_adapter = self._simulate_chi_or_peng(action)
+            play_action = self._select_action(agent, new_adapter.observation)
             play, played_card = new_adapter._env.action_to_tuple(play_action)
             assert play == 'Play'
             return f'CHI {card} {played_card}'
         
         if action_type == 'Peng':
-            # 复制一份环境，假装碰牌成功了
-            new_adapter = deepcopy(self)
-            new_adapter._env._active_player = self._my_id
-            new_adapter._env._add_shown_pack(action, card_from=new_adapter._env._current_card_from)
-            new_adapter._add_to_my_hand_card_counter(new_adapter._env._current_card, 1-new_adapter._env._peng_tile_length)
-            new_adapter._env._set_current_card_and_source(None, None)
-            new_adapter._n_hand_cards[new_adapter._my_id] -= new_adapter._env._chi_tile_length - 1
-            new_adapter._env._unprocessed_actions.clear()
-            new_adapter._update_action_space_and_fan()
-            # 生成新的observation再调用agent决策碰完打什么牌
-            play_action = agent.select_action(new_adapter.observation)
+            # 假装碰牌成功了，生成新的observation再调用agent决策碰完打什么牌
+            new_adapter = self._simulate_chi_or_peng(action)
+            play_action = self._select_action(agent, new_adapter.observation)
             play, played_card = new_adapter._env.action_to_tuple(play_action)
             assert play == 'Play'
-            return f'PENG {played_card}'
\ No newline at end of file
+            return f'PENG {played_card}'
+
+    # 复制一份adapter，假装我方吃/碰牌成功了，返回的adapter处于只能打牌的阶段
+    def _simulate_chi_or_peng(self, action:ChineseStandardMahjongEnv.ActionNameType) -> 'ChineseStandardMahjongBotzoneAdapter':
+        action_type, card = self._env.action_to_tuple(action)
+        assert action_type in {'Chi', 'Peng'}
+        new_adapter = deepcopy(self)
+        new_adapter._env._active_player = self._my_id
+        new_adapter._env._add_shown_pack(action, card_from=new_adapter._env._current_card_from)
+        # 修改手牌
+        if action_type == 'Chi':
+            new_adapter._add_to_my_hand_card_counter(new_adapter._env._current_card)
+            for i in range(-1, -1+new_adapter._env._chi_tile_length):
+                new_adapter._add_to_my_hand_card_counter(new_adapter._env.card_name(new_adapter._env.card_id(card)+i), -1)
+        else:
+            new_adapter._add_to_my_hand_card_counter(new_adapter._env._current_card, 1-new_adapter._env._peng_tile_length)
+        new_adapter._env._set_current_card_and_source(None, None)
+        new_adapter._n_hand_cards[new_adapter._my_id] -= new_adapter._env._chi_tile_length - 1
+        new_adapter._env._unprocessed_actions.clear()
+        new_adapter._update_action_space_and_fan()
+        return new_adapter
+
+    # 将我方Botzone格式的response解析为动作，_generate_botzone_response的逆过程
+    # 返回(动作, 吃碰之后打出的牌对应的动作或None)；暗杠会记录在self._last_anganged_card中，以备后续加载状态
+    def _parse_botzone_response(self, response:str) -> Tuple[ChineseStandardMahjongEnv.ActionNameType, Union[ChineseStandardMahjongEnv.ActionNameType, None]]:
+        action, play_action = self.botzone_response_to_action(response, self._env._current_card)
+        if action.startswith('AnGang'):
+            self._last_anganged_card = self._env.action_to_tuple(action)[1]
+        return (action, play_action)
+
+    # 将Botzone格式的response解析为动作，current_card为当前待决策的牌，用于补全明杠、碰牌的牌张
+    # 返回(动作, 吃碰之后打出的牌对应的动作或None)
+    @classmethod
+    def botzone_response_to_action(cls, response:str, current_card:ChineseStandardMahjongEnv.CardNameType) -> Tuple[ChineseStandardMahjongEnv.ActionNameType, Union[ChineseStandardMahjongEnv.ActionNameType, None]]:
+        response_parts = response.split()
+        response_type = response_parts[0] if response_parts else None
+
+        if response_type in {'PASS', 'HU'}:
+            return (response_type.capitalize(), None)
+
+        if response_type == 'PLAY':
+            return (f'Play{response_parts[1]}', None)
+
+        # 带牌张的GANG为暗杠，否则为明杠别人打出的牌
+        if response_type == 'GANG':
+            if len(response_parts) > 1:
+                return (f'AnGang{response_parts[1]}', None)
+            return (f'Gang{current_card}', None)
+
+        if response_type == 'BUGANG':
+            return (f'BuGang{response_parts[1]}', None)
+
+        if response_type == 'CHI':
+            return (f'Chi{response_parts[1]}', f'Play{response_parts[2]}')
+
+        if response_type == 'PENG':
+            return (f'Peng{current_card}', f'Play{response_parts[1]}')
+
+        raise ValueError(f'unknown botzone response: {response}')
\ No newline at end of file
@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+from agent import Agent
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_botzone_adapter import ChineseStandardMahjongBotzoneAdapter
+from random_mahjong_agent import RandomMahjongAgent
+
+# 进程内的bot：直接调用adapter处理request，不经过标准输入输出
+class InProcessBot:
+
+    def __init__(self, agent:Agent):
+        self._agent = agent
+        self._adapter = ChineseStandardMahjongBotzoneAdapter()
+
+    def request(self, request:str) -> str:
+        return self._adapter.process_request(self._agent, request)
+
+    def close(self):
+        pass
+
+# 子进程中的bot：通过管道按照Botzone简单交互长时运行模式通信
+class SubprocessBot:
+
+    _keep_running_mark = '>>>BOTZONE_REQUEST_KEEP_RUNNING<<<'
+
+    def __init__(self, command:List[str]):
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, bufsize=1, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        self._is_first_turn = True
+
+    def request(self, request:str) -> str:
+        # 首回合先给出回合数，之后长时运行只给出新的request
+        if self._is_first_turn:
+            self._process.stdin.write('1\n')
+            self._is_first_turn = False
+        self._process.stdin.write(request + '\n')
+        self._process.stdin.flush()
+        lines = list()
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise RuntimeError(f'bot exited with code {self._process.poll()}')
+            line = line.strip()
+            if line == self._keep_running_mark:
+                return ' '.join(lines)
+            lines.append(line)
+
+    def close(self):
+        self._process.kill()
+        self._process.wait()
+
+# 本地模拟Botzone裁判：以ChineseStandardMahjongEnv为准生成每个座位的request，收集response并推进环境
+class ChineseStandardMahjongBotzoneJudge:
+
+    # 一局的结果
+    MatchResultType = Dict[str, Any]
+
+    _default_command = [sys.executable, '-u', '__main__.py']
+    _latency_percentiles = (50, 90, 99, 100)
+
+    def __init__(self, config:Dict):
+        self.config = config
+
+    # in_process: 每局在一个进程中运行4个adapter；subprocess: 每个bot是一个子进程
+    @property
+    def mode(self) -> str:
+        return self.config.get('mode', 'in_process')
+
+    # 同时进行的对局数
+    @property
+    def n_workers(self) -> int:
+        return self.config.get('n_workers', os.cpu_count())
+
+    # 进程内模式下生成agent，需要可以被pickle
+    @property
+    def agent_factory(self) -> Callable[[], Agent]:
+        return self.config.get('agent_factory', RandomMahjongAgent)
+
+    # 子进程模式下启动bot的命令
+    @property
+    def command(self) -> List[str]:
+        return self.config.get('command', self._default_command)
+
+    # 对局记录输出路径，每行一局，格式同Botzone导出的对局记录
+    @property
+    def log_path(self) -> Union[str, None]:
+        return self.config.get('log_path', None)
+
+    # 以env为准推进一局，bots按照env的玩家id排列
+    @classmethod
+    def play_match(cls, bots:List[Any], env_config:Dict) -> MatchResultType:
+        env = ChineseStandardMahjongEnv(env_config)
+        n_players = env.n_players
+        # Botzone的玩家id即门风
+        botzone_ids = tuple(wind - 1 for wind in env.seat_winds)
+        log = list()
+        latencies = list()
+
+        # 向每个玩家发送request，收集response
+        def broadcast(requests:List[str]) -> List[str]:
+            responses = list()
+            for bot, request in zip(bots, requests):
+                start_time = time.perf_counter()
+                responses.append(bot.request(request))
+                latencies.append(time.perf_counter() - start_time)
+            log.append({'output' : {'content' : {str(botzone_ids[i]) : requests[i] for i in range(n_players)}}})
+            log.append({str(botzone_ids[i]) : {'response' : responses[i]} for i in range(n_players)})
+            return responses
+
+        # 检查动作合法后推进环境
+        def step(player:int, action:ChineseStandardMahjongEnv.ActionNameType):
+            if env.active_player != player or action not in env.action_space:
+                raise ValueError(f'illegal action {action} from player {player}, action space {env.action_space}')
+            env.step(action)
+
+        to_action = ChineseStandardMahjongBotzoneAdapter.botzone_response_to_action
+
+        broadcast([f'0 {botzone_ids[i]} {env.prevalent_wind - 1}' for i in range(n_players)])
+        broadcast([' '.join(('1',) + ('0',) * n_players + tuple(env._initial_hand_cards[i])) for i in range(n_players)])
+
+        while not env.done:
+            # 摸牌阶段
+            player = env.active_player
+            card, _ = env.current_card_and_source
+            responses = broadcast([f'2 {card}' if i == player else f'3 {botzone_ids[player]} DRAW' for i in range(n_players)])
+            action, _ = to_action(responses[player], card)
+            step(player, action)
+            if env.done:
+                break
+            action_type, card = env.action_to_tuple(action)
+            if action_type == 'AnGang':
+                broadcast([f'3 {botzone_ids[player]} GANG'] * n_players)
+                continue
+            request = f'3 {botzone_ids[player]} {action_type.upper()} {card}'
+
+            # 其他玩家对打出/补杠的牌做出回应，吃碰之后还需要继续回应
+            while request is not None:
+                responses = broadcast([request] * n_players)
+                claims = dict()
+                for _ in range(n_players - 1):
+                    responder = env.active_player
+                    claims[responder] = to_action(responses[responder], env._current_card)
+                    step(responder, claims[responder][0])
+                    if env.done:
+                        break
+                if env.done:
+                    break
+                request = None
+                # 这一圈结束后的牌权归属说明了哪个吃碰杠成功了
+                player = env.active_player
+                action, play_action = claims.get(player, ('Pass', None))
+                action_type, card = env.action_to_tuple(action)
+                if action_type == 'Gang':
+                    broadcast([f'3 {botzone_ids[player]} GANG'] * n_players)
+                elif action_type in {'Chi', 'Peng'}:
+                    step(player, play_action)
+                    _, played_card = env.action_to_tuple(play_action)
+                    request = f'3 {botzone_ids[player]} CHI {card} {played_card}' if action_type == 'Chi' else f'3 {botzone_ids[player]} PENG {played_card}'
+
+        return {
+            'scores' : env.scores,
+            'winner' : env.winner,
+            'latencies' : latencies,
+            'log' : log
+        }
+
+    # 进程内模式运行一局，供进程池调用
+    @classmethod
+    def _play_in_process_match(cls, args:Tuple[Callable[[], Agent], Dict]) -> MatchResultType:
+        agent_factory, env_config = args
+        bots = [InProcessBot(agent_factory()) for _ in range(ChineseStandardMahjongEnv._n_players)]
+        return cls._play_and_catch(bots, env_config)
+
+    # 子进程模式运行一局，供线程池调用
+    def _play_subprocess_match(self, env_config:Dict) -> MatchResultType:
+        bots = [SubprocessBot(self.command) for _ in range(ChineseStandardMahjongEnv._n_players)]
+        try:
+            return self._play_and_catch(bots, env_config)
+        finally:
+            for bot in bots:
+                bot.close()
+
+    # bot出错时记录错误而不中断其他对局
+    @classmethod
+    def _play_and_catch(cls, bots:List[Any], env_config:Dict) -> MatchResultType:
+        try:
+            return cls.play_match(bots, env_config)
+        except (ValueError, RuntimeError, AssertionError) as e:
+            return {'error' : repr(e), 'latencies' : list(), 'log' : list()}
+
+    # 进行n_matches局，返回吞吐和延迟统计
+    def run(self, n_matches:int, seed:int=0) -> Dict[str, Any]:
+        env_configs = [{'seed' : seed + i} for i in range(n_matches)]
+        start_time = time.perf_counter()
+        if self.mode == 'in_process':
+            with Pool(self.n_workers) as pool:
+                results = pool.map(self._play_in_process_match, [(self.agent_factory, c) for c in env_configs])
+        elif self.mode == 'subprocess':
+            with ThreadPoolExecutor(self.n_workers) as executor:
+                results = list(executor.map(self._play_subprocess_match, env_configs))
+        else:
+            raise ValueError(f'unknown mode: {self.mode}')
+        elapsed = time.perf_counter() - start_time
+
+        if self.log_path is not None:
+            with open(self.log_path, 'w', encoding='utf-8') as f:
+                for result in results:
+                    if 'error' not in result:
+                        f.write(json.dumps({'log' : result['log']}) + '\n')
+
+        latencies = np.array([l for result in results for l in result['latencies']])
+        return {
+            'n_matches' : n_matches,
+            'n_errors' : sum('error' in result for result in results),
+            'errors' : [result['error'] for result in results if 'error' in result],
+            'matches_per_second' : n_matches / elapsed,
+            'n_requests' : len(latencies),
+            'latency_percentiles' : {
+                f'p{p}' : float(np.percentile(latencies, p)) if len(latencies) > 0 else None
+                for p in self._latency_percentiles
+            }
+        }
+
+if __name__ == '__main__':
+    # python chinese_standard_mahjong_botzone_judge.py [in_process|subprocess] [n_matches]
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'in_process'
+    n_matches = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    judge = ChineseStandardMahjongBotzoneJudge({'mode' : mode})
+    print(json.dumps(judge.run(n_matches), indent=4))
@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, Union
+
+import numpy as np
+
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+
+# 将ChineseStandardMahjongEnv的observation编码为定长数组，将动作空间编码为合法动作掩码
+# 所有玩家相关的信息都以编码视角的玩家为0号，按照行牌顺序相对排列
+class ChineseStandardMahjongEncoder:
+
+    # 编码后的观测类型
+    EncodedObservationType = np.ndarray
+    # 合法动作掩码类型
+    ActionMaskType = np.ndarray
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+    _n_winds = ChineseStandardMahjongEnv._n_winds
+    _n_cards = len(ChineseStandardMahjongEnv._card_names)
+    _card_ids = ChineseStandardMahjongEnv._card_ids
+    _action_ids = ChineseStandardMahjongEnv._action_ids
+
+    # 每种副露包含的牌张相对于标识牌张的偏移
+    _pack_card_offsets = {
+        'Chi' : tuple(range(-1, ChineseStandardMahjongEnv._chi_tile_length-1)),
+        'Peng' : (0,) * ChineseStandardMahjongEnv._peng_tile_length,
+        'Gang' : (0,) * ChineseStandardMahjongEnv._gang_tile_length,
+        'BuGang' : (0,) * ChineseStandardMahjongEnv._gang_tile_length
+    }
+
+    # 编码的各个字段及其长度，按顺序排列
+    _fields = (
+        # 自己的手牌，每种牌的张数
+        ('hand_card', _n_cards),
+        # 当前待决策的牌
+        ('current_card', _n_cards),
+        # 当前待决策的牌的来源：环境 + 每个玩家
+        ('current_card_from', 1 + _n_players),
+        # 每个玩家的副露，每种牌的张数
+        ('shown_packs', _n_players * _n_cards),
+        # 每个玩家的牌河，每种牌的张数
+        ('discard_histories', _n_players * _n_cards),
+        # 自己的暗杠
+        ('hidden_pack', _n_cards),
+        # 每个玩家的暗杠数量
+        ('n_hidden_packs', _n_players),
+        # 每个玩家的手牌数目
+        ('n_hand_cards', _n_players),
+        # 每个玩家的牌墙剩余
+        ('wall_remains', _n_players),
+        # 圈风
+        ('prevalent_wind', _n_winds),
+        # 门风
+        ('seat_wind', _n_winds)
+    )
+
+    # 每个字段在编码中的起始位置
+    _offsets = dict(zip(
+        (name for name, _ in _fields),
+        np.cumsum((0,) + tuple(length for _, length in _fields[:-1])).tolist()
+    ))
+
+    # 编码长度
+    observation_size = sum(length for _, length in _fields)
+    # 编码的数据类型，所有计数都不超过255
+    observation_dtype = np.uint8
+    # 动作数目
+    n_actions = len(ChineseStandardMahjongEnv._action_names)
+
+    # 将玩家id转为相对于编码视角玩家的id
+    @classmethod
+    def _relative_player(cls, player:int, viewer:int) -> int:
+        return (player - viewer) % cls._n_players
+
+    # 编码player视角的observation，如果给出out则原地写入
+    @classmethod
+    def encode_observation(cls, obs:ChineseStandardMahjongEnv.ObservationType, player:int, out:Union[np.ndarray, None]=None) -> EncodedObservationType:
+        if out is None:
+            out = np.zeros(cls.observation_size, dtype=cls.observation_dtype)
+        else:
+            out[:] = 0
+        card_ids, offsets, n_cards = cls._card_ids, cls._offsets, cls._n_cards
+
+        for card, card_num in obs['hand_card'].items():
+            if card_num > 0:
+                out[offsets['hand_card'] + card_ids[card]] = card_num
+
+        if obs['current_card'] is not None:
+            out[offsets['current_card'] + card_ids[obs['current_card']]] = 1
+        card_from = obs['current_card_from']
+        out[offsets['current_card_from'] + (0 if card_from is None else 1 + cls._relative_player(card_from, player))] = 1
+
+        for p in range(cls._n_players):
+            base = cls._relative_player(p, player) * n_cards
+            for action_type, card, _ in obs['shown_packs'][p]:
+                card_id = card_ids[card]
+                for offset in cls._pack_card_offsets[action_type]:
+                    out[offsets['shown_packs'] + base + card_id + offset] += 1
+            for card in obs['discard_histories'][p]:
+                out[offsets['discard_histories'] + base + card_ids[card]] += 1
+
+        for card in obs['hidden_pack']:
+            out[offsets['hidden_pack'] + card_ids[card]] += ChineseStandardMahjongEnv._gang_tile_length
+
+        for field in ('n_hidden_packs', 'n_hand_cards', 'wall_remains'):
+            values = obs[field]
+            for p in range(cls._n_players):
+                out[offsets[field] + cls._relative_player(p, player)] = values[p]
+
+        # 风向为1-4
+        out[offsets['prevalent_wind'] + obs['prevalent_wind'] - 1] = 1
+        out[offsets['seat_wind'] + obs['seat_winds'][player] - 1] = 1
+        return out
+
+    # 编码动作空间为合法动作掩码，如果给出out则原地写入
+    @classmethod
+    def encode_action_mask(cls, action_space:Iterable[ChineseStandardMahjongEnv.ActionNameType], out:Union[np.ndarray, None]=None) -> ActionMaskType:
+        if out is None:
+            out = np.zeros(cls.n_actions, dtype=np.bool_)
+        else:
+            out[:] = False
+        out[[cls._action_ids[action] for action in action_space]] = True
+        return out
+
+    # 动作名到编号
+    @classmethod
+    def encode_action(cls, action:ChineseStandardMahjongEnv.ActionNameType) -> int:
+        return cls._action_ids[action]
+
+    # 编号到动作名
+    @classmethod
+    def decode_action(cls, action_id:int) -> ChineseStandardMahjongEnv.ActionNameType:
+        return ChineseStandardMahjongEnv.action_name(int(action_id))
+
+    # 每个字段在编码中的切片，便于模型按字段取用
+    @classmethod
+    def field_slices(cls) -> Dict[str, slice]:
+        return {name : slice(cls._offsets[name], cls._offsets[name] + length) for name, length in cls._fields}
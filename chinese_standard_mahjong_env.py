@@ -1,13 +1,24 @@
 from copy import deepcopy
+from time import perf_counter
 from collections import Counter
 from typing import Any, Dict, List, Iterable, Union, Tuple
 
-import numpy as np
+import chinese_standard_mahjong_tables as tables
+from multiagent_env import MultiAgentEnv
 
-# https://github.com/ailab-pku/PyMahjongGB
-from MahjongGB import MahjongFanCalculator
+# numpy和算番库在第一次用到时才导入，缩短Botzone首回合的启动时间
+np = None
+MahjongFanCalculator = None
 
-from multiagent_env import MultiAgentEnv
+def _import_numpy():
+    global np
+    import numpy
+    np = numpy
+
+def _import_fan_calculator():
+    global MahjongFanCalculator
+    # https://github.com/ailab-pku/PyMahjongGB
+    from MahjongGB import MahjongFanCalculator
 
 class ChineseStandardMahjongEnv(MultiAgentEnv):
 
@@ -57,53 +68,25 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
     # 最小成和番数为8
     _min_win_fan = 8
 
-    # 将种类和细分类结合到一起，生成完整牌张/动作名称
-    _type_detail_combiner = lambda type_list, detail_list : tuple(f'{t}{d}' for (i, t) in enumerate(type_list) for d in detail_list[i])
-
-    # 生成名称到id的映射
-    _id_dict_generator = lambda _list : {k : i for i, k in enumerate(_list)}
-
-    # 牌的种类：风箭万条饼
-    _card_types = ('F', 'J', 'W', 'T', 'B')
-
-    # 每种牌的细分
-    _card_details = (
-        tuple(range(1, _n_winds+1)),                             # F1-F4: 东南西北
-        tuple(range(1, _n_dragons+1)),                           # J1-J3: 中发白
-        *((tuple(range(1, _n_ordinals+1)), ) * _n_ordinal_types) # W1-W9, T1-T9, B1-B9
-    )
+    # 以下静态表由chinese_standard_mahjong_tables预先生成
 
     # 牌名列表
-    _card_names = _type_detail_combiner(_card_types, _card_details)
+    _card_names = tables.card_names
 
-    _chiable = lambda card : not (card.startswith('F') or card.startswith('J') or card.endswith('1') or card.endswith('9'))
-    
     # 可以作为吃牌标识的牌张：包括2-8万条饼
-    _chiable_card_names = tuple(filter(_chiable, _card_names))
+    _chiable_card_names = tables.chiable_card_names
 
     # 牌名到编号的映射
-    _card_ids = _id_dict_generator(_card_names)
+    _card_ids = tables.card_ids
 
     # 动作种类
-    _action_types = ('Pass', 'Hu', 'Play', 'Chi', 'Peng', 'Gang', 'AnGang', 'BuGang')
-
-    # 每种动作的细分类
-    _action_details = (
-        ('',),               # Pass
-        ('',),               # Hu
-        _card_names,         # Play
-        _chiable_card_names, # Chi
-        _card_names,         # Peng
-        _card_names,         # Gang
-        _card_names,         # AnGang
-        _card_names          # BuGang
-    )
+    _action_types = tables.action_types
 
     # 动作名列表
-    _action_names = _type_detail_combiner(_action_types, _action_details)
+    _action_names = tables.action_names
 
     # 动作名到编号的映射
-    _action_ids = _id_dict_generator(_action_names)
+    _action_ids = tables.action_ids
 
     # 玩家人数：4
     @property
@@ -225,6 +208,8 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
     def __init__(self, config:Dict):
         super().__init__()
         self.config = config
+        if config.get('profile', False):
+            self.enable_profiling()
         # 设置牌墙：self._wall, 初始手牌：self._initial_hand_cards
         self._general_wall_initializer(config)
         # 设置圈风：self.prevalent_wind, 门风：self.seat_winds
@@ -252,6 +237,8 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
         
         self.prevalent_wind = prevalent_wind
         if prevalent_wind is None:
+            if np is None:
+                _import_numpy()
             self.prevalent_wind = np.random.randint(1, self._n_winds+1)
 
         self.seat_winds = tuple(
@@ -278,6 +265,8 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
 
     # 用随机种子初始化手牌和牌墙
     def _seed_wall_initializer(self, seed:Union[int,None]=None):
+        if np is None:
+            _import_numpy()
         if seed is not None:
             np.random.seed(seed)
         cards = list(self._card_names * self._n_duplicate_cards)
@@ -444,36 +433,49 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
         
         # 别人打出牌，吃碰杠和阶段
         if has_unprocessed_actions and self._unprocessed_actions[0].startswith('Play'):
-            self._action_space.append('Pass')
-            self._add_hu_actions_and_update_fan()
-            # 非海底牌方可吃碰杠
-            if not self._is_wall_last:
-                self._add_peng_actions()
-                # 只能吃上家的牌
-                if len(self._unprocessed_actions) == 1:
-                    self._add_chi_actions()
-                # 自己牌墙里有牌才能杠
-                if self.wall_remain(self.active_player) > 0:
-                    self._add_gang_actions()
-            
+            self._update_response_actions()
         # 别人补杠，抢杠和阶段
         elif has_unprocessed_actions and self._unprocessed_actions[0].startswith('BuGang'):
-            self._action_space.append('Pass')
-            self._add_hu_actions_and_update_fan()
-
+            self._update_rob_kong_actions()
         # 接受发牌阶段 / 杠后摸打阶段
         elif self._current_card is not None and self._current_card_from is None:
-            self._add_play_actions()
-            self._add_hu_actions_and_update_fan()
+            self._update_draw_actions()
+        # 吃碰完牌、只能打牌阶段
+        elif self._current_card is None and self._current_card_from is None:
+            self._update_play_only_actions()
+
+    # 别人打出牌：过、和、碰、吃、杠
+    def _update_response_actions(self):
+        self._action_space.append('Pass')
+        self._add_hu_actions_and_update_fan()
+        # 非海底牌方可吃碰杠
+        if not self._is_wall_last:
+            self._add_peng_actions()
+            # 只能吃上家的牌
+            if len(self._unprocessed_actions) == 1:
+                self._add_chi_actions()
             # 自己牌墙里有牌才能杠
             if self.wall_remain(self.active_player) > 0:
-                self._add_angang_actions()
-                self._add_bugang_actions()
+                self._add_gang_actions()
+
+    # 别人补杠：过、抢杠和
+    def _update_rob_kong_actions(self):
+        self._action_space.append('Pass')
+        self._add_hu_actions_and_update_fan()
+
+    # 摸牌之后：打牌、自摸和、暗杠、补杠
+    def _update_draw_actions(self):
+        self._add_play_actions()
+        self._add_hu_actions_and_update_fan()
+        # 自己牌墙里有牌才能杠
+        if self.wall_remain(self.active_player) > 0:
+            self._add_angang_actions()
+            self._add_bugang_actions()
+
+    # 吃碰之后：只能打牌
+    def _update_play_only_actions(self):
+        self._add_play_actions()
 
-        # 吃碰完牌、只能打牌阶段
-        elif self._current_card is None and self._current_card_from is None:
-            self._add_play_actions()
-        
     # 生成打牌动作
     def _add_play_actions(self):
         self._action_space.extend(f'Play{card}' 
@@ -568,6 +570,8 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
 
     # 更新成番情况
     def _call_fan_calculator(self) -> FanCalculatorReturnType:
+        if MahjongFanCalculator is None:
+            _import_fan_calculator()
         try:
             self._fan = MahjongFanCalculator(
                 pack = self._combine_packs(),
@@ -666,6 +670,27 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
     def close(self):
         pass
 
+    # 开启热点方法的计数：把实例的类换成带计时的子类，未开启时没有任何额外开销
+    # counters为名称 -> [调用次数, 累计秒数]，多个环境传入同一个dict时累计到一起
+    def enable_profiling(self, counters:Union[Dict[str, List], None]=None):
+        if not hasattr(self, '_unprofiled_class'):
+            self._unprofiled_class = self.__class__
+            self.__class__ = _profiled_class(self.__class__)
+        self._profile_counters = dict() if counters is None else counters
+
+    def disable_profiling(self):
+        if hasattr(self, '_unprofiled_class'):
+            self.__class__ = self._unprofiled_class
+            del self._unprofiled_class
+
+    # 计数的快照：名称 -> 调用次数、累计秒数、每次调用的平均微秒数；计时包含被调用的其他热点方法
+    def profile_snapshot(self) -> Dict[str, Dict[str, float]]:
+        counters = getattr(self, '_profile_counters', dict())
+        return {
+            name : {'calls' : calls, 'seconds' : seconds, 'mean_us' : seconds / calls * 1e6 if calls > 0 else 0.0}
+            for name, (calls, seconds) in sorted(counters.items())
+        }
+
     # 状态发生转移，返回：执行动作过程中发生的事件信息
     def step(self, action:ActionNameType) -> StepInfoType:
         
@@ -725,91 +750,142 @@ class ChineseStandardMahjongEnv(MultiAgentEnv):
 
         # 如果打出的牌/补杠的牌轮过一圈，则需要确定牌张归属、重新确定牌权
         if len(self._unprocessed_actions) == self.n_players:
-            # 此时active_player回到打出/补杠的人手里
-            last_round_player = self.active_player
-            # 看看这一圈的第一个动作是打牌还是补杠
-            a0 = self._unprocessed_actions[0]
-            a0_type, a0_card = self.action_to_tuple(a0)
-
-            # 补杠成功
-            if a0_type == 'BuGang':
-                self._is_about_kong = True
-                # 把碰的那个tile删掉
-                peng_pack_id = self._peng_pack_index_of(a0_card)
-                del self._shown_packs[self.active_player][peng_pack_id]
-                # 添加新的副露
-                self._add_shown_pack(action=a0, card_from=None)
-                # 修改手牌，删去补杠的那张
-                self._add_hand_card(a0_card, -1)
-                # 补牌，等待玩家打出一张牌
-                self._deal_card()
-            
-            # 打出的海底牌无人成和，结束
-            elif self._is_wall_last:
-                self._done = True
+            # 打出的海底牌无人成和，游戏结束，不再更新动作空间和观测
+            if not self._resolve_round():
                 return
 
-            elif a0_type == 'Play':
-                # 这一圈其他人的动作
-                for i, a in enumerate(self._unprocessed_actions[1:]):
-                    a_type, a_card = self.action_to_tuple(a)
-                    if a_type == 'Gang':
-                        # 可以杠上开花
-                        self._is_about_kong = True
-                        # 牌权属于杠牌的人
-                        self._active_player = self._next_player(last_round_player, i+1)
-                        # 加入杠牌副露
-                        self._add_shown_pack(action=a, card_from=last_round_player)
-                        # 更新手牌
-                        self._add_hand_card(a_card, 1-self._gang_tile_length)
-                        # 杠牌需要补摸一张
-                        self._deal_card()
-                        # 等待杠牌的玩家决策
-                        break
-                    elif a_type == 'Peng':
-                        self._is_about_kong = False
-                        # 牌权属于碰牌的人
-                        self._active_player = self._next_player(last_round_player, i+1)
-                        # 加入碰牌副露
-                        self._add_shown_pack(action=a, card_from=last_round_player)
-                        # 更新手牌
-                        self._add_hand_card(a_card, 1-self._peng_tile_length)
-                        # 当前只能打牌
-                        self._set_current_card_and_source(None, None)
-                        # 等待碰牌的人决策
-                        break
-                # 如果没有遇到碰杠的情况：只有过或者吃
-                else:
-                    self._is_about_kong = False
-                    # 看看有没有被下家吃
-                    a1 = self._unprocessed_actions[1]
-                    a1_type, a1_card = self.action_to_tuple(a1)
-                    # 牌被吃了
-                    if a1_type == 'Chi':
-                        # 牌权属于吃牌的玩家
-                        self._active_player = self._next_player(last_round_player)
-                        # 添加副露
-                        self._add_shown_pack(action=a1, card_from=last_round_player)
-                        # 修改手牌
-                        self._add_hand_card(self._current_card)
-                        for i in range(-1, self._chi_tile_length-1):
-                            self._add_hand_card(self.card_name(self.card_id(a1_card)+i), -1)
-                        # 等待玩家打出一张牌
-                        self._set_current_card_and_source(None, None)
-                    # 牌没有被吃，则需要丢入牌河
-                    else:
-                        # 加入牌河中
-                        self._add_discard_history(self._current_card)
-                        # 牌权交给下一个玩家
-                        self._active_player = self._next_player(self.active_player)
-                        # 发一张牌
-                        self._deal_card()
-
-            self._unprocessed_actions.clear()
-
         self._update_action_space_and_fan()
         self._update_observation_and_state()
 
+    # 打出的牌/补杠的牌轮过一圈之后，确定牌张归属、重新确定牌权
+    # 返回游戏是否继续：打出的海底牌无人成和时结束游戏并返回False；摸牌时牌墙摸完结束的游戏仍返回True
+    def _resolve_round(self) -> bool:
+        # 此时active_player回到打出/补杠的人手里
+        last_round_player = self.active_player
+        # 看看这一圈的第一个动作是打牌还是补杠
+        a0 = self._unprocessed_actions[0]
+        a0_type, a0_card = self.action_to_tuple(a0)
+
+        # 补杠成功
+        if a0_type == 'BuGang':
+            self._is_about_kong = True
+            # 把碰的那个tile删掉
+            peng_pack_id = self._peng_pack_index_of(a0_card)
+            del self._shown_packs[self.active_player][peng_pack_id]
+            # 添加新的副露
+            self._add_shown_pack(action=a0, card_from=None)
+            # 修改手牌，删去补杠的那张
+            self._add_hand_card(a0_card, -1)
+            # 补牌，等待玩家打出一张牌
+            self._deal_card()
+        
+        # 打出的海底牌无人成和，结束
+        elif self._is_wall_last:
+            self._done = True
+            return False
+
+        elif a0_type == 'Play':
+            # 这一圈其他人的动作
+            for i, a in enumerate(self._unprocessed_actions[1:]):
+                a_type, a_card = self.action_to_tuple(a)
+                if a_type == 'Gang':
+                    # 可以杠上开花
+                    self._is_about_kong = True
+                    # 牌权属于杠牌的人
+                    self._active_player = self._next_player(last_round_player, i+1)
+                    # 加入杠牌副露
+                    self._add_shown_pack(action=a, card_from=last_round_player)
+                    # 更新手牌
+                    self._add_hand_card(a_card, 1-self._gang_tile_length)
+                    # 杠牌需要补摸一张
+                    self._deal_card()
+                    # 等待杠牌的玩家决策
+                    break
+                elif a_type == 'Peng':
+                    self._is_about_kong = False
+                    # 牌权属于碰牌的人
+                    self._active_player = self._next_player(last_round_player, i+1)
+                    # 加入碰牌副露
+                    self._add_shown_pack(action=a, card_from=last_round_player)
+                    # 更新手牌
+                    self._add_hand_card(a_card, 1-self._peng_tile_length)
+                    # 当前只能打牌
+                    self._set_current_card_and_source(None, None)
+                    # 等待碰牌的人决策
+                    break
+            # 如果没有遇到碰杠的情况：只有过或者吃
+            else:
+                self._is_about_kong = False
+                # 看看有没有被下家吃
+                a1 = self._unprocessed_actions[1]
+                a1_type, a1_card = self.action_to_tuple(a1)
+                # 牌被吃了
+                if a1_type == 'Chi':
+                    # 牌权属于吃牌的玩家
+                    self._active_player = self._next_player(last_round_player)
+                    # 添加副露
+                    self._add_shown_pack(action=a1, card_from=last_round_player)
+                    # 修改手牌
+                    self._add_hand_card(self._current_card)
+                    for i in range(-1, self._chi_tile_length-1):
+                        self._add_hand_card(self.card_name(self.card_id(a1_card)+i), -1)
+                    # 等待玩家打出一张牌
+                    self._set_current_card_and_source(None, None)
+                # 牌没有被吃，则需要丢入牌河
+                else:
+                    # 加入牌河中
+                    self._add_discard_history(self._current_card)
+                    # 牌权交给下一个玩家
+                    self._active_player = self._next_player(self.active_player)
+                    # 发一张牌
+                    self._deal_card()
+
+        self._unprocessed_actions.clear()
+        return True
+
+# 计时的方法：计数名称 -> 方法名
+_profiled_methods = {
+    'step' : 'step',
+    'resolve_round' : '_resolve_round',
+    'update_action_space_and_fan' : '_update_action_space_and_fan',
+    'action_space.response' : '_update_response_actions',
+    'action_space.rob_kong' : '_update_rob_kong_actions',
+    'action_space.draw' : '_update_draw_actions',
+    'action_space.play_only' : '_update_play_only_actions',
+    'call_fan_calculator' : '_call_fan_calculator',
+    'update_observation_and_state' : '_update_observation_and_state'
+}
+# 计时的属性（返回深拷贝）：计数名称 -> 属性名
+_profiled_properties = {
+    'deepcopy.observation' : 'observation',
+    'deepcopy.state' : 'state',
+    'deepcopy.history' : 'history'
+}
+# 环境类 -> 带计时的子类
+_profiled_classes = dict()
+
+def _timed(name:str, method):
+    def timed_method(self, *args, **kwargs):
+        start_time = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            counter = self._profile_counters.get(name)
+            if counter is None:
+                counter = self._profile_counters[name] = [0, 0.0]
+            counter[0] += 1
+            counter[1] += perf_counter() - start_time
+    timed_method.__name__ = method.__name__
+    return timed_method
+
+# 给环境类生成一个重写了热点方法的子类，用于enable_profiling
+def _profiled_class(cls:type) -> type:
+    if cls not in _profiled_classes:
+        namespace = {method_name : _timed(name, getattr(cls, method_name)) for name, method_name in _profiled_methods.items()}
+        namespace.update({property_name : property(_timed(name, getattr(cls, property_name).fget)) for name, property_name in _profiled_properties.items()})
+        _profiled_classes[cls] = type(f'Profiled{cls.__name__}', (cls,), namespace)
+    return _profiled_classes[cls]
+
 def generate_log(env):
     print(f'prevalent_wind: {env.prevalent_wind}, seat_winds: {env.seat_winds}')
     print(f'wall: {env._walls}')
@@ -835,6 +911,7 @@ def generate_log(env):
 
 if __name__ == '__main__':
 
+    _import_numpy()
     c = ChineseStandardMahjongEnv({
         'prevalent_wind' : 1,
         'reset_mode' : {
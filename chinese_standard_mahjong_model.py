@@ -0,0 +1,105 @@
+import sys
+import time
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import torch
+from torch import nn
+
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+
+# 策略价值网络：输入ChineseStandardMahjongEncoder的观测编码，输出每个动作的logits和状态价值
+class ChineseStandardMahjongPolicyNetwork(nn.Module):
+
+    _default_hidden_sizes = (512, 512, 256)
+
+    def __init__(self, config:Union[Dict, None]=None):
+        super().__init__()
+        self.config = dict() if config is None else config
+        layers = list()
+        in_features = ChineseStandardMahjongEncoder.observation_size
+        for hidden_size in self.hidden_sizes:
+            layers += [nn.Linear(in_features, hidden_size), nn.ReLU()]
+            in_features = hidden_size
+        self.body = nn.Sequential(*layers)
+        self.policy_head = nn.Linear(in_features, ChineseStandardMahjongEncoder.n_actions)
+        self.value_head = nn.Linear(in_features, 1)
+
+    @property
+    def hidden_sizes(self) -> Tuple[int]:
+        return tuple(self.config.get('hidden_sizes', self._default_hidden_sizes))
+
+    # observations: (batch, observation_size)的观测编码；masks: (batch, n_actions)的合法动作掩码
+    # 返回logits（给出masks时非法动作为-inf）和价值
+    def forward(self, observations:torch.Tensor, masks:Union[torch.Tensor, None]=None) -> Tuple[torch.Tensor, torch.Tensor]:
+        x = self.body(observations.float())
+        logits = self.policy_head(x)
+        if masks is not None:
+            logits = logits.masked_fill(~masks, float('-inf'))
+        return logits, self.value_head(x).squeeze(-1)
+
+# 动态int8量化：Linear层的权重以int8存储，激活在推理时动态量化，只用于CPU推理
+# 量化后的state_dict需要加载到同样量化过的网络中：quantize_network(ChineseStandardMahjongPolicyNetwork(config)).load_state_dict(...)
+def quantize_network(network:nn.Module) -> nn.Module:
+    return torch.ao.quantization.quantize_dynamic(network, {nn.Linear}, dtype=torch.qint8)
+
+# 用随机对局生成的观测编码和合法动作掩码
+def _generate_observations(n_matches:int) -> Tuple[np.ndarray, np.ndarray]:
+    from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+    from random_mahjong_agent import RandomMahjongAgent
+    encoder = ChineseStandardMahjongEncoder
+    agent = RandomMahjongAgent()
+    observations, masks = list(), list()
+    for seed in range(n_matches):
+        env = ChineseStandardMahjongEnv({'seed' : seed})
+        while not env.done:
+            obs = env.observation
+            observations.append(encoder.encode_observation(obs, env.active_player))
+            masks.append(encoder.encode_action_mask(env.action_space))
+            env.step(agent.select_action(obs))
+    return np.stack(observations), np.stack(masks)
+
+# 每秒决策数，batch_size为1时与actor和Botzone bot逐个决策的用法相同
+def _decisions_per_second(network:nn.Module, observations:torch.Tensor, masks:torch.Tensor, batch_size:int) -> float:
+    with torch.no_grad():
+        start_time = time.perf_counter()
+        for i in range(0, len(observations), batch_size):
+            network(observations[i:i+batch_size], masks[i:i+batch_size])
+        return len(observations) / (time.perf_counter() - start_time)
+
+if __name__ == '__main__':
+    # 量化基准：python chinese_standard_mahjong_model.py [对局数]
+    import tempfile
+    from folder_model_pool import ChineseStandardMahjongModelPool
+
+    torch.set_num_threads(1)
+    n_matches = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    observations, masks = map(torch.from_numpy, _generate_observations(n_matches))
+    with tempfile.TemporaryDirectory() as path:
+        pool = ChineseStandardMahjongModelPool({'path' : path})
+        handler = pool.save_model(ChineseStandardMahjongPolicyNetwork().state_dict())
+
+        network = ChineseStandardMahjongPolicyNetwork()
+        network.load_state_dict(pool.load_model(handler))
+        quantized_network = quantize_network(ChineseStandardMahjongPolicyNetwork())
+        start_time = time.perf_counter()
+        quantized_network.load_state_dict(pool.load_model(handler, quantized=True))
+        print(f'first quantized load (quantize and save): {(time.perf_counter() - start_time) * 1000:.2f}ms')
+        start_time = time.perf_counter()
+        ChineseStandardMahjongModelPool({'path' : path}).load_model(handler, quantized=True)
+        print(f'quantized load from disk: {(time.perf_counter() - start_time) * 1000:.2f}ms')
+
+        with torch.no_grad():
+            logits, values = network(observations, masks)
+            quantized_logits, quantized_values = quantized_network(observations, masks)
+        # 只统计有多个合法动作的决策点
+        is_choice = masks.sum(dim=1) > 1
+        agreement = (logits.argmax(dim=1) == quantized_logits.argmax(dim=1))[is_choice].float().mean()
+        print(f'{len(observations)} decisions, {int(is_choice.sum())} with a choice, greedy action agreement {float(agreement) * 100:.2f}%')
+        print(f'max value difference {float((values - quantized_values).abs().max()):.4f}')
+        for batch_size in (1, 64):
+            print(
+                f'batch {batch_size}: fp32 {_decisions_per_second(network, observations, masks, batch_size):.0f} decisions/s, '
+                f'int8 {_decisions_per_second(quantized_network, observations, masks, batch_size):.0f} decisions/s'
+            )
+        print(f'state_dict size: fp32 {pool._model_bytes(network.state_dict()) / 2**20:.2f}MB, int8 {pool._model_bytes(quantized_network.state_dict()) / 2**20:.2f}MB')
@@ -0,0 +1,116 @@
+# ChineseStandardMahjongEnv用到的静态表，预先生成以免在导入时计算，由本文件的__main__重新生成，请勿手动修改
+
+# 牌名列表
+card_names = (
+    'F1', 'F2', 'F3', 'F4', 'J1', 'J2', 'J3', 'W1', 'W2', 'W3', 'W4', 'W5',
+    'W6', 'W7', 'W8', 'W9', 'T1', 'T2', 'T3', 'T4', 'T5', 'T6', 'T7', 'T8',
+    'T9', 'B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B9'
+)
+
+# 可以作为吃牌标识的牌张：包括2-8万条饼
+chiable_card_names = (
+    'W2', 'W3', 'W4', 'W5', 'W6', 'W7', 'W8', 'T2', 'T3', 'T4', 'T5', 'T6',
+    'T7', 'T8', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8'
+)
+
+# 牌名到编号的映射
+card_ids = {
+    'F1' : 0, 'F2' : 1, 'F3' : 2, 'F4' : 3, 'J1' : 4, 'J2' : 5, 'J3' : 6, 'W1' : 7, 'W2' : 8, 'W3' : 9, 'W4' : 10, 'W5' : 11,
+    'W6' : 12, 'W7' : 13, 'W8' : 14, 'W9' : 15, 'T1' : 16, 'T2' : 17, 'T3' : 18, 'T4' : 19, 'T5' : 20, 'T6' : 21, 'T7' : 22, 'T8' : 23,
+    'T9' : 24, 'B1' : 25, 'B2' : 26, 'B3' : 27, 'B4' : 28, 'B5' : 29, 'B6' : 30, 'B7' : 31, 'B8' : 32, 'B9' : 33
+}
+
+# 动作种类
+action_types = (
+    'Pass', 'Hu', 'Play', 'Chi', 'Peng', 'Gang', 'AnGang', 'BuGang'
+)
+
+# 动作名列表
+action_names = (
+    'Pass', 'Hu', 'PlayF1', 'PlayF2', 'PlayF3', 'PlayF4', 'PlayJ1', 'PlayJ2', 'PlayJ3', 'PlayW1', 'PlayW2', 'PlayW3',
+    'PlayW4', 'PlayW5', 'PlayW6', 'PlayW7', 'PlayW8', 'PlayW9', 'PlayT1', 'PlayT2', 'PlayT3', 'PlayT4', 'PlayT5', 'PlayT6',
+    'PlayT7', 'PlayT8', 'PlayT9', 'PlayB1', 'PlayB2', 'PlayB3', 'PlayB4', 'PlayB5', 'PlayB6', 'PlayB7', 'PlayB8', 'PlayB9',
+    'ChiW2', 'ChiW3', 'ChiW4', 'ChiW5', 'ChiW6', 'ChiW7', 'ChiW8', 'ChiT2', 'ChiT3', 'ChiT4', 'ChiT5', 'ChiT6',
+    'ChiT7', 'ChiT8', 'ChiB2', 'ChiB3', 'ChiB4', 'ChiB5', 'ChiB6', 'ChiB7', 'ChiB8', 'PengF1', 'PengF2', 'PengF3',
+    'PengF4', 'PengJ1', 'PengJ2', 'PengJ3', 'PengW1', 'PengW2', 'PengW3', 'PengW4', 'PengW5', 'PengW6', 'PengW7', 'PengW8',
+    'PengW9', 'PengT1', 'PengT2', 'PengT3', 'PengT4', 'PengT5', 'PengT6', 'PengT7', 'PengT8', 'PengT9', 'PengB1', 'PengB2',
+    'PengB3', 'PengB4', 'PengB5', 'PengB6', 'PengB7', 'PengB8', 'PengB9', 'GangF1', 'GangF2', 'GangF3', 'GangF4', 'GangJ1',
+    'GangJ2', 'GangJ3', 'GangW1', 'GangW2', 'GangW3', 'GangW4', 'GangW5', 'GangW6', 'GangW7', 'GangW8', 'GangW9', 'GangT1',
+    'GangT2', 'GangT3', 'GangT4', 'GangT5', 'GangT6', 'GangT7', 'GangT8', 'GangT9', 'GangB1', 'GangB2', 'GangB3', 'GangB4',
+    'GangB5', 'GangB6', 'GangB7', 'GangB8', 'GangB9', 'AnGangF1', 'AnGangF2', 'AnGangF3', 'AnGangF4', 'AnGangJ1', 'AnGangJ2', 'AnGangJ3',
+    'AnGangW1', 'AnGangW2', 'AnGangW3', 'AnGangW4', 'AnGangW5', 'AnGangW6', 'AnGangW7', 'AnGangW8', 'AnGangW9', 'AnGangT1', 'AnGangT2', 'AnGangT3',
+    'AnGangT4', 'AnGangT5', 'AnGangT6', 'AnGangT7', 'AnGangT8', 'AnGangT9', 'AnGangB1', 'AnGangB2', 'AnGangB3', 'AnGangB4', 'AnGangB5', 'AnGangB6',
+    'AnGangB7', 'AnGangB8', 'AnGangB9', 'BuGangF1', 'BuGangF2', 'BuGangF3', 'BuGangF4', 'BuGangJ1', 'BuGangJ2', 'BuGangJ3', 'BuGangW1', 'BuGangW2',
+    'BuGangW3', 'BuGangW4', 'BuGangW5', 'BuGangW6', 'BuGangW7', 'BuGangW8', 'BuGangW9', 'BuGangT1', 'BuGangT2', 'BuGangT3', 'BuGangT4', 'BuGangT5',
+    'BuGangT6', 'BuGangT7', 'BuGangT8', 'BuGangT9', 'BuGangB1', 'BuGangB2', 'BuGangB3', 'BuGangB4', 'BuGangB5', 'BuGangB6', 'BuGangB7', 'BuGangB8',
+    'BuGangB9'
+)
+
+# 动作名到编号的映射
+action_ids = {
+    'Pass' : 0, 'Hu' : 1, 'PlayF1' : 2, 'PlayF2' : 3, 'PlayF3' : 4, 'PlayF4' : 5, 'PlayJ1' : 6, 'PlayJ2' : 7, 'PlayJ3' : 8, 'PlayW1' : 9, 'PlayW2' : 10, 'PlayW3' : 11,
+    'PlayW4' : 12, 'PlayW5' : 13, 'PlayW6' : 14, 'PlayW7' : 15, 'PlayW8' : 16, 'PlayW9' : 17, 'PlayT1' : 18, 'PlayT2' : 19, 'PlayT3' : 20, 'PlayT4' : 21, 'PlayT5' : 22, 'PlayT6' : 23,
+    'PlayT7' : 24, 'PlayT8' : 25, 'PlayT9' : 26, 'PlayB1' : 27, 'PlayB2' : 28, 'PlayB3' : 29, 'PlayB4' : 30, 'PlayB5' : 31, 'PlayB6' : 32, 'PlayB7' : 33, 'PlayB8' : 34, 'PlayB9' : 35,
+    'ChiW2' : 36, 'ChiW3' : 37, 'ChiW4' : 38, 'ChiW5' : 39, 'ChiW6' : 40, 'ChiW7' : 41, 'ChiW8' : 42, 'ChiT2' : 43, 'ChiT3' : 44, 'ChiT4' : 45, 'ChiT5' : 46, 'ChiT6' : 47,
+    'ChiT7' : 48, 'ChiT8' : 49, 'ChiB2' : 50, 'ChiB3' : 51, 'ChiB4' : 52, 'ChiB5' : 53, 'ChiB6' : 54, 'ChiB7' : 55, 'ChiB8' : 56, 'PengF1' : 57, 'PengF2' : 58, 'PengF3' : 59,
+    'PengF4' : 60, 'PengJ1' : 61, 'PengJ2' : 62, 'PengJ3' : 63, 'PengW1' : 64, 'PengW2' : 65, 'PengW3' : 66, 'PengW4' : 67, 'PengW5' : 68, 'PengW6' : 69, 'PengW7' : 70, 'PengW8' : 71,
+    'PengW9' : 72, 'PengT1' : 73, 'PengT2' : 74, 'PengT3' : 75, 'PengT4' : 76, 'PengT5' : 77, 'PengT6' : 78, 'PengT7' : 79, 'PengT8' : 80, 'PengT9' : 81, 'PengB1' : 82, 'PengB2' : 83,
+    'PengB3' : 84, 'PengB4' : 85, 'PengB5' : 86, 'PengB6' : 87, 'PengB7' : 88, 'PengB8' : 89, 'PengB9' : 90, 'GangF1' : 91, 'GangF2' : 92, 'GangF3' : 93, 'GangF4' : 94, 'GangJ1' : 95,
+    'GangJ2' : 96, 'GangJ3' : 97, 'GangW1' : 98, 'GangW2' : 99, 'GangW3' : 100, 'GangW4' : 101, 'GangW5' : 102, 'GangW6' : 103, 'GangW7' : 104, 'GangW8' : 105, 'GangW9' : 106, 'GangT1' : 107,
+    'GangT2' : 108, 'GangT3' : 109, 'GangT4' : 110, 'GangT5' : 111, 'GangT6' : 112, 'GangT7' : 113, 'GangT8' : 114, 'GangT9' : 115, 'GangB1' : 116, 'GangB2' : 117, 'GangB3' : 118, 'GangB4' : 119,
+    'GangB5' : 120, 'GangB6' : 121, 'GangB7' : 122, 'GangB8' : 123, 'GangB9' : 124, 'AnGangF1' : 125, 'AnGangF2' : 126, 'AnGangF3' : 127, 'AnGangF4' : 128, 'AnGangJ1' : 129, 'AnGangJ2' : 130, 'AnGangJ3' : 131,
+    'AnGangW1' : 132, 'AnGangW2' : 133, 'AnGangW3' : 134, 'AnGangW4' : 135, 'AnGangW5' : 136, 'AnGangW6' : 137, 'AnGangW7' : 138, 'AnGangW8' : 139, 'AnGangW9' : 140, 'AnGangT1' : 141, 'AnGangT2' : 142, 'AnGangT3' : 143,
+    'AnGangT4' : 144, 'AnGangT5' : 145, 'AnGangT6' : 146, 'AnGangT7' : 147, 'AnGangT8' : 148, 'AnGangT9' : 149, 'AnGangB1' : 150, 'AnGangB2' : 151, 'AnGangB3' : 152, 'AnGangB4' : 153, 'AnGangB5' : 154, 'AnGangB6' : 155,
+    'AnGangB7' : 156, 'AnGangB8' : 157, 'AnGangB9' : 158, 'BuGangF1' : 159, 'BuGangF2' : 160, 'BuGangF3' : 161, 'BuGangF4' : 162, 'BuGangJ1' : 163, 'BuGangJ2' : 164, 'BuGangJ3' : 165, 'BuGangW1' : 166, 'BuGangW2' : 167,
+    'BuGangW3' : 168, 'BuGangW4' : 169, 'BuGangW5' : 170, 'BuGangW6' : 171, 'BuGangW7' : 172, 'BuGangW8' : 173, 'BuGangW9' : 174, 'BuGangT1' : 175, 'BuGangT2' : 176, 'BuGangT3' : 177, 'BuGangT4' : 178, 'BuGangT5' : 179,
+    'BuGangT6' : 180, 'BuGangT7' : 181, 'BuGangT8' : 182, 'BuGangT9' : 183, 'BuGangB1' : 184, 'BuGangB2' : 185, 'BuGangB3' : 186, 'BuGangB4' : 187, 'BuGangB5' : 188, 'BuGangB6' : 189, 'BuGangB7' : 190, 'BuGangB8' : 191,
+    'BuGangB9' : 192
+}
+
+if __name__ == '__main__':
+    # 由牌张、动作的定义重新生成本文件中的静态表
+
+    # 将种类和细分类结合到一起，生成完整牌张/动作名称
+    type_detail_combiner = lambda type_list, detail_list : tuple(f'{t}{d}' for (i, t) in enumerate(type_list) for d in detail_list[i])
+    # 生成名称到id的映射
+    id_dict_generator = lambda _list : {k : i for i, k in enumerate(_list)}
+
+    # 牌的种类：风箭万条饼
+    card_types = ('F', 'J', 'W', 'T', 'B')
+    # 每种牌的细分：F1-F4东南西北，J1-J3中发白，W1-W9，T1-T9，B1-B9
+    card_details = (tuple(range(1, 5)), tuple(range(1, 4)), *((tuple(range(1, 10)), ) * 3))
+    generated_card_names = type_detail_combiner(card_types, card_details)
+    generated_chiable_card_names = tuple(filter(
+        lambda card : not (card.startswith('F') or card.startswith('J') or card.endswith('1') or card.endswith('9')),
+        generated_card_names
+    ))
+    # 动作种类及其细分类：Pass, Hu, Play, Chi, Peng, Gang, AnGang, BuGang
+    generated_action_types = ('Pass', 'Hu', 'Play', 'Chi', 'Peng', 'Gang', 'AnGang', 'BuGang')
+    action_details = (('',), ('',), generated_card_names, generated_chiable_card_names, *((generated_card_names, ) * 4))
+    generated_action_names = type_detail_combiner(generated_action_types, action_details)
+
+    # 每行若干项的紧凑格式
+    def format_table(table, items_per_line=12):
+        items = [f'{k!r} : {v!r}' for k, v in table.items()] if isinstance(table, dict) else list(map(repr, table))
+        lines = (', '.join(items[i:i+items_per_line]) for i in range(0, len(items), items_per_line))
+        brackets = '{}' if isinstance(table, dict) else '()'
+        return brackets[0] + '\n    ' + ',\n    '.join(lines) + '\n' + brackets[1]
+
+    tables = (
+        ('牌名列表', 'card_names', generated_card_names),
+        ('可以作为吃牌标识的牌张：包括2-8万条饼', 'chiable_card_names', generated_chiable_card_names),
+        ('牌名到编号的映射', 'card_ids', id_dict_generator(generated_card_names)),
+        ('动作种类', 'action_types', generated_action_types),
+        ('动作名列表', 'action_names', generated_action_names),
+        ('动作名到编号的映射', 'action_ids', id_dict_generator(generated_action_names))
+    )
+
+    with open(__file__, 'r', encoding='utf-8') as f:
+        source = f.read()
+    header = source[:source.index('\n\n') + 2]
+    main_block = source[source.index("if __name__ == '__main__':"):]
+    with open(__file__, 'w', encoding='utf-8') as f:
+        f.write(header)
+        for comment, name, table in tables:
+            f.write(f'# {comment}\n{name} = {format_table(table)}\n\n')
+        f.write(main_block)
@@ -0,0 +1,227 @@
+import sys
+import math
+import time
+import multiprocessing
+from typing import Any, Callable, Dict, Iterator, Union
+
+import numpy as np
+
+from agent import Agent
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+
+# 按座位和种子构造agent：factory(player, seed) -> Agent，用多个进程评估时需要可以pickle
+# agent的随机决策应只使用由seed初始化的随机数生成器，不读写numpy、torch的全局随机数
+AgentFactoryType = Callable[[int, int], Agent]
+
+# duplicate赛制的评估：每一组（set）用同一副牌墙和圈风进行n_players局，待评估的agent依次坐在每个座位，其余座位为基准agent
+# 牌运在同一组内相互抵消，每组的分差（待评估agent的得分减去同局基准agent的平均得分，按局平均）方差远小于单局
+# 各组分配到进程池中并行对局，按组的顺序流式返回结果，用序贯概率比检验（SPRT）在达到显著性后提前停止
+# SPRT检验H0：平均分差为null_difference，H1：平均分差为min_difference，分差近似正态分布，方差用样本方差估计
+class ChineseStandardMahjongDuplicateEvaluator:
+
+    EvaluateResultType = Dict[str, Any]
+    SetResultType = Dict[str, Any]
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+
+    _default_n_workers = 1
+    _default_max_sets = 1000
+    _default_min_sets = 8
+    _default_alpha = 0.05
+    _default_beta = 0.05
+    _default_null_difference = 0.0
+    _default_min_difference = 4.0
+    _default_seed = 0
+
+    def __init__(self, candidate:AgentFactoryType, baseline:AgentFactoryType, config:Union[Dict, None]=None):
+        self.candidate = candidate
+        self.baseline = baseline
+        self.config = dict() if config is None else config
+
+    # 对局进程数，为1时在当前进程中对局
+    @property
+    def n_workers(self) -> int:
+        return self.config.get('n_workers', self._default_n_workers)
+
+    # 最多进行的组数
+    @property
+    def max_sets(self) -> int:
+        return self.config.get('max_sets', self._default_max_sets)
+
+    # 至少进行的组数，之前不做检验（方差估计不可靠）
+    @property
+    def min_sets(self) -> int:
+        return self.config.get('min_sets', self._default_min_sets)
+
+    # 第一类错误率：错误接受H1的概率
+    @property
+    def alpha(self) -> float:
+        return self.config.get('alpha', self._default_alpha)
+
+    # 第二类错误率：错误接受H0的概率
+    @property
+    def beta(self) -> float:
+        return self.config.get('beta', self._default_beta)
+
+    # H0的每局平均分差
+    @property
+    def null_difference(self) -> float:
+        return self.config.get('null_difference', self._default_null_difference)
+
+    # H1的每局平均分差：希望检测出的最小提升
+    @property
+    def min_difference(self) -> float:
+        return self.config.get('min_difference', self._default_min_difference)
+
+    # 第i组使用种子seed+i生成牌墙，结果与进程数无关
+    @property
+    def seed(self) -> int:
+        return self.config.get('seed', self._default_seed)
+
+    @property
+    def start_method(self) -> Union[str, None]:
+        return self.config.get('start_method', None)
+
+    # SPRT的停止边界：对数似然比低于lower_bound接受H0，高于upper_bound接受H1
+    @property
+    def lower_bound(self) -> float:
+        return math.log(self.beta / (1 - self.alpha))
+
+    @property
+    def upper_bound(self) -> float:
+        return math.log((1 - self.beta) / self.alpha)
+
+    # 正态近似下n组分差的对数似然比
+    def llr(self, differences:np.ndarray) -> float:
+        n = len(differences)
+        if n < 2:
+            return 0.0
+        variance = max(float(differences.var(ddof=1)), 1e-9)
+        mu0, mu1 = self.null_difference, self.min_difference
+        return (mu1 - mu0) * (float(differences.sum()) - n * (mu0 + mu1) / 2) / variance
+
+    # 逐组进行对局，每组结束后返回这一组的结果和到目前为止的检验统计量，SPRT得出结论或达到max_sets后停止
+    def sets(self) -> Iterator[SetResultType]:
+        seeds = range(self.seed, self.seed + self.max_sets)
+        pool = None
+        if self.n_workers == 1:
+            results = (_play_set(self.candidate, self.baseline, seed) for seed in seeds)
+        else:
+            context = multiprocessing.get_context(self.start_method)
+            pool = context.Pool(self.n_workers, initializer=_init_worker, initargs=(self.candidate, self.baseline))
+            results = pool.imap(_play_worker_set, seeds)
+        differences = list()
+        try:
+            for scores in results:
+                # scores[r]为待评估agent坐在座位r时各座位的得分
+                candidate_scores = np.diagonal(scores)
+                baseline_scores = (scores.sum(axis=1) - candidate_scores) / (self._n_players - 1)
+                game_differences = candidate_scores - baseline_scores
+                differences.append(float(game_differences.mean()))
+                llr = self.llr(np.array(differences))
+                decision = None
+                if len(differences) >= self.min_sets:
+                    if llr >= self.upper_bound:
+                        decision = 'H1'
+                    elif llr <= self.lower_bound:
+                        decision = 'H0'
+                yield {
+                    'set' : len(differences) - 1,
+                    'candidate_scores' : candidate_scores,
+                    'game_differences' : game_differences,
+                    'difference' : differences[-1],
+                    'llr' : llr,
+                    'decision' : decision
+                }
+                if decision is not None:
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    # 进行评估直到停止，汇总结果
+    # naive_games：单局独立评估达到相同标准误差所需的局数，等于组数乘以单局分差方差与每组平均分差方差之比
+    def evaluate(self, callback:Union[Callable[[SetResultType], None], None]=None) -> EvaluateResultType:
+        start_time = time.perf_counter()
+        candidate_scores, game_differences, differences = list(), list(), list()
+        decision, llr = None, 0.0
+        for result in self.sets():
+            if callback is not None:
+                callback(result)
+            candidate_scores.append(result['candidate_scores'])
+            game_differences.append(result['game_differences'])
+            differences.append(result['difference'])
+            decision, llr = result['decision'], result['llr']
+        candidate_scores = np.concatenate(candidate_scores)
+        game_differences = np.concatenate(game_differences)
+        differences = np.array(differences)
+        n_sets, n_games = len(differences), len(game_differences)
+        set_variance = float(differences.var(ddof=1)) if n_sets > 1 else float('nan')
+        game_variance = float(game_differences.var(ddof=1)) if n_games > 1 else float('nan')
+        naive_games = n_sets * game_variance / set_variance if set_variance > 0 else float('nan')
+        return {
+            'sets' : n_sets,
+            'games' : n_games,
+            'mean_score' : float(candidate_scores.mean()),
+            'win_rate' : float((candidate_scores > 0).mean()),
+            'mean_difference' : float(differences.mean()),
+            'std_error' : math.sqrt(set_variance / n_sets) if n_sets > 1 else float('nan'),
+            'llr' : llr,
+            'decision' : decision if decision is not None else 'inconclusive',
+            'naive_games' : naive_games,
+            'variance_reduction' : naive_games / n_games,
+            'seconds' : time.perf_counter() - start_time
+        }
+
+# 用一组的种子生成牌墙和圈风，待评估的agent依次坐在每个座位，返回(n_players, n_players)的得分，第r行为坐在座位r的那一局
+def _play_set(candidate:AgentFactoryType, baseline:AgentFactoryType, seed:int) -> np.ndarray:
+    n_players = ChineseStandardMahjongEnv._n_players
+    rng = np.random.default_rng(seed)
+    cards = tuple(rng.permutation(np.array(ChineseStandardMahjongEnv._card_names * ChineseStandardMahjongEnv._n_duplicate_cards)).tolist())
+    prevalent_wind = int(rng.integers(1, ChineseStandardMahjongEnv._n_winds + 1))
+    scores = np.zeros((n_players, n_players), dtype=np.float64)
+    for rotation in range(n_players):
+        # 每一局每个座位的agent各自的种子，由组的种子和轮换决定
+        agent_seeds = np.random.SeedSequence([seed, rotation]).generate_state(n_players).tolist()
+        agents = [(candidate if player == rotation else baseline)(player, agent_seeds[player]) for player in range(n_players)]
+        env = ChineseStandardMahjongEnv({'cards' : cards, 'prevalent_wind' : prevalent_wind})
+        while not env.done:
+            action_space = env.action_space
+            if len(action_space) == 1:
+                env.step(action_space[0])
+                continue
+            env.step(agents[env.active_player].select_action(env.observation))
+        scores[rotation] = env.scores
+    return scores
+
+_worker_factories = None
+
+def _init_worker(candidate:AgentFactoryType, baseline:AgentFactoryType):
+    global _worker_factories
+    _worker_factories = (candidate, baseline)
+
+def _play_worker_set(seed:int) -> np.ndarray:
+    return _play_set(*_worker_factories, seed)
+
+def _random_agent(player:int, seed:int) -> Agent:
+    from random_mahjong_agent import RandomMahjongAgent
+    return RandomMahjongAgent(seed)
+
+def _shanten_agent(player:int, seed:int) -> Agent:
+    from shanten_mahjong_agent import ShantenMahjongAgent
+    return ShantenMahjongAgent(seed)
+
+if __name__ == '__main__':
+    # ShantenMahjongAgent对RandomMahjongAgent的评估：python duplicate_evaluator.py [进程数] [最多组数]
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    max_sets = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    evaluator = ChineseStandardMahjongDuplicateEvaluator(_shanten_agent, _random_agent, {
+        'n_workers' : n_workers,
+        'max_sets' : max_sets
+    })
+    def print_set(result:ChineseStandardMahjongDuplicateEvaluator.SetResultType):
+        print(f"set {result['set']}: difference {result['difference']:.2f}, llr {result['llr']:.2f}")
+    result = evaluator.evaluate(print_set)
+    for name, value in result.items():
+        print(f'{name}: {value:.4g}' if isinstance(value, float) else f'{name}: {value}')
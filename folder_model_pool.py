@@ -1,10 +1,19 @@
 import os
-from collections import OrderedDict
+import re
+import sys
+import copy
+import json
+import time
+import zlib
+import shutil
+import struct
+import threading
+from collections import OrderedDict, deque
 
 import numpy as np
 import torch
 
-from typing import Dict, Union, List
+from typing import Callable, Dict, Union, List, Tuple
 from model_pool import ModelPool
 
 class ChineseStandardMahjongModelPool(ModelPool):
@@ -17,11 +26,70 @@ class ChineseStandardMahjongModelPool(ModelPool):
     _default_model_pool_path = './model_pool'
     _tag_version_seperator = '_'
     _model_file_name_format = '{tag}' + f'{_tag_version_seperator}' + '{version}.pkl'
+    # mmap格式：所有张量连续存放的二进制文件，以及记录每个张量位置的json头
+    _blob_file_name_format = '{tag}' + f'{_tag_version_seperator}' + '{version}.bin'
+    _header_file_name_format = '{tag}' + f'{_tag_version_seperator}' + '{version}.json'
+    # delta格式：每隔keyframe_interval个版本保存一个完整的关键帧，其余版本保存与关键帧按位异或后压缩的增量
+    _delta_file_name_format = '{tag}' + f'{_tag_version_seperator}' + '{version}.delta'
+    # 动态int8量化的推理版本，第一次请求时生成，保存在原版本旁边
+    _quantized_file_name_format = '{tag}' + f'{_tag_version_seperator}' + '{version}.int8.pkl'
+    # 每种存储格式标志保存完成的文件的后缀
+    _format_extensions = {'pkl' : '.pkl', 'mmap' : '.json', 'delta' : '.delta'}
+    # mmap格式中每个张量的起始位置按64字节对齐
+    _blob_alignment = 64
+    
+    # 进程内模型缓存的默认容量：1GB
+    _default_cache_bytes = 1 << 30
+    
+    # 版本索引文件：每次保存后原地替换，读者只需读这一个文件就能知道有哪些版本
+    _index_file_name = 'index.json'
+    # 计算校验和时每次读入的字节数
+    _checksum_chunk_bytes = 1 << 24
+    # 保留策略的默认检查间隔（秒）
+    _default_retention_interval = 60.0
+    _default_keyframe_interval = 10
+    _default_compression_level = 6
+    # 异步保存时等待写入的快照数上限
+    _default_max_pending_saves = 1
     
     def __init__(self, config:Dict):
         self.config = config
         self._latest_version = 0
         self._file_names = list()
+        # 每个版本的tag和存储格式
+        self._tags = dict()
+        self._formats = dict()
+        # 进程内的模型缓存：handler -> (模型, 字节数)，按最近使用排序
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._cache_hits = 0
+        self._cache_misses = 0
+        # 磁盘上可用的版本：handler -> 索引条目，按版本号排序
+        self._index = OrderedDict()
+        # 上次读取时索引文件的(inode, mtime, 大小)，没有变化时不必重新读取
+        self._index_stat = None
+        # 保存模型和后台清理都会修改索引
+        self._index_lock = threading.Lock()
+        self._retention_thread = None
+        self._retention_stop = threading.Event()
+        # 异步保存：等待写入的(handler, tag, 格式, 快照)，由后台线程依次写入
+        self._save_queue = deque()
+        self._save_condition = threading.Condition()
+        self._n_writing = 0
+        # 后台线程正在写入的版本
+        self._writing_handler = None
+        self._writer_thread = None
+        self._writer_stop = False
+        self._writer_error = None
+        self._n_saved = 0
+        self._n_dropped = 0
+        self._n_coalesced = 0
+        # 写入delta格式时最近的关键帧：(版本, 张量布局, 每个张量的字节)
+        self._keyframe = None
+        # 读取delta格式时最近解码的关键帧：(版本, 每个张量的字节)
+        self._decoded_keyframe = None
+        # 重启的learner从索引中的最新版本继续编号
+        self.refresh()
     
     @property
     def size(self) -> int:
@@ -30,36 +98,700 @@ class ChineseStandardMahjongModelPool(ModelPool):
     @property
     def path(self) -> str:
         return self.config.get('path', self._default_model_pool_path)
+
+    # 存储格式：pkl为torch.save的文件；mmap为内存映射加载的二进制文件，同一节点上的进程共享同一版本的物理内存
+    # delta为关键帧加压缩增量，节省磁盘空间和带宽，加载时需要解压
+    @property
+    def format(self) -> str:
+        return self.config.get('format', 'pkl')
+
+    # 浮点张量的存储类型（float16或bfloat16），为None时按原类型存储；加载时恢复为float32
+    @property
+    def storage_dtype(self) -> Union[str, None]:
+        return self.config.get('storage_dtype', None)
+
+    # 生成量化版本时构造网络的函数，返回的网络需要能加载池中保存的state_dict，默认为ChineseStandardMahjongPolicyNetwork
+    @property
+    def network_factory(self) -> Callable[[], torch.nn.Module]:
+        network_factory = self.config.get('network_factory', None)
+        if network_factory is None:
+            from chinese_standard_mahjong_model import ChineseStandardMahjongPolicyNetwork
+            network_factory = ChineseStandardMahjongPolicyNetwork
+        return network_factory
+
+    # delta格式中关键帧的间隔（版本数）
+    @property
+    def keyframe_interval(self) -> int:
+        return self.config.get('keyframe_interval', self._default_keyframe_interval)
+
+    # delta格式的zlib压缩等级
+    @property
+    def compression_level(self) -> int:
+        return self.config.get('compression_level', self._default_compression_level)
+
+    # 缓存容量（字节），为0时不缓存
+    @property
+    def cache_bytes(self) -> int:
+        return self.config.get('cache_bytes', self._default_cache_bytes)
+
+    # 缓存统计：命中、未命中次数和当前缓存的字节数
+    @property
+    def cache_info(self) -> Dict[str, int]:
+        return {
+            'hits' : self._cache_hits,
+            'misses' : self._cache_misses,
+            'bytes' : self._cached_bytes,
+            'n_models' : len(self._cache)
+        }
+
+    # 保留策略，为None时不清理旧版本
+    # keep: 保留最新的版本数，不小于size；mode: delete删除或archive移动到archive_path；interval: 后台检查间隔（秒）
+    @property
+    def retention(self) -> Union[Dict, None]:
+        return self.config.get('retention', None)
+
+    # 磁盘上可用的版本，从旧到新
+    @property
+    def versions(self) -> List[ModelHandlerType]:
+        return list(self._index.keys())
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self.path, self._index_file_name)
+
+    # 是否异步保存：save_model只把模型快照到CPU内存，由后台线程写入磁盘
+    @property
+    def async_save(self) -> bool:
+        return self.config.get('async_save', False)
+
+    # 异步保存时最多等待写入的快照数，不含正在写入的一个
+    @property
+    def max_pending_saves(self) -> int:
+        return self.config.get('max_pending_saves', self._default_max_pending_saves)
+
+    # 等待写入的快照已满时的处理方式
+    # block: 等待写入完成；drop: 丢弃这次保存；coalesce: 用这次的快照替换最新一个等待写入的快照，沿用它的版本号
+    @property
+    def backpressure(self) -> str:
+        return self.config.get('backpressure', 'block')
+
+    # 保存统计：已写入、丢弃、被合并的版本数和等待写入的快照数
+    @property
+    def save_info(self) -> Dict[str, int]:
+        return {
+            'saved' : self._n_saved,
+            'dropped' : self._n_dropped,
+            'coalesced' : self._n_coalesced,
+            'pending' : len(self._save_queue) + self._n_writing
+        }
     
-    def save_model(self, model:ModelType, tag:str='') -> ModelHandlerType:
+    # 异步保存时立即返回版本号，文件和索引写入完成后读者才能看到该版本；丢弃的保存返回None
+    # 合并的保存替换最新一个等待写入的快照并沿用它的版本号：之前的调用者和这次的调用者得到同一个版本号，写入的是这次的快照
+    # 因此返回过的版本号最终都会被写入
+    def save_model(self, model:ModelType, tag:str='') -> Union[ModelHandlerType, None]:
         assert self._tag_version_seperator not in tag
+        self._raise_writer_error()
+        self._start_retention()
         
-        file_name = self._model_file_name_format.format(tag=tag, version=self._latest_version)
-        
-        path = os.path.join(self.path, file_name)
+        if not self.async_save:
+            handler = self._next_version()
+            self._write_version(handler, tag, self.format, model)
+            return handler
+
+        snapshot = self._snapshot(model)
+        with self._save_condition:
+            if len(self._save_queue) >= self.max_pending_saves:
+                if self.backpressure == 'drop':
+                    self._n_dropped += 1
+                    return None
+                elif self.backpressure == 'coalesce':
+                    handler = self._save_queue[-1][0]
+                    self._save_queue[-1] = (handler, tag, self.format, snapshot)
+                    self._n_coalesced += 1
+                    return handler
+                elif self.backpressure == 'block':
+                    self._save_condition.wait_for(lambda : len(self._save_queue) < self.max_pending_saves or self._writer_error is not None)
+                    self._raise_writer_error()
+                else:
+                    raise ValueError(f'unknown backpressure: {self.backpressure}')
+            handler = self._next_version()
+            self._save_queue.append((handler, tag, self.format, snapshot))
+            self._save_condition.notify_all()
+        self._start_writer()
+        return handler
+
+    def _next_version(self) -> ModelHandlerType:
+        with self._index_lock:
+            handler = self._latest_version
+            self._latest_version += 1
+        return handler
 
-        torch.save(model, path)
+    # 复制到CPU内存，之后训练对参数的原地修改不影响等待写入的快照
+    @staticmethod
+    def _snapshot(model:ModelType) -> ModelType:
+        return OrderedDict(
+            (name, value.detach().to('cpu', copy=True) if isinstance(value, torch.Tensor) else copy.deepcopy(value))
+            for name, value in model.items()
+        )
+
+    # 写入一个版本的文件，完成后再加入索引
+    def _write_version(self, handler:ModelHandlerType, tag:str, model_format:str, model:ModelType):
+        os.makedirs(self.path, exist_ok=True)
+        storage_dtype = self.storage_dtype
+        if storage_dtype is not None:
+            model = self._cast_floating(model, getattr(torch, storage_dtype))
+        keyframe = None
+        if model_format == 'pkl':
+            file_name = self._save_pkl(model, tag, handler)
+            file_names = [file_name]
+        elif model_format == 'mmap':
+            file_name = self._save_mmap(model, tag, handler)
+            file_names = [self._blob_file_name_format.format(tag=tag, version=handler), file_name]
+        elif model_format == 'delta':
+            file_name, keyframe = self._save_delta(model, tag, handler)
+            file_names = [file_name]
+        else:
+            raise ValueError(f'unknown model format: {model_format}')
+        checksum, n_bytes = self._checksum(file_names)
         
-        handler = self._latest_version
         self._file_names.append(file_name)
-        self._latest_version += 1
-        return handler
+        self._tags[handler] = tag
+        self._formats[handler] = model_format
+        with self._index_lock:
+            self._index[handler] = {
+                'version' : handler,
+                'tag' : tag,
+                'format' : model_format,
+                'storage_dtype' : storage_dtype,
+                'keyframe' : keyframe,
+                'files' : file_names,
+                'size' : n_bytes,
+                'timestamp' : time.time(),
+                'checksum' : checksum
+            }
+            self._write_index()
+        self._n_saved += 1
+
+    def _start_writer(self):
+        if self._writer_thread is not None:
+            return
+        self._writer_thread = threading.Thread(target=self._writer_loop, name='model-pool-writer', daemon=True)
+        self._writer_thread.start()
+
+    def _writer_loop(self):
+        while True:
+            with self._save_condition:
+                self._save_condition.wait_for(lambda : self._save_queue or self._writer_stop)
+                if not self._save_queue:
+                    return
+                job = self._save_queue.popleft()
+                self._n_writing += 1
+                self._writing_handler = job[0]
+                self._save_condition.notify_all()
+            try:
+                self._write_version(*job)
+            except Exception as e:
+                self._writer_error = e
+            finally:
+                with self._save_condition:
+                    self._n_writing -= 1
+                    self._writing_handler = None
+                    self._save_condition.notify_all()
+
+    # 后台写入的异常在下一次调用save_model或flush时抛出
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            error, self._writer_error = self._writer_error, None
+            raise error
+
+    # 版本是否还在等待异步写入或正在写入，调用者需持有_save_condition
+    def _is_pending(self, handler:ModelHandlerType) -> bool:
+        return handler == self._writing_handler or any(job[0] == handler for job in self._save_queue)
+
+    # 等待所有异步保存写入完成
+    def flush(self) -> None:
+        with self._save_condition:
+            self._save_condition.wait_for(lambda : not self._save_queue and self._n_writing == 0)
+        self._raise_writer_error()
+
+    # 版本所有文件的CRC32校验和与总字节数
+    def _checksum(self, file_names:List[str]) -> Tuple[str, int]:
+        checksum, n_bytes = 0, 0
+        for file_name in file_names:
+            with open(os.path.join(self.path, file_name), 'rb') as f:
+                for chunk in iter(lambda : f.read(self._checksum_chunk_bytes), b''):
+                    checksum = zlib.crc32(chunk, checksum)
+                    n_bytes += len(chunk)
+        return f'{checksum:08x}', n_bytes
+
+    # 检查版本的文件是否与索引中记录的校验和一致
+    def verify_model(self, handler:ModelHandlerType) -> bool:
+        self.refresh()
+        entry = self._index[handler]
+        return self._checksum(entry['files']) == (entry['checksum'], entry['size'])
+
+    # 原子地写入索引，调用者需持有_index_lock
+    def _write_index(self):
+        with open(self._index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'latest_version' : self._latest_version, 'versions' : list(self._index.values())}, f)
+        os.replace(self._index_path + '.tmp', self._index_path)
+        stat = os.stat(self._index_path)
+        self._index_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    # 读取其他进程更新的索引；索引文件没有变化时只需一次stat，不需要列目录
+    def refresh(self) -> None:
+        try:
+            stat = os.stat(self._index_path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._index_stat:
+            return
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        with self._index_lock:
+            self._index_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            entries = OrderedDict((entry['version'], entry) for entry in index['versions'])
+            # 读文件和加锁之间本进程的写入线程可能已经写入了更新的版本，保留比文件中最新版本还新的本地条目
+            newest = max(entries, default=-1)
+            entries.update((handler, entry) for handler, entry in self._index.items() if handler > newest)
+            self._index = entries
+            self._latest_version = max(self._latest_version, index['latest_version'])
+            for handler, entry in self._index.items():
+                self._tags[handler] = entry['tag']
+                self._formats[handler] = entry['format']
+        # 已被清理的版本不会再被采样，不再占用缓存
+        # 量化版本的缓存键为(handler, 'int8')
+        for key in [k for k in self._cache if (k[0] if isinstance(k, tuple) else k) not in self._index]:
+            self._cached_bytes -= self._cache.pop(key)[1]
+
+    # 将采样窗口之外的旧版本移出索引，再删除或归档其文件，返回被清理的版本
+    # 读者按新索引采样，不会再选中这些版本；已经以mmap格式加载的版本在文件删除后仍然可用
+    def apply_retention(self) -> List[ModelHandlerType]:
+        if self.retention is None:
+            return list()
+        keep = max(self.retention.get('keep', self.size), self.size)
+        with self._index_lock:
+            entries = list(self._index.values())
+            n_expired = max(0, len(entries) - keep)
+            # 保留的delta版本依赖的关键帧不能清理
+            keyframes = {entry.get('keyframe') for entry in entries[n_expired:]}
+            expired = [entry for entry in entries[:n_expired] if entry['version'] not in keyframes]
+            if not expired:
+                return list()
+            for entry in expired:
+                del self._index[entry['version']]
+            self._write_index()
+
+        mode = self.retention.get('mode', 'delete')
+        archive_path = self.retention.get('archive_path', os.path.join(self.path, 'archive'))
+        for entry in expired:
+            self._tags.pop(entry['version'], None)
+            self._formats.pop(entry['version'], None)
+            file_names = list(entry['files'])
+            # 读者生成的量化版本不在索引中，随原版本一起清理
+            quantized_file_name = self._quantized_file_name_format.format(tag=entry['tag'], version=entry['version'])
+            if os.path.exists(os.path.join(self.path, quantized_file_name)):
+                file_names.append(quantized_file_name)
+            if mode == 'archive':
+                os.makedirs(archive_path, exist_ok=True)
+                # 按保存时的顺序移动，标志保存完成的文件最后出现
+                for file_name in file_names:
+                    shutil.move(os.path.join(self.path, file_name), os.path.join(archive_path, file_name))
+            elif mode == 'delete':
+                for file_name in reversed(file_names):
+                    os.remove(os.path.join(self.path, file_name))
+            else:
+                raise ValueError(f'unknown retention mode: {mode}')
+        return [entry['version'] for entry in expired]
+
+    # 保存模型的进程在后台按保留策略定期清理
+    def _start_retention(self):
+        if self.retention is None or self._retention_thread is not None:
+            return
+        self._retention_thread = threading.Thread(target=self._retention_loop, name='model-pool-retention', daemon=True)
+        self._retention_thread.start()
+
+    def _retention_loop(self):
+        interval = self.retention.get('interval', self._default_retention_interval)
+        while not self._retention_stop.wait(interval):
+            try:
+                self.apply_retention()
+            except OSError as e:
+                print(f'model pool retention failed: {e!r}', file=sys.stderr)
+
+    # 写完等待中的异步保存，停止后台写入和清理线程
+    def close(self) -> None:
+        self.flush()
+        with self._save_condition:
+            self._writer_stop = True
+            self._save_condition.notify_all()
+        if self._writer_thread is not None:
+            self._writer_thread.join()
+            self._writer_thread = None
+        self._writer_stop = False
+        self._retention_stop.set()
+        if self._retention_thread is not None:
+            self._retention_thread.join()
+            self._retention_thread = None
+
+    def _save_pkl(self, model:ModelType, tag:str, version:int) -> str:
+        file_name = self._model_file_name_format.format(tag=tag, version=version)
+        # 先写临时文件再重命名，在目录中查找版本的读者不会读到不完整的文件
+        path = os.path.join(self.path, file_name)
+        torch.save(model, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return file_name
+
+    # 所有张量连续存放时每个张量的名称、类型、形状和起始位置，以及总字节数
+    @classmethod
+    def _blob_layout(cls, model:ModelType) -> Tuple[List[Dict], int]:
+        tensors = list()
+        offset = 0
+        for name, tensor in model.items():
+            assert isinstance(tensor, torch.Tensor), f'{name} is not a tensor'
+            offset += -offset % cls._blob_alignment
+            tensors.append({
+                'name' : name,
+                'dtype' : str(tensor.dtype).replace('torch.', ''),
+                'shape' : list(tensor.shape),
+                'offset' : offset
+            })
+            offset += tensor.numel() * tensor.element_size()
+        return tensors, offset
+
+    @staticmethod
+    def _tensor_bytes(tensor:torch.Tensor) -> np.ndarray:
+        return tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy()
+
+    # 在连续存放的字节上按布局构造张量视图
+    @staticmethod
+    def _model_from_blob(blob:torch.Tensor, tensors:List[Dict]) -> ModelType:
+        model = OrderedDict()
+        for tensor in tensors:
+            dtype = getattr(torch, tensor['dtype'])
+            n_bytes = int(np.prod(tensor['shape'], dtype=np.int64)) * torch.empty(0, dtype=dtype).element_size()
+            model[tensor['name']] = blob[tensor['offset'] : tensor['offset'] + n_bytes].view(dtype).view(tensor['shape'])
+        return model
+
+    # 浮点张量转为dtype，其余保持不变
+    @staticmethod
+    def _cast_floating(model:ModelType, dtype:torch.dtype) -> ModelType:
+        return OrderedDict(
+            (name, value.to(dtype) if isinstance(value, torch.Tensor) and value.is_floating_point() else value)
+            for name, value in model.items()
+        )
+
+    # 按字节位置重排：所有元素的第0个字节在前，然后是第1个字节，以此类推
+    # 异或后相同位置的字节（如符号和指数）大多为0，集中在一起更容易压缩
+    @staticmethod
+    def _shuffle_bytes(data:np.ndarray, itemsize:int) -> bytes:
+        return data.reshape(-1, itemsize).T.tobytes()
+
+    @staticmethod
+    def _unshuffle_bytes(data:bytes, itemsize:int) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.copy().reshape(-1)
+
+    # 文件内容为8字节的json头长度、json头、每个张量压缩后的字节；json头中keyframe为None表示这是关键帧
+    def _save_delta(self, model:ModelType, tag:str, version:int) -> Tuple[str, int]:
+        layout = [(name, str(tensor.dtype), list(tensor.shape)) for name, tensor in model.items()]
+        raw = {name : self._tensor_bytes(tensor) for name, tensor in model.items()}
+        is_keyframe = (
+            self._keyframe is None or self._keyframe[1] != layout
+            or version - self._keyframe[0] >= self.keyframe_interval
+        )
+        if is_keyframe:
+            # 复制一份，同步保存时训练会继续原地修改模型
+            self._keyframe = (version, layout, {name : data.copy() for name, data in raw.items()})
+        keyframe_version, _, keyframe_raw = self._keyframe
+
+        tensors, chunks, offset = list(), list(), 0
+        for name, tensor in model.items():
+            data = raw[name] if is_keyframe else np.bitwise_xor(raw[name], keyframe_raw[name])
+            chunk = zlib.compress(self._shuffle_bytes(data, tensor.element_size()), self.compression_level)
+            tensors.append({
+                'name' : name,
+                'dtype' : str(tensor.dtype).replace('torch.', ''),
+                'shape' : list(tensor.shape),
+                'offset' : offset,
+                'n_bytes' : len(chunk)
+            })
+            chunks.append(chunk)
+            offset += len(chunk)
+
+        header = json.dumps({'keyframe' : None if is_keyframe else keyframe_version, 'tensors' : tensors}).encode()
+        file_name = self._delta_file_name_format.format(tag=tag, version=version)
+        path = os.path.join(self.path, file_name)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(struct.pack('<q', len(header)))
+            f.write(header)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(path + '.tmp', path)
+        return file_name, keyframe_version
+
+    # 先写二进制文件再写json头，json头存在即说明保存完成
+    def _save_mmap(self, model:ModelType, tag:str, version:int) -> str:
+        blob_file_name = self._blob_file_name_format.format(tag=tag, version=version)
+        header_file_name = self._header_file_name_format.format(tag=tag, version=version)
+        tensors, n_bytes = self._blob_layout(model)
+        offset = 0
+        with open(os.path.join(self.path, blob_file_name), 'wb') as f:
+            for tensor in tensors:
+                f.write(bytes(tensor['offset'] - offset))
+                data = self._tensor_bytes(model[tensor['name']])
+                f.write(data.data)
+                offset = tensor['offset'] + data.nbytes
+        header_path = os.path.join(self.path, header_file_name)
+        with open(header_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'n_bytes' : n_bytes, 'tensors' : tensors}, f)
+        os.replace(header_path + '.tmp', header_path)
+        return header_file_name
+
+    # 查找版本的tag和存储格式；不是本进程保存的版本先查索引，没有索引的旧目录需要在目录中查找
+    def _locate(self, handler:ModelHandlerType) -> None:
+        if handler in self._tags:
+            return
+        self.refresh()
+        if handler in self._tags:
+            return
+        extensions = '|'.join(map(re.escape, self._format_extensions.values()))
+        pattern = re.compile(re.escape(self._tag_version_seperator) + f'{handler}' + f'({extensions})$')
+        for file_name in os.listdir(self.path):
+            match = pattern.search(file_name)
+            if match is not None:
+                self._tags[handler] = file_name[:file_name.rindex(self._tag_version_seperator)]
+                self._formats[handler] = next(k for k, v in self._format_extensions.items() if v == match.group(1))
+                return
+        raise FileNotFoundError(f'model version {handler} not found in {self.path}')
     
-    def load_model(self, handler:ModelHandlerType) -> ModelType:
-        path = os.path.join(self.path, self._model_file_name_format(tag=self._tags[handler], version=handler))
-        model = torch.load(path)
+    # 返回的模型可能被缓存共享，调用者不应原地修改
+    # quantized为True时返回动态int8量化的网络的state_dict，需要加载到chinese_standard_mahjong_model.quantize_network量化过的网络中
+    def load_model(self, handler:ModelHandlerType, quantized:bool=False) -> ModelType:
+        if quantized:
+            return self._load_quantized(handler)
+        if handler in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(handler)
+            return self._cache[handler][0]
+
+        self._cache_misses += 1
+        self._locate(handler)
+        if self._formats[handler] == 'mmap':
+            model = self._load_mmap(self._tags[handler], handler)
+        elif self._formats[handler] == 'delta':
+            model = self._load_delta(self._tags[handler], handler)
+        else:
+            model = self._load_pkl(self._tags[handler], handler)
+        # 以低精度存储的版本恢复为float32
+        if self._index.get(handler, dict()).get('storage_dtype') is not None:
+            model = self._cast_floating(model, torch.float32)
+        self._add_to_cache(handler, model)
+        return model
+
+    # 量化版本在第一次请求时由原版本生成并保存，之后的请求和其他进程直接加载
+    def _load_quantized(self, handler:ModelHandlerType) -> ModelType:
+        key = (handler, 'int8')
+        if key in self._cache:
+            self._cache_hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key][0]
+
+        self._cache_misses += 1
+        self._locate(handler)
+        path = os.path.join(self.path, self._quantized_file_name_format.format(tag=self._tags[handler], version=handler))
+        if os.path.exists(path):
+            model = torch.load(path)
+        else:
+            from chinese_standard_mahjong_model import quantize_network
+            network = self.network_factory()
+            network.load_state_dict(self.load_model(handler))
+            model = quantize_network(network.eval()).state_dict()
+            # 多个进程可能同时生成同一版本，各自写入临时文件后重命名
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            torch.save(model, tmp_path)
+            os.replace(tmp_path, path)
+        self._add_to_cache(key, model)
         return model
+
+    # 解压delta格式的文件，返回json头和每个张量的字节；增量版本与关键帧异或后还原
+    def _decode_delta(self, tag:str, version:int) -> Tuple[Dict, Dict[str, np.ndarray]]:
+        with open(os.path.join(self.path, self._delta_file_name_format.format(tag=tag, version=version)), 'rb') as f:
+            header_bytes, = struct.unpack('<q', f.read(8))
+            header = json.loads(f.read(header_bytes))
+            payload = f.read()
+        keyframe_raw = None if header['keyframe'] is None else self._keyframe_raw(header['keyframe'])
+        raw = dict()
+        for tensor in header['tensors']:
+            itemsize = torch.empty(0, dtype=getattr(torch, tensor['dtype'])).element_size()
+            data = self._unshuffle_bytes(zlib.decompress(payload[tensor['offset'] : tensor['offset'] + tensor['n_bytes']]), itemsize)
+            if keyframe_raw is not None:
+                np.bitwise_xor(data, keyframe_raw[tensor['name']], out=data)
+            raw[tensor['name']] = data
+        return header, raw
+
+    # 关键帧的字节，最近解码的关键帧会被保留，连续加载同一关键帧之后的版本时只需解码一次
+    def _keyframe_raw(self, version:int) -> Dict[str, np.ndarray]:
+        if self._decoded_keyframe is None or self._decoded_keyframe[0] != version:
+            self._locate(version)
+            _, raw = self._decode_delta(self._tags[version], version)
+            self._decoded_keyframe = (version, raw)
+        return self._decoded_keyframe[1]
+
+    def _load_delta(self, tag:str, version:int) -> ModelType:
+        header, raw = self._decode_delta(tag, version)
+        model = OrderedDict()
+        for tensor in header['tensors']:
+            # 关键帧的字节会被保留用于还原之后的版本，复制一份避免与返回的模型共享
+            data = raw[tensor['name']] if header['keyframe'] is not None else raw[tensor['name']].copy()
+            dtype = getattr(torch, tensor['dtype'])
+            if data.size == 0:
+                model[tensor['name']] = torch.empty(tensor['shape'], dtype=dtype)
+            else:
+                model[tensor['name']] = torch.from_numpy(data).view(dtype).view(tensor['shape'])
+        return model
+
+    def _load_pkl(self, tag:str, version:int) -> ModelType:
+        return torch.load(os.path.join(self.path, self._model_file_name_format.format(tag=tag, version=version)))
+
+    # 张量是私有内存映射（写时复制）上的视图，只读访问时各进程共享页缓存中的同一份数据
+    def _load_mmap(self, tag:str, version:int) -> ModelType:
+        with open(os.path.join(self.path, self._header_file_name_format.format(tag=tag, version=version)), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        if header['n_bytes'] == 0:
+            blob = torch.empty(0, dtype=torch.uint8)
+        else:
+            blob_path = os.path.join(self.path, self._blob_file_name_format.format(tag=tag, version=version))
+            blob = torch.from_file(blob_path, shared=False, size=header['n_bytes'], dtype=torch.uint8)
+        return self._model_from_blob(blob, header['tensors'])
+
+    # 模型中所有张量的字节数
+    @staticmethod
+    def _model_bytes(model:ModelType) -> int:
+        # 量化网络的权重和偏置以元组的形式存放
+        tensors = (t for value in model.values() for t in (value if isinstance(value, tuple) else (value,)))
+        return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+    # 加入缓存，超出容量时按最近最少使用淘汰
+    def _add_to_cache(self, handler:ModelHandlerType, model:ModelType):
+        n_bytes = self._model_bytes(model)
+        if n_bytes > self.cache_bytes:
+            return
+        self._cache[handler] = (model, n_bytes)
+        self._cached_bytes += n_bytes
+        while self._cached_bytes > self.cache_bytes:
+            _, (_, evicted_bytes) = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted_bytes
+
+    # 预先加载采样窗口内最新的size个版本
+    def warm_up(self) -> None:
+        self.refresh()
+        for handler in self.versions[-self.size:]:
+            self.load_model(handler)
     
+    # 从索引中最新的size个可用版本中采样
     def sample_model(self, n:int, dist:DistributionType='latest') -> List[ModelHandlerType]:
-        n_models = min(self.size, self._latest_version)
+        self.refresh()
+        return self._sample_versions(self.versions[-self.size:], n, dist)
+
+    @staticmethod
+    def _sample_versions(versions:List[ModelHandlerType], n:int, dist:DistributionType) -> List[ModelHandlerType]:
+        n_models = len(versions)
         assert n_models > 0
         
         if dist == 'uniform':
-            dist = np.ones(n_models) / self.size
+            dist = np.ones(n_models) / n_models
         elif dist == 'latest':
             dist = np.append(np.zeros(n_models-1), 1)
         
-        start_version = self._latest_version - n_models
-        end_version = self._latest_version
-        
-        return np.random.choice(range(start_version, end_version), size=n, p=dist).tolist()
\ No newline at end of file
+        return np.random.choice(versions, size=n, p=dist).tolist()
+
+# 读取/proc/self/smaps_rollup中的内存统计（KB）
+def _memory_usage_kb() -> Dict[str, int]:
+    usage = dict()
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in {'Rss:', 'Pss:'}:
+                usage[parts[0][:-1]] = int(parts[1])
+    return usage
+
+# 子进程中加载模型并读遍所有张量，返回加载耗时和内存增量
+def _benchmark_load(args) -> Dict[str, float]:
+    path, model_format, handler = args
+    pool = ChineseStandardMahjongModelPool({'path' : path, 'format' : model_format, 'cache_bytes' : 0})
+    before = _memory_usage_kb()
+    start_time = time.perf_counter()
+    model = pool.load_model(handler)
+    load_time = time.perf_counter() - start_time
+    sum(float(t.float().sum()) for t in model.values())
+    after = _memory_usage_kb()
+    return {'load' : load_time, 'rss' : after['Rss'] - before['Rss'], 'pss' : after['Pss'] - before['Pss']}
+
+# 模拟训练中连续保存的版本，比较各种编码的磁盘占用和加载（还原）耗时
+def _benchmark_encoding(n_params:int, n_versions:int):
+    import tempfile
+    n_layers = 10
+    encodings = {
+        'pkl' : {'format' : 'pkl'},
+        'delta' : {'format' : 'delta'},
+        'delta float16' : {'format' : 'delta', 'storage_dtype' : 'float16'},
+        'delta bfloat16' : {'format' : 'delta', 'storage_dtype' : 'bfloat16'}
+    }
+    for name, config in encodings.items():
+        generator = torch.Generator().manual_seed(0)
+        model = OrderedDict((f'layer{i}.weight', torch.randn(n_params // n_layers, generator=generator) * 0.05) for i in range(n_layers))
+        with tempfile.TemporaryDirectory() as path:
+            pool = ChineseStandardMahjongModelPool(dict(config, path=path, keyframe_interval=n_versions))
+            for _ in range(n_versions):
+                pool.save_model(model)
+                # 每个版本之间参数有微小变化
+                for tensor in model.values():
+                    tensor.add_(torch.randn(tensor.shape, generator=generator) * 1e-4)
+            n_bytes = sum(entry['size'] for entry in pool._index.values())
+            reader = ChineseStandardMahjongModelPool({'path' : path, 'cache_bytes' : 0})
+            start_time = time.perf_counter()
+            reader.load_model(n_versions - 1)
+            load_time = time.perf_counter() - start_time
+            print(
+                f'{name}: {n_versions} versions, {n_bytes / 2**20:.1f}MB, '
+                f'compression ratio {n_params * 4 * n_versions / n_bytes:.2f}, load latest {load_time * 1000:.2f}ms'
+            )
+
+if __name__ == '__main__':
+    # 编码基准：python folder_model_pool.py encoding [模型参数量(M)] [版本数]
+    if len(sys.argv) > 1 and sys.argv[1] == 'encoding':
+        _benchmark_encoding(
+            int(float(sys.argv[2]) * 1e6) if len(sys.argv) > 2 else 10_000_000,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        )
+        sys.exit()
+
+    # 加载耗时与内存基准：python folder_model_pool.py [模型参数量(M)] [进程数]
+    import tempfile
+    from multiprocessing import Pool
+
+    n_params = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 50_000_000
+    n_processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_layers = 10
+    model = OrderedDict((f'layer{i}.weight', torch.randn(n_params // n_layers)) for i in range(n_layers))
+    with tempfile.TemporaryDirectory() as path:
+        pool = ChineseStandardMahjongModelPool({'path' : path})
+        for model_format in ('pkl', 'mmap'):
+            pool.config['format'] = model_format
+            handler = pool.save_model(model, tag=model_format)
+            with Pool(n_processes) as process_pool:
+                results = process_pool.map(_benchmark_load, [(path, model_format, handler)] * n_processes)
+            print(
+                f'{model_format}: {n_params * 4 / 2**20:.0f}MB, {n_processes} processes, '
+                f'load {np.median([r["load"] for r in results]) * 1000:.2f}ms, '
+                f'rss/process {np.mean([r["rss"] for r in results]) / 1024:.0f}MB, '
+                f'total pss {sum(r["pss"] for r in results) / 1024:.0f}MB'
+            )
+        # 保存耗时：同步保存阻塞到写入完成，异步保存只在调用线程中复制一份快照
+        for async_save in (False, True):
+            pool = ChineseStandardMahjongModelPool({'path' : path, 'async_save' : async_save})
+            start_time = time.perf_counter()
+            pool.save_model(model)
+            save_time = time.perf_counter() - start_time
+            pool.close()
+            print(f'save (async_save={async_save}): {save_time * 1000:.2f}ms')
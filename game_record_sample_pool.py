@@ -0,0 +1,240 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Union
+
+import numpy as np
+
+from sample_pool import SamplePool
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+
+# 只存储对局记录的样本池：一局游戏完全由牌墙、风向和动作序列决定
+# 每局存储牌墙（144个牌编号）、圈风和0号玩家的门风、每一步的动作编号（uint8）和最终得分
+# 每一步决策都是一个样本，观测编码在抽到时用ChineseStandardMahjongEnv重放对局生成，并缓存最近解码的对局
+# 写满size局后覆盖最旧的对局
+class ChineseStandardMahjongGameRecordSamplePool(SamplePool):
+
+    # 一局游戏的记录：
+    # cards: 牌名或牌编号，顺序同ChineseStandardMahjongEnv的cards配置
+    # prevalent_wind: 圈风；seat_winds: 门风
+    # actions: 每一步的动作名或动作编号；scores: 每个玩家的最终得分
+    SampleType = Dict[str, Any]
+    # 一批样本：字段名 -> 第一维为batch的数组
+    BatchType = Dict[str, np.ndarray]
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+    _n_cards = len(ChineseStandardMahjongEnv._card_names) * ChineseStandardMahjongEnv._n_duplicate_cards
+    _card_names = ChineseStandardMahjongEnv._card_names
+    _action_names = ChineseStandardMahjongEnv._action_names
+
+    _default_size = 1 << 20
+    _default_cache_size = 256
+
+    def __init__(self, config:Dict):
+        self.config = config
+        self._cards = np.zeros((self.size, self._n_cards), dtype=np.uint8)
+        # 圈风、0号玩家的门风
+        self._winds = np.zeros((self.size, 2), dtype=np.uint8)
+        self._scores = np.zeros((self.size, self._n_players), dtype=np.int32)
+        self._n_plies = np.zeros(self.size, dtype=np.int64)
+        self._tags = np.zeros(self.size, dtype=np.int16)
+        # 每局的动作编号序列
+        self._actions = [b''] * self.size
+        self._cursor = 0
+        self._n_inserted = 0
+        self._tag_ids = dict()
+        # 步数的前缀和，用于按步均匀抽样，插入后失效
+        self._cumulative_plies = None
+        # 对局位置 -> 解码后的对局，按最近使用排序
+        self._decoded_games = OrderedDict()
+        self._rng = np.random.default_rng(self.config.get('seed', None))
+
+    # 容量（局数）
+    @property
+    def size(self) -> int:
+        return self.config.get('size', self._default_size)
+
+    # 缓存的解码后对局数
+    @property
+    def cache_size(self) -> int:
+        return self.config.get('cache_size', self._default_cache_size)
+
+    # 当前存储的对局数
+    @property
+    def n_games(self) -> int:
+        return min(self._n_inserted, self.size)
+
+    # 当前存储的样本（决策）数
+    @property
+    def n_samples(self) -> int:
+        return int(self._n_plies.sum())
+
+    # tag编号到tag
+    @property
+    def tag_names(self) -> List[str]:
+        return list(self._tag_ids.keys())
+
+    # 存储占用的字节数
+    @property
+    def n_bytes(self) -> int:
+        arrays = (self._cards, self._winds, self._scores, self._n_plies, self._tags)
+        return sum(array.nbytes for array in arrays) + sum(map(sys.getsizeof, self._actions)) + sys.getsizeof(self._actions)
+
+    def _tag_id(self, tag:str) -> int:
+        if tag not in self._tag_ids:
+            self._tag_ids[tag] = len(self._tag_ids)
+        return self._tag_ids[tag]
+
+    # 从一局结束的环境生成对局记录，actions为这一局依次执行的动作
+    @staticmethod
+    def game_record(env:ChineseStandardMahjongEnv, actions:Sequence[Union[str, int]]) -> SampleType:
+        return {
+            'cards' : sum(env._initial_hand_cards, ()) + sum(env._walls, ()),
+            'prevalent_wind' : env.prevalent_wind,
+            'seat_winds' : env.seat_winds,
+            'actions' : actions,
+            'scores' : env.scores
+        }
+
+    # 存储一局游戏的记录
+    def save_sample(self, sample:SampleType, tag:str=''):
+        i = self._cursor
+        cards, actions = sample['cards'], sample['actions']
+        self._cards[i] = [ChineseStandardMahjongEnv._card_ids[card] if isinstance(card, str) else card for card in cards]
+        self._winds[i] = (sample['prevalent_wind'], sample['seat_winds'][0])
+        self._scores[i] = sample['scores']
+        self._actions[i] = bytes(ChineseStandardMahjongEnv._action_ids[action] if isinstance(action, str) else int(action) for action in actions)
+        self._n_plies[i] = len(actions)
+        self._tags[i] = self._tag_id(tag)
+        self._decoded_games.pop(i, None)
+        self._cumulative_plies = None
+        self._cursor = (i + 1) % self.size
+        self._n_inserted += 1
+
+    # 按记录构造对局开始时的环境
+    def _initial_env(self, game:int) -> ChineseStandardMahjongEnv:
+        prevalent_wind, seat_wind = self._winds[game].tolist()
+        env = ChineseStandardMahjongEnv({
+            'cards' : tuple(self._card_names[card] for card in self._cards[game].tolist()),
+            'prevalent_wind' : prevalent_wind
+        })
+        # 门风经过轮转时与圈风不一致，需要重新初始化游戏状态
+        if env.seat_winds[0] != seat_wind:
+            env.seat_winds = tuple(env._next_wind(seat_wind, i) for i in range(self._n_players))
+            env._game_state_initializer()
+        return env
+
+    # 重放一局游戏，得到每一步决策的观测编码、合法动作掩码和决策的玩家
+    def decode_game(self, game:int) -> BatchType:
+        decoded = self._decoded_games.get(game)
+        if decoded is not None:
+            self._decoded_games.move_to_end(game)
+            return decoded
+        encoder = ChineseStandardMahjongEncoder
+        actions = self._actions[game]
+        n_plies = len(actions)
+        decoded = {
+            'observation' : np.empty((n_plies, encoder.observation_size), dtype=encoder.observation_dtype),
+            'mask' : np.empty((n_plies, encoder.n_actions), dtype=np.bool_),
+            'seat' : np.empty(n_plies, dtype=np.uint8)
+        }
+        env = self._initial_env(game)
+        for ply, action in enumerate(actions):
+            player = env.active_player
+            # 直接读取环境内部的观测，避免observation属性的深拷贝
+            encoder.encode_observation(env._observation, player, out=decoded['observation'][ply])
+            encoder.encode_action_mask(env.action_space, out=decoded['mask'][ply])
+            decoded['seat'][ply] = player
+            env.step(self._action_names[action])
+        self._decoded_games[game] = decoded
+        while len(self._decoded_games) > self.cache_size:
+            self._decoded_games.popitem(last=False)
+        return decoded
+
+    # 按(对局位置, 步数)取出一批样本，同一局的样本只重放一次
+    def gather(self, games:np.ndarray, plies:np.ndarray) -> BatchType:
+        encoder = ChineseStandardMahjongEncoder
+        batch_size = len(games)
+        batch = {
+            'observation' : np.empty((batch_size, encoder.observation_size), dtype=encoder.observation_dtype),
+            'mask' : np.empty((batch_size, encoder.n_actions), dtype=np.bool_),
+            'action' : np.empty(batch_size, dtype=np.int16),
+            'seat' : np.empty(batch_size, dtype=np.uint8),
+            'reward' : np.empty(batch_size, dtype=np.float32),
+            'tag' : self._tags[games],
+            'game' : games,
+            'ply' : plies
+        }
+        order = np.argsort(games, kind='stable')
+        unique_games, starts = np.unique(games[order], return_index=True)
+        for game, positions in zip(unique_games.tolist(), np.split(order, starts[1:])):
+            decoded = self.decode_game(game)
+            game_plies = plies[positions]
+            batch['observation'][positions] = decoded['observation'][game_plies]
+            batch['mask'][positions] = decoded['mask'][game_plies]
+            seats = decoded['seat'][game_plies]
+            batch['seat'][positions] = seats
+            batch['action'][positions] = np.frombuffer(self._actions[game], dtype=np.uint8)[game_plies]
+            batch['reward'][positions] = self._scores[game, seats]
+        return batch
+
+    # 在所有存储的决策中均匀随机抽取batch_size个样本
+    def load_batch(self, batch_size:int) -> BatchType:
+        assert self.n_games > 0
+        if self._cumulative_plies is None:
+            self._cumulative_plies = np.cumsum(self._n_plies)
+        samples = self._rng.integers(0, self._cumulative_plies[-1], size=batch_size)
+        games = np.searchsorted(self._cumulative_plies, samples, side='right')
+        plies = samples - (self._cumulative_plies[games] - self._n_plies[games])
+        return self.gather(games, plies)
+
+# 用RandomMahjongAgent进行一局游戏，返回对局记录
+def _play_random_game(seed:int) -> ChineseStandardMahjongGameRecordSamplePool.SampleType:
+    from random_mahjong_agent import RandomMahjongAgent
+    agent = RandomMahjongAgent()
+    env = ChineseStandardMahjongEnv({'seed' : seed})
+    actions = list()
+    while not env.done:
+        action = agent.select_action(env.observation)
+        actions.append(action)
+        env.step(action)
+    return ChineseStandardMahjongGameRecordSamplePool.game_record(env, actions)
+
+if __name__ == '__main__':
+    # 存储与解码基准：python game_record_sample_pool.py [对局数] [batch_size]
+    from ring_buffer_sample_pool import ChineseStandardMahjongRingBufferSamplePool
+
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    records = [_play_random_game(seed) for seed in range(n_games)]
+    pool = ChineseStandardMahjongGameRecordSamplePool({'size' : n_games, 'seed' : 0})
+    for record in records:
+        pool.save_sample(record)
+    ring_bytes = sum(int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize for _, shape, dtype in ChineseStandardMahjongRingBufferSamplePool._fields)
+    print(f'{pool.n_games} games, {pool.n_samples} decisions, {pool.n_bytes / pool.n_samples:.2f} bytes/sample (ring buffer: {ring_bytes} bytes/sample)')
+
+    # 重放得到的观测应与对局时一致
+    game = 0
+    decoded = pool.decode_game(game)
+    env = ChineseStandardMahjongEnv({'seed' : game})
+    for ply, action in enumerate(records[game]['actions']):
+        expected = ChineseStandardMahjongEncoder.encode_observation(env.observation, env.active_player)
+        assert np.array_equal(decoded['observation'][ply], expected) and decoded['seat'][ply] == env.active_player
+        env.step(action)
+
+    pool._decoded_games.clear()
+    start_time = time.perf_counter()
+    for game in range(n_games):
+        pool.decode_game(game)
+    elapsed = time.perf_counter() - start_time
+    print(f'replay: {n_games / elapsed:.1f} games/s, {pool.n_samples / elapsed:.0f} decisions/s')
+
+    for cache_size in (0, 16, n_games):
+        pool.config['cache_size'] = cache_size
+        pool._decoded_games.clear()
+        n_batches = 20
+        start_time = time.perf_counter()
+        for _ in range(n_batches):
+            pool.load_batch(batch_size)
+        print(f'load_batch({batch_size}), cache {cache_size} games: {n_batches / (time.perf_counter() - start_time):.2f} batches/s')
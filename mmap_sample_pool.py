@@ -0,0 +1,353 @@
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import platform
+import threading
+from typing import Dict, Iterable, Iterator, List, Union
+
+import numpy as np
+
+from sample_pool import SamplePool
+from ring_buffer_sample_pool import ChineseStandardMahjongRingBufferSamplePool
+
+# 磁盘上的样本池，样本总量可以超过内存
+# 样本为定长记录，字段同ChineseStandardMahjongRingBufferSamplePool，每个写入者（producer）只追加写入自己的分片文件：
+# {producer}.{分片号}.bin，每个分片最多shard_records条记录
+# 每个写入者维护一个很小的索引{producer}.index.json，记录每个分片已提交的记录数和tag名称，原子地替换
+# 读取端合并所有写入者的索引，通过内存映射按需读取记录，不需要加载整个分片
+class ChineseStandardMahjongMmapSamplePool(SamplePool):
+
+    SampleType = ChineseStandardMahjongRingBufferSamplePool.SampleType
+    BatchType = ChineseStandardMahjongRingBufferSamplePool.BatchType
+
+    _n_actions = ChineseStandardMahjongRingBufferSamplePool._n_actions
+    _fields = ChineseStandardMahjongRingBufferSamplePool._fields
+    # 按字段对齐的记录类型，读出的字段可以直接转为torch张量
+    _record_dtype = np.dtype([(name, dtype, shape) for name, shape, dtype in _fields], align=True)
+
+    _default_path = './sample_pool'
+    _index_file_suffix = '.index.json'
+    _shard_file_name_format = '{producer}.{shard:06d}.bin'
+    _default_shard_records = 1 << 20
+    _default_commit_interval = 4096
+    _default_prefetch_depth = 4
+
+    def __init__(self, config:Dict):
+        self.config = config
+        # 写入端：攒满commit_interval条记录后写入分片并更新索引
+        self._write_buffer = None
+        self._n_buffered = 0
+        self._file = None
+        self._producer_index = None
+        self._tag_ids = dict()
+        # 读取端：所有写入者的索引、每个分片在全局编号中的起始位置、打开的内存映射
+        self._indexes = dict()
+        self._index_stats = dict()
+        self._shards = list()
+        self._boundaries = np.zeros(1, dtype=np.int64)
+        self._tag_names = list()
+        self._tag_remaps = list()
+        self._memmaps = dict()
+        self._rng = np.random.default_rng(self.config.get('seed', None))
+
+    @property
+    def path(self) -> str:
+        return self.config.get('path', self._default_path)
+
+    # 写入者名称，同时写入的各个进程需要不同
+    @property
+    def producer(self) -> str:
+        return self.config.get('producer', f'{platform.node()}-{os.getpid()}')
+
+    @property
+    def shard_records(self) -> int:
+        return self.config.get('shard_records', self._default_shard_records)
+
+    # 每攒多少条记录写入一次，写入后读取端才能看到
+    @property
+    def commit_interval(self) -> int:
+        return self.config.get('commit_interval', self._default_commit_interval)
+
+    # 读取端可以读到的记录数，调用refresh后更新
+    @property
+    def size(self) -> int:
+        return int(self._boundaries[-1])
+
+    # 全局的tag名称，load_batch返回的tag字段是其中的编号
+    @property
+    def tag_names(self) -> List[str]:
+        return list(self._tag_names)
+
+    # 写入端
+
+    def _open_producer(self):
+        os.makedirs(self.path, exist_ok=True)
+        self._write_buffer = np.zeros(self.commit_interval, dtype=self._record_dtype)
+        index_path = os.path.join(self.path, self.producer + self._index_file_suffix)
+        if os.path.exists(index_path):
+            # 同名写入者重启后从新的分片开始写，之前未提交的记录被丢弃
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self._producer_index = json.load(f)
+        else:
+            self._producer_index = {'tags' : list(), 'shards' : list()}
+        self._tag_ids = {tag : i for i, tag in enumerate(self._producer_index['tags'])}
+
+    def _tag_id(self, tag:str) -> int:
+        if tag not in self._tag_ids:
+            self._tag_ids[tag] = len(self._producer_index['tags'])
+            self._producer_index['tags'].append(tag)
+        return self._tag_ids[tag]
+
+    def save_sample(self, sample:SampleType, tag:str=''):
+        if self._write_buffer is None:
+            self._open_producer()
+        i = self._n_buffered
+        buffer = self._write_buffer
+        buffer['observation'][i] = sample['observation']
+        buffer['mask'][i] = np.packbits(sample['mask'])
+        buffer['action'][i] = sample['action']
+        buffer['log_prob'][i] = sample['log_prob']
+        buffer['reward'][i] = sample['reward']
+        buffer['value'][i] = sample['value']
+        buffer['advantage'][i] = sample['advantage']
+        buffer['return'][i] = sample['return']
+        buffer['tag'][i] = self._tag_id(tag)
+        self._n_buffered += 1
+        if self._n_buffered == len(buffer):
+            self.flush()
+
+    # 批量写入，samples中每个字段的第一维为样本数
+    def save_samples(self, samples:BatchType, tag:str=''):
+        if self._write_buffer is None:
+            self._open_producer()
+        n, start = len(samples['action']), 0
+        tag_id = self._tag_id(tag)
+        while start < n:
+            i = self._n_buffered
+            count = min(n - start, len(self._write_buffer) - i)
+            for name, _, _ in self._fields:
+                if name == 'mask':
+                    values = np.packbits(samples['mask'][start : start + count], axis=1)
+                elif name == 'tag':
+                    values = tag_id
+                else:
+                    values = samples[name][start : start + count]
+                self._write_buffer[name][i : i + count] = values
+            self._n_buffered += count
+            start += count
+            if self._n_buffered == len(self._write_buffer):
+                self.flush()
+
+    # 把缓冲的记录追加到分片，再原子地更新索引；读取端只读取索引中已提交的记录
+    def flush(self):
+        if self._n_buffered == 0:
+            return
+        shards = self._producer_index['shards']
+        start = 0
+        while start < self._n_buffered:
+            if self._file is None or shards[-1]['n_records'] == self.shard_records:
+                self._open_shard()
+            count = min(self._n_buffered - start, self.shard_records - shards[-1]['n_records'])
+            self._file.write(self._write_buffer[start : start + count].tobytes())
+            shards[-1]['n_records'] += count
+            start += count
+        self._file.flush()
+        self._n_buffered = 0
+        index_path = os.path.join(self.path, self.producer + self._index_file_suffix)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._producer_index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def _open_shard(self):
+        if self._file is not None:
+            self._file.close()
+        shards = self._producer_index['shards']
+        file_name = self._shard_file_name_format.format(producer=self.producer, shard=len(shards))
+        self._file = open(os.path.join(self.path, file_name), 'wb')
+        shards.append({'file' : file_name, 'n_records' : 0})
+
+    def close(self):
+        if self._write_buffer is not None:
+            self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memmaps.clear()
+
+    # 读取端
+
+    # 重新读取有变化的写入者索引，更新可以读取的分片
+    def refresh(self):
+        changed = False
+        for index_path in glob.glob(os.path.join(glob.escape(self.path), '*' + self._index_file_suffix)):
+            stat = os.stat(index_path)
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._index_stats.get(index_path) == key:
+                continue
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self._indexes[index_path] = json.load(f)
+            self._index_stats[index_path] = key
+            changed = True
+        if not changed:
+            return
+
+        self._shards = list()
+        self._tag_remaps = list()
+        tag_ids = {tag : i for i, tag in enumerate(self._tag_names)}
+        for index_path in sorted(self._indexes):
+            index = self._indexes[index_path]
+            for tag in index['tags']:
+                if tag not in tag_ids:
+                    tag_ids[tag] = len(self._tag_names)
+                    self._tag_names.append(tag)
+            # 写入者的tag编号 -> 全局的tag编号
+            remap = np.array([tag_ids[tag] for tag in index['tags']] or [0], dtype=np.int16)
+            for shard in index['shards']:
+                if shard['n_records'] > 0:
+                    self._shards.append((shard['file'], shard['n_records']))
+                    self._tag_remaps.append(remap)
+        self._boundaries = np.cumsum([0] + [n for _, n in self._shards], dtype=np.int64)
+
+    # 分片的内存映射，分片增长后重新映射
+    def _memmap(self, shard:int) -> np.memmap:
+        file_name, n_records = self._shards[shard]
+        memmap = self._memmaps.get(file_name)
+        if memmap is None or len(memmap) < n_records:
+            memmap = self._memmaps[file_name] = np.memmap(
+                os.path.join(self.path, file_name), dtype=self._record_dtype, mode='r', shape=(n_records,)
+            )
+        return memmap
+
+    # 按全局编号读取记录，同一分片内按顺序读取
+    def gather(self, indices:np.ndarray) -> BatchType:
+        records = np.empty(len(indices), dtype=self._record_dtype)
+        order = np.argsort(indices, kind='stable')
+        sorted_indices = indices[order]
+        splits = np.searchsorted(sorted_indices, self._boundaries)
+        for shard in range(len(self._shards)):
+            lo, hi = splits[shard], splits[shard+1]
+            if lo == hi:
+                continue
+            shard_records = np.take(self._memmap(shard), sorted_indices[lo:hi] - self._boundaries[shard])
+            shard_records['tag'] = self._tag_remaps[shard][shard_records['tag']]
+            records[order[lo:hi]] = shard_records
+        batch = {name : records[name] for name in self._record_dtype.names}
+        batch['mask'] = np.unpackbits(batch['mask'], axis=1, count=self._n_actions).view(np.bool_)
+        return batch
+
+    # 均匀随机抽取batch_size条记录
+    def load_batch(self, batch_size:int) -> BatchType:
+        if self.size == 0:
+            self.refresh()
+        assert self.size > 0
+        return self.gather(self._rng.integers(0, self.size, size=batch_size))
+
+    # 按顺序（或每轮打乱顺序）遍历当前可以读取的所有记录
+    def iterate_batches(self, batch_size:int, shuffle:bool=False) -> Iterator[BatchType]:
+        self.refresh()
+        size = self.size
+        order = self._rng.permutation(size) if shuffle else None
+        for start in range(0, size, batch_size):
+            if shuffle:
+                yield self.gather(order[start : start + batch_size])
+            else:
+                yield self.gather(np.arange(start, min(start + batch_size, size)))
+
+    # 在后台线程中读取batches，与训练步骤重叠；读取时的异常在迭代到该位置时抛出
+    # 例：pool.prefetch(pool.iterate_batches(4096, shuffle=True)) 或 pool.prefetch(pool.load_batch(4096) for _ in range(n))
+    # 后台线程会使用池的内存映射和随机数生成器，迭代期间不应在其他线程读取同一个池
+    def prefetch(self, batches:Iterable[BatchType], depth:Union[int, None]=None) -> Iterator[BatchType]:
+        depth = self.config.get('prefetch_depth', self._default_prefetch_depth) if depth is None else depth
+        prefetched = queue.Queue(maxsize=depth)
+        end = object()
+        stop = threading.Event()
+
+        def run():
+            try:
+                for batch in batches:
+                    if stop.is_set():
+                        return
+                    prefetched.put(batch)
+            except Exception as e:
+                prefetched.put(e)
+            prefetched.put(end)
+
+        thread = threading.Thread(target=run, name='sample-pool-prefetch', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = prefetched.get()
+                if item is end:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # 提前结束迭代时让后台线程退出
+            stop.set()
+            while thread.is_alive():
+                try:
+                    prefetched.get_nowait()
+                except queue.Empty:
+                    thread.join(0.01)
+
+# 子进程中作为一个写入者写入n条随机记录
+def _produce(args) -> float:
+    from ring_buffer_sample_pool import _random_samples
+    path, producer, n = args
+    pool = ChineseStandardMahjongMmapSamplePool({'path' : path, 'producer' : producer, 'shard_records' : 1 << 18})
+    samples = _random_samples(1000, np.random.default_rng(int(producer)))
+    start_time = time.perf_counter()
+    for _ in range(n // 1000):
+        pool.save_samples(samples, tag=f'producer{producer}')
+    pool.close()
+    return n / (time.perf_counter() - start_time)
+
+# 把分片从页缓存中逐出，使读取真正来自磁盘
+def _drop_page_cache(path:str):
+    for file_path in glob.glob(os.path.join(path, '*.bin')):
+        fd = os.open(file_path, os.O_RDONLY)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        os.close(fd)
+
+if __name__ == '__main__':
+    # 读写基准：python mmap_sample_pool.py [每个写入者的记录数] [写入者数] [batch_size] [模拟的训练步耗时(ms)]
+    import tempfile
+    from multiprocessing import Pool
+
+    n_records = int(float(sys.argv[1])) if len(sys.argv) > 1 else 500_000
+    n_producers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    step_time = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.02
+    n_batches = 100
+    with tempfile.TemporaryDirectory(dir='.') as path:
+        with Pool(n_producers) as process_pool:
+            rates = process_pool.map(_produce, [(path, str(i), n_records) for i in range(n_producers)])
+        print(f'{n_producers} producers: {sum(rates):.0f} records/s in total')
+
+        pool = ChineseStandardMahjongMmapSamplePool({'path' : path, 'seed' : 0})
+        pool.refresh()
+        print(f'{pool.size} records in {len(pool._shards)} shards, {pool._record_dtype.itemsize} bytes/record, tags {pool.tag_names}')
+
+        _drop_page_cache(path)
+        start_time = time.perf_counter()
+        n_sequential = 0
+        for batch in pool.iterate_batches(batch_size):
+            n_sequential += len(batch['action'])
+        print(f'sequential (cold): {n_sequential / (time.perf_counter() - start_time):.0f} records/s')
+
+        for use_prefetch in (False, True):
+            _drop_page_cache(path)
+            batches = (pool.load_batch(batch_size) for _ in range(n_batches))
+            start_time = time.perf_counter()
+            for batch in (pool.prefetch(batches) if use_prefetch else batches):
+                time.sleep(step_time)
+            elapsed = time.perf_counter() - start_time
+            print(
+                f'random batches (cold) with {step_time * 1000:.0f}ms train step, prefetch={use_prefetch}: '
+                f'{n_batches / elapsed:.1f} batches/s, read overhead {(elapsed / n_batches - step_time) * 1000:.2f}ms/batch'
+            )
+        pool.close()
@@ -1,2 +1,530 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import multiprocessing
+from functools import partial
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from agent import Agent
 from trainer import Trainer
-from chinese_standard_mahjong import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+from chinese_standard_mahjong_model import ChineseStandardMahjongPolicyNetwork
+from folder_model_pool import ChineseStandardMahjongModelPool
+from shared_memory_sample_pool import ChineseStandardMahjongSharedMemorySamplePool
+from advantage_estimator import ChineseStandardMahjongAdvantageEstimator
+from duplicate_evaluator import ChineseStandardMahjongDuplicateEvaluator, _random_agent
+from telemetry import MetricsSink
+
+# actor-learner结构的PPO训练
+# actor进程用模型池中最新的模型自我对弈，对手从ChineseStandardMahjongModelPool.sample_model中抽取，
+# 使用最新模型的座位在有多个合法动作时的决策作为样本，整条轨迹写入共享内存样本池
+# learner从样本池按批读取样本做PPO更新，每隔publish_interval次更新把模型保存到模型池
+# learner多于一个时每个learner是一个进程，用torch.distributed（gloo）平均梯度，0号learner负责保存模型和写日志
+# 给出metrics配置时，actor和learner的指标通过MetricsSink汇总写入文件，write_log的内容也由MetricsSink的后台线程写入
+# 样本的reward为该座位这一局的最终得分乘以reward_scale，只在最后一个决策给出；优势和回报由ChineseStandardMahjongAdvantageEstimator按GAE计算
+class ChineseStandardMahjongPPOTrainer(Trainer):
+
+    EvaluateResultType = Dict[str, float]
+    LogContentType = Dict[str, Any]
+
+    _default_n_actors = 4
+    _default_n_learners = 1
+    _default_batch_size = 1024
+    _default_learning_rate = 3e-4
+    _default_clip = 0.2
+    _default_value_coef = 0.5
+    _default_entropy_coef = 0.01
+    _default_max_grad_norm = 0.5
+    _default_reward_scale = 0.01
+    _default_gamma = 1.0
+    _default_gae_lambda = 0.95
+    _default_publish_interval = 10
+    _default_log_interval = 10.0
+    _default_evaluate_games = 200
+    _default_sample_tag = 'selfplay'
+
+    # actor的计数：对局数、样本数、对弈用时（秒）、等待模型和加载模型的空闲时间（秒）
+    _actor_stat_names = ('games', 'samples', 'play_seconds', 'idle_seconds')
+    # actor每次检查是否有可用模型的间隔（秒）
+    _model_wait_interval = 0.1
+
+    def __init__(self, config:Dict):
+        self.config = config
+        # 当前进程记录指标的MetricsSink或MetricsChannel
+        self._metrics = None
+
+    # ChineseStandardMahjongModelPool的配置
+    @property
+    def model_pool_config(self) -> Dict:
+        return self.config.get('model_pool', dict())
+
+    # ChineseStandardMahjongSharedMemorySamplePool的配置
+    @property
+    def sample_pool_config(self) -> Dict:
+        return self.config.get('sample_pool', dict())
+
+    # ChineseStandardMahjongPolicyNetwork的配置
+    @property
+    def network_config(self) -> Dict:
+        return self.config.get('network', dict())
+
+    @property
+    def n_actors(self) -> int:
+        return self.config.get('n_actors', self._default_n_actors)
+
+    @property
+    def n_learners(self) -> int:
+        return self.config.get('n_learners', self._default_n_learners)
+
+    # 每个learner每次更新的样本数
+    @property
+    def batch_size(self) -> int:
+        return self.config.get('batch_size', self._default_batch_size)
+
+    # 样本池中至少有多少样本时开始训练
+    @property
+    def min_samples(self) -> int:
+        return self.config.get('min_samples', self.batch_size)
+
+    @property
+    def learning_rate(self) -> float:
+        return self.config.get('learning_rate', self._default_learning_rate)
+
+    # PPO的裁剪范围
+    @property
+    def clip(self) -> float:
+        return self.config.get('clip', self._default_clip)
+
+    @property
+    def value_coef(self) -> float:
+        return self.config.get('value_coef', self._default_value_coef)
+
+    @property
+    def entropy_coef(self) -> float:
+        return self.config.get('entropy_coef', self._default_entropy_coef)
+
+    @property
+    def max_grad_norm(self) -> float:
+        return self.config.get('max_grad_norm', self._default_max_grad_norm)
+
+    # 得分到reward的缩放
+    @property
+    def reward_scale(self) -> float:
+        return self.config.get('reward_scale', self._default_reward_scale)
+
+    # 折扣因子
+    @property
+    def gamma(self) -> float:
+        return self.config.get('gamma', self._default_gamma)
+
+    # GAE的lambda
+    @property
+    def gae_lambda(self) -> float:
+        return self.config.get('gae_lambda', self._default_gae_lambda)
+
+    # 对手模型的抽样分布，见ChineseStandardMahjongModelPool.sample_model
+    @property
+    def opponent_dist(self) -> Union[str, np.ndarray]:
+        return self.config.get('opponent_dist', 'uniform')
+
+    # 每隔多少次更新保存一次模型
+    @property
+    def publish_interval(self) -> int:
+        return self.config.get('publish_interval', self._default_publish_interval)
+
+    # 训练的最大更新次数和最长时间（秒），为None时不限
+    @property
+    def max_updates(self) -> Union[int, None]:
+        return self.config.get('max_updates', None)
+
+    @property
+    def duration(self) -> Union[float, None]:
+        return self.config.get('duration', None)
+
+    # 写日志的间隔（秒）
+    @property
+    def log_interval(self) -> float:
+        return self.config.get('log_interval', self._default_log_interval)
+
+    # 日志文件，每行一个json；为None时只打印
+    @property
+    def log_path(self) -> Union[str, None]:
+        return self.config.get('log_path', None)
+
+    # MetricsSink的配置，为None时不收集指标
+    @property
+    def metrics_config(self) -> Union[Dict, None]:
+        return self.config.get('metrics', None)
+
+    # 评估最多进行的局数，duplicate评估每组n_players局
+    @property
+    def evaluate_games(self) -> int:
+        return self.config.get('evaluate_games', self._default_evaluate_games)
+
+    # ChineseStandardMahjongDuplicateEvaluator的配置，未给出max_sets时由evaluate_games决定
+    @property
+    def evaluator_config(self) -> Dict:
+        return self.config.get('evaluator', dict())
+
+    @property
+    def device(self) -> str:
+        return self.config.get('device', 'cpu')
+
+    # 启动actor和learner进程的方式，同时用于样本池的锁
+    @property
+    def start_method(self) -> Union[str, None]:
+        return self.sample_pool_config.get('start_method', None)
+
+    # 对局
+
+    # 按合法动作掩码采样一个动作，返回(动作编号, log概率, 价值)；greedy时选概率最大的动作
+    @staticmethod
+    def _select_action(network:torch.nn.Module, observation:np.ndarray, mask:np.ndarray, greedy:bool=False, generator:Union[torch.Generator, None]=None) -> Tuple[int, float, float]:
+        with torch.no_grad():
+            logits, value = network(torch.from_numpy(observation)[None], torch.from_numpy(mask)[None])
+            log_probs = F.log_softmax(logits[0], dim=-1)
+            if greedy:
+                action = int(log_probs.argmax())
+            else:
+                action = int(torch.multinomial(log_probs.exp(), 1, generator=generator))
+            return action, float(log_probs[action]), float(value[0])
+
+    def _new_network(self) -> ChineseStandardMahjongPolicyNetwork:
+        return ChineseStandardMahjongPolicyNetwork(self.network_config).eval()
+
+    # 进行一局游戏，networks为每个座位的网络，为None的座位使用RandomMahjongAgent
+    # 返回每个座位的轨迹（只包含有多个合法动作的决策）和最终得分
+    def _play_game(self, networks:List[Union[torch.nn.Module, None]], seed:Union[int, None]=None, greedy:bool=False) -> Tuple[List[Dict[str, List]], Tuple[int]]:
+        from random_mahjong_agent import RandomMahjongAgent
+        encoder = ChineseStandardMahjongEncoder
+        # 收集指标时同时统计环境热点方法的调用次数和耗时
+        env_config = {'profile' : self._metrics is not None}
+        if seed is not None:
+            env_config['seed'] = seed
+        env = ChineseStandardMahjongEnv(env_config)
+        random_agent = RandomMahjongAgent()
+        trajectories = [{'observation' : [], 'mask' : [], 'action' : [], 'log_prob' : [], 'value' : []} for _ in networks]
+        n_steps = 0
+        while not env.done:
+            n_steps += 1
+            player = env.active_player
+            action_space = env.action_space
+            # 只有一个合法动作（通常是Pass）时不需要网络决策，也不作为样本
+            if len(action_space) == 1:
+                env.step(action_space[0])
+                continue
+            network = networks[player]
+            if network is None:
+                env.step(random_agent.select_action(env.observation))
+                continue
+            observation = encoder.encode_observation(env._observation, player)
+            mask = encoder.encode_action_mask(action_space)
+            action, log_prob, value = self._select_action(network, observation, mask, greedy)
+            trajectory = trajectories[player]
+            trajectory['observation'].append(observation)
+            trajectory['mask'].append(mask)
+            trajectory['action'].append(action)
+            trajectory['log_prob'].append(log_prob)
+            trajectory['value'].append(value)
+            env.step(env.action_name(action))
+        if self._metrics is not None:
+            self._metrics.record('env_steps', n_steps)
+            for name, counter in env.profile_snapshot().items():
+                self._metrics.record(f'env_{name}_calls', counter['calls'])
+                self._metrics.record(f'env_{name}_seconds', counter['seconds'])
+        return trajectories, env.scores
+
+    # actor
+
+    # actor进程：每局开始前从模型池取最新模型和对手模型，对局结束后把最新模型各座位的轨迹写入样本池
+    def _run_actor(self, actor_id:int, sample_pool:ChineseStandardMahjongSharedMemorySamplePool, actor_stats:Any, stop_event:Any, metrics:Any=None):
+        torch.set_num_threads(1)
+        self._metrics = metrics
+        stats = np.frombuffer(actor_stats.get_obj(), dtype=np.float64).reshape(self.n_actors, len(self._actor_stat_names))[actor_id]
+        model_pool = ChineseStandardMahjongModelPool(self.model_pool_config)
+        estimator = ChineseStandardMahjongAdvantageEstimator({'gamma' : self.gamma, 'gae_lambda' : self.gae_lambda, 'reward_scale' : self.reward_scale})
+        # handler -> 网络，只保留最近用到的几个
+        networks = OrderedDict()
+        rng = np.random.default_rng()
+        n_players = ChineseStandardMahjongEnv._n_players
+        try:
+            while not stop_event.is_set():
+                idle_start = time.perf_counter()
+                model_pool.refresh()
+                if len(model_pool.versions) == 0:
+                    time.sleep(self._model_wait_interval)
+                    stats[3] += time.perf_counter() - idle_start
+                    continue
+                latest = model_pool.versions[-1]
+                handlers = [latest] + model_pool.sample_model(n_players - 1, self.opponent_dist)
+                rng.shuffle(handlers)
+                for handler in handlers:
+                    if handler not in networks:
+                        network = self._new_network()
+                        network.load_state_dict(model_pool.load_model(handler))
+                        networks[handler] = network
+                    networks.move_to_end(handler)
+                while len(networks) > n_players:
+                    networks.popitem(last=False)
+                play_start = time.perf_counter()
+                stats[3] += play_start - idle_start
+
+                trajectories, scores = self._play_game([networks[handler] for handler in handlers], seed=int(rng.integers(1 << 31)))
+                # 最新模型所在座位的决策拼成一局，由estimator按座位拆分并计算优势
+                players = [player for player, handler in enumerate(handlers) if handler == latest and len(trajectories[player]['action']) > 0]
+                if len(players) > 0:
+                    game = {name : np.concatenate([np.array(trajectories[player][name]) for player in players]) for name in trajectories[players[0]]}
+                    game['action'] = game['action'].astype(np.int16)
+                    game['log_prob'] = game['log_prob'].astype(np.float32)
+                    game['value'] = game['value'].astype(np.float32)
+                    game['seat'] = np.repeat(players, [len(trajectories[player]['action']) for player in players])
+                    game['scores'] = scores
+                    stats[1] += estimator.save_games([game], sample_pool, tag=self._default_sample_tag)
+                stats[0] += 1
+                play_seconds = time.perf_counter() - play_start
+                stats[2] += play_seconds
+                if metrics is not None:
+                    metrics.record('actor_game_seconds', play_seconds)
+                    metrics.record('actor_decisions', sum(len(trajectory['action']) for trajectory in trajectories))
+        finally:
+            if metrics is not None:
+                metrics.close()
+            model_pool.close()
+            sample_pool.close()
+
+    # learner
+
+    # PPO损失，返回(总损失, 各项损失和统计)
+    def _loss(self, network:torch.nn.Module, batch:Dict[str, np.ndarray]) -> Tuple[torch.Tensor, Dict[str, float]]:
+        device = self.device
+        observations = torch.from_numpy(batch['observation']).to(device)
+        masks = torch.from_numpy(batch['mask']).to(device)
+        actions = torch.from_numpy(batch['action'].astype(np.int64)).to(device)
+        old_log_probs = torch.from_numpy(batch['log_prob']).to(device)
+        advantages = torch.from_numpy(batch['advantage']).to(device)
+        returns = torch.from_numpy(batch['return']).to(device)
+
+        logits, values = network(observations, masks)
+        log_probs_all = F.log_softmax(logits, dim=-1)
+        log_probs = log_probs_all.gather(1, actions[:, None]).squeeze(1)
+        # 非法动作的log概率为-inf，计算熵时按0处理
+        entropy = -(log_probs_all.exp() * log_probs_all.masked_fill(~masks, 0)).sum(dim=-1).mean()
+
+        advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-8)
+        ratio = torch.exp(log_probs - old_log_probs)
+        policy_loss = -torch.min(ratio * advantages, ratio.clamp(1 - self.clip, 1 + self.clip) * advantages).mean()
+        value_loss = F.mse_loss(values, returns)
+        loss = policy_loss + self.value_coef * value_loss - self.entropy_coef * entropy
+        return loss, {
+            'policy_loss' : policy_loss.item(),
+            'value_loss' : value_loss.item(),
+            'entropy' : entropy.item(),
+            'clip_fraction' : ((ratio - 1).abs() > self.clip).float().mean().item()
+        }
+
+    # learner：等待样本池中有足够的样本后不断更新，rank为0的learner保存模型和写日志
+    def _run_learner(self, rank:int, sample_pool:ChineseStandardMahjongSharedMemorySamplePool, actor_stats:Any, init_file:Union[str, None]=None, metrics:Any=None):
+        self._metrics = metrics
+        distributed = self.n_learners > 1
+        if distributed:
+            torch.set_num_threads(1)
+            torch.distributed.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=self.n_learners)
+        network = ChineseStandardMahjongPolicyNetwork(self.network_config).to(self.device)
+        model_pool = ChineseStandardMahjongModelPool(self.model_pool_config) if rank == 0 else None
+        if distributed:
+            # 所有learner从同样的参数开始，之后每次更新后的梯度都相同
+            for parameter in network.parameters():
+                torch.distributed.broadcast(parameter.data, src=0)
+            learner_network = torch.nn.parallel.DistributedDataParallel(network)
+        else:
+            learner_network = network
+        optimizer = torch.optim.Adam(network.parameters(), lr=self.learning_rate)
+        if rank == 0:
+            model_pool.save_model(network.state_dict(), tag='ppo')
+
+        # 等待actor产生第一批样本
+        while sample_pool.n_samples < self.min_samples:
+            time.sleep(self._model_wait_interval)
+        start_time = time.perf_counter()
+        log_time, log_updates, log_compute_seconds, log_records = start_time, 0, 0.0, 0
+        log_losses = dict()
+        n_updates = 0
+        try:
+            while True:
+                load_start = time.perf_counter()
+                batch = sample_pool.load_batch(self.batch_size)
+                compute_start = time.perf_counter()
+                loss, losses = self._loss(learner_network, batch)
+                optimizer.zero_grad()
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(network.parameters(), self.max_grad_norm)
+                optimizer.step()
+                now = time.perf_counter()
+                log_compute_seconds += now - compute_start
+                n_updates += 1
+                log_updates += 1
+                log_records += self.batch_size
+                if metrics is not None:
+                    metrics.record('learner_load_seconds', compute_start - load_start)
+                    metrics.record('learner_step_seconds', now - compute_start)
+                for name, value in losses.items():
+                    log_losses[name] = log_losses.get(name, 0.0) + value
+
+                stop = (self.max_updates is not None and n_updates >= self.max_updates) or (self.duration is not None and now - start_time >= self.duration)
+                if distributed:
+                    # 所有learner必须在同一次更新后停止，否则其余learner会在梯度同步时一直等待
+                    flag = torch.tensor([float(stop)])
+                    torch.distributed.all_reduce(flag, op=torch.distributed.ReduceOp.MAX)
+                    stop = bool(flag.item())
+                if rank != 0:
+                    if stop:
+                        break
+                    continue
+
+                if n_updates % self.publish_interval == 0 or stop:
+                    model_pool.save_model(network.state_dict(), tag='ppo')
+                if now - log_time >= self.log_interval or stop:
+                    elapsed = now - log_time
+                    content = {'update' : n_updates, 'version' : model_pool.versions[-1] if model_pool.versions else None}
+                    content.update({name : value / log_updates for name, value in log_losses.items()})
+                    content['samples_per_second'] = log_records * self.n_learners / elapsed
+                    # learner用于计算的时间占比，其余时间在等待样本或保存模型
+                    content['learner_utilization'] = log_compute_seconds / elapsed
+                    content.update(self._actor_summary(actor_stats))
+                    pool_stats = sample_pool.stats()
+                    content['produced_records_per_second'] = pool_stats['producer_records_per_second']
+                    content['dropped_records'] = pool_stats['dropped_records']
+                    content['overwritten_records'] = pool_stats['overwritten_records']
+                    self.write_log(content)
+                    log_time, log_updates, log_compute_seconds, log_records = now, 0, 0.0, 0
+                    log_losses = dict()
+                if stop:
+                    break
+        finally:
+            if model_pool is not None:
+                model_pool.close()
+            if distributed:
+                torch.distributed.destroy_process_group()
+                sample_pool.close()
+                if metrics is not None:
+                    metrics.close()
+
+    # 所有actor的累计对局数、样本数和空闲时间占比
+    def _actor_summary(self, actor_stats:Any) -> Dict[str, float]:
+        stats = np.frombuffer(actor_stats.get_obj(), dtype=np.float64).reshape(self.n_actors, len(self._actor_stat_names))
+        games, samples, play_seconds, idle_seconds = stats.sum(axis=0)
+        return {
+            'games' : int(games),
+            'actor_samples' : int(samples),
+            'actor_idle_seconds' : float(idle_seconds),
+            'actor_idle_fraction' : float(idle_seconds / max(play_seconds + idle_seconds, 1e-9))
+        }
+
+    # 启动actor进程和learner，learner达到max_updates或duration后停止所有actor
+    def train(self):
+        context = multiprocessing.get_context(self.start_method)
+        sample_pool = ChineseStandardMahjongSharedMemorySamplePool(self.sample_pool_config)
+        actor_stats = context.Array('d', self.n_actors * len(self._actor_stat_names))
+        stop_event = context.Event()
+        sink = None
+        if self.metrics_config is not None:
+            sink = MetricsSink(dict({'start_method' : self.start_method}, **self.metrics_config))
+            sink.start()
+        actors = [
+            context.Process(target=self._run_actor, args=(i, sample_pool, actor_stats, stop_event, None if sink is None else sink.channel()), daemon=True)
+            for i in range(self.n_actors)
+        ]
+        for actor in actors:
+            actor.start()
+        try:
+            if self.n_learners == 1:
+                self._run_learner(0, sample_pool, actor_stats, metrics=sink)
+            else:
+                init_file = os.path.join(tempfile.gettempdir(), f'ppo_trainer_{os.getpid()}_{time.time_ns()}')
+                learners = [
+                    context.Process(target=self._run_learner, args=(rank, sample_pool, actor_stats, init_file, None if sink is None else sink.channel()))
+                    for rank in range(self.n_learners)
+                ]
+                for learner in learners:
+                    learner.start()
+                for learner in learners:
+                    learner.join()
+                if os.path.exists(init_file):
+                    os.remove(init_file)
+                assert all(learner.exitcode == 0 for learner in learners), 'learner failed'
+        finally:
+            stop_event.set()
+            for actor in actors:
+                actor.join()
+            sample_pool.close()
+            if sink is not None:
+                sink.stop()
+            self._metrics = None
+
+    # 模型池中最新的模型（贪心决策）与三个RandomMahjongAgent进行duplicate评估，同一副牌墙轮换座位，SPRT显著后提前停止
+    def evaluate(self) -> EvaluateResultType:
+        model_pool = ChineseStandardMahjongModelPool(self.model_pool_config)
+        try:
+            network = self._new_network()
+            network.load_state_dict(model_pool.load_model(model_pool.versions[-1]))
+        finally:
+            model_pool.close()
+        n_players = ChineseStandardMahjongEnv._n_players
+        config = dict({'max_sets' : max(1, self.evaluate_games // n_players)}, **self.evaluator_config)
+        evaluator = ChineseStandardMahjongDuplicateEvaluator(partial(NetworkMahjongAgent, network, greedy=True), _random_agent, config)
+        return evaluator.evaluate()
+
+    # 打印日志，收集指标时交给MetricsSink的后台线程写入，否则给出log_path时追加到日志文件
+    def write_log(self, content:LogContentType):
+        content = dict(content, time=time.time())
+        print(' '.join(f'{name}={value:.4g}' if isinstance(value, float) else f'{name}={value}' for name, value in content.items()), file=sys.stderr)
+        if self._metrics is not None:
+            self._metrics.write(dict(content, name='log'))
+        elif self.log_path is not None:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(content) + '\n')
+
+# 用网络决策的agent，环境的观测不包含座位，编码观测需要知道agent所在的座位player
+class NetworkMahjongAgent(Agent):
+
+    def __init__(self, network:torch.nn.Module, player:int, seed:Union[int, None]=None, greedy:bool=False):
+        super().__init__()
+        self.network = network
+        self.player = player
+        self.greedy = greedy
+        # 采样时使用的随机数生成器，没有给出种子时使用torch的全局随机数
+        self._generator = None if seed is None else torch.Generator().manual_seed(seed)
+
+    def select_action(self, obs:ChineseStandardMahjongEnv.ObservationType) -> ChineseStandardMahjongEnv.ActionNameType:
+        encoder = ChineseStandardMahjongEncoder
+        action_space = obs['action_space']
+        if len(action_space) == 1:
+            return action_space[0]
+        action, _, _ = ChineseStandardMahjongPPOTrainer._select_action(self.network, encoder.encode_observation(obs, self.player), encoder.encode_action_mask(action_space), self.greedy, self._generator)
+        return ChineseStandardMahjongEnv.action_name(action)
+
+if __name__ == '__main__':
+    # 短时间训练：python ppo_trainer.py [actor数] [learner数] [训练秒数]
+    n_actors = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    n_learners = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 60.0
+    with tempfile.TemporaryDirectory() as path:
+        trainer = ChineseStandardMahjongPPOTrainer({
+            'model_pool' : {'path' : path, 'size' : 8},
+            'sample_pool' : {'size' : 1 << 18},
+            'n_actors' : n_actors,
+            'n_learners' : n_learners,
+            'batch_size' : 256,
+            'duration' : duration,
+            'log_interval' : duration / 4
+        })
+        trainer.train()
+        print(trainer.evaluate())
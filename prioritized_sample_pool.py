@@ -0,0 +1,172 @@
+import sys
+import time
+from typing import Dict, Union
+
+import numpy as np
+
+from ring_buffer_sample_pool import ChineseStandardMahjongRingBufferSamplePool
+
+# 数组实现的求和树：叶子为每个位置的优先级，每个内部节点为两个子节点之和，根节点（编号1）为总和
+# 节点i的子节点为2i和2i+1，叶子j的编号为capacity+j；所有操作都按层向量化
+class SumTree:
+
+    def __init__(self, size:int):
+        self.capacity = 1 << max(0, int(size - 1).bit_length())
+        self._depth = self.capacity.bit_length() - 1
+        self._tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return float(self._tree[1])
+
+    def __getitem__(self, indices:Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        return self._tree[np.asarray(indices) + self.capacity]
+
+    # 设置一批位置的优先级，逐层重新计算受影响的父节点，每层O(k)，共O(k log n)
+    # 同一位置出现多次时以最后一次为准
+    def update(self, indices:Union[int, np.ndarray], priorities:Union[float, np.ndarray]):
+        tree = self._tree
+        if np.ndim(indices) == 0:
+            # 单个位置逐层向上，避免数组操作的开销
+            node = int(indices) + self.capacity
+            tree[node] = priorities
+            while node > 1:
+                node >>= 1
+                tree[node] = tree[2 * node] + tree[2 * node + 1]
+            return
+        nodes = np.asarray(indices, dtype=np.int64).reshape(-1) + self.capacity
+        tree[nodes] = priorities
+        # 排序一次后父节点仍然有序，每层只需去掉相邻的重复
+        nodes = np.sort(nodes)
+        for _ in range(self._depth):
+            nodes >>= 1
+            if len(nodes) > 1:
+                nodes = nodes[np.concatenate(([True], nodes[1:] != nodes[:-1]))]
+            tree[nodes] = tree[2 * nodes] + tree[2 * nodes + 1]
+
+    # 找到前缀和首次超过values的位置，所有values同时从根向下走
+    def find(self, values:np.ndarray) -> np.ndarray:
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self._depth):
+            left = 2 * nodes
+            left_sums = self._tree[left]
+            # 浮点误差可能使values略大于左子树之和，右子树为空时不能走向右边
+            go_right = (values >= left_sums) & (self._tree[left + 1] > 0)
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - self.capacity
+
+    # 分层抽样：把总和等分为n段，每段中均匀抽取一个值
+    def sample(self, n:int, rng:np.random.Generator) -> np.ndarray:
+        values = (np.arange(n) + rng.random(n)) * (self.total / n)
+        return self.find(values)
+
+# 按优先级抽样的样本池（Prioritized Experience Replay），存储同ChineseStandardMahjongRingBufferSamplePool
+# 样本被抽中的概率正比于priority ** alpha；新样本默认取目前最大的优先级，保证至少被抽到一次
+# 大番和牌、杠等少见的决策可以在写入时直接给出更高的优先级，learner训练后用update_priorities批量更新
+class ChineseStandardMahjongPrioritizedSamplePool(ChineseStandardMahjongRingBufferSamplePool):
+
+    _default_alpha = 0.6
+    _default_beta = 0.4
+    _default_epsilon = 1e-6
+
+    def __init__(self, config:Dict):
+        super().__init__(config)
+        self._tree = SumTree(self.size)
+        self._max_priority = 1.0
+
+    # 优先级的指数，0为均匀抽样
+    @property
+    def alpha(self) -> float:
+        return self.config.get('alpha', self._default_alpha)
+
+    # 重要性采样权重的指数，1为完全修正抽样偏差；可以在训练中逐渐增大
+    @property
+    def beta(self) -> float:
+        return self.config.get('beta', self._default_beta)
+
+    # 加到优先级上的小常数，避免优先级为0的样本永远不被抽到
+    @property
+    def epsilon(self) -> float:
+        return self.config.get('epsilon', self._default_epsilon)
+
+    # priority为None时取目前最大的优先级
+    def save_sample(self, sample:ChineseStandardMahjongRingBufferSamplePool.SampleType, tag:str='', priority:Union[float, None]=None):
+        index = self._cursor
+        super().save_sample(sample, tag)
+        self._set_priorities(index, self._max_priority if priority is None else priority)
+
+    # priorities为每个样本的优先级，为None时都取目前最大的优先级
+    def save_samples(self, samples:ChineseStandardMahjongRingBufferSamplePool.BatchType, tag:str='', priorities:Union[np.ndarray, None]=None):
+        n = len(samples['action'])
+        if priorities is None:
+            priorities = np.full(n, self._max_priority)
+        if n > self.size:
+            priorities = np.asarray(priorities)[n - self.size:]
+        cursor_after = (self._cursor + n) % self.size
+        super().save_samples(samples, tag)
+        n = min(n, self.size)
+        self._set_priorities((cursor_after - n + np.arange(n)) % self.size, priorities)
+
+    def _set_priorities(self, indices:Union[int, np.ndarray], priorities:Union[float, np.ndarray]):
+        priorities = np.asarray(priorities, dtype=np.float64)
+        if priorities.size > 0:
+            self._max_priority = max(self._max_priority, float(priorities.max()))
+        self._tree.update(indices, (priorities + self.epsilon) ** self.alpha)
+
+    # learner一步训练后批量更新样本的优先级（如TD误差或优势的绝对值），indices为load_batch返回的index
+    def update_priorities(self, indices:np.ndarray, priorities:np.ndarray):
+        self._set_priorities(indices, np.abs(priorities))
+
+    # 按优先级抽取batch_size个样本，额外返回样本位置index和重要性采样权重weight（按这一批的最大值归一化）
+    # 返回的数组是复用的输出缓冲区，下一次调用load_batch时会被覆盖
+    def load_batch(self, batch_size:int) -> ChineseStandardMahjongRingBufferSamplePool.BatchType:
+        assert self.n_samples > 0
+        indices = self._tree.sample(batch_size, self._rng)
+        batch = self.gather(indices)
+        probabilities = self._tree[indices] / self._tree.total
+        weights = (self.n_samples * probabilities) ** -self.beta
+        batch['index'] = indices
+        batch['weight'] = (weights / weights.max()).astype(np.float32)
+        return batch
+
+if __name__ == '__main__':
+    # 求和树基准：python prioritized_sample_pool.py [容量] [batch_size]
+    size = int(float(sys.argv[1])) if len(sys.argv) > 1 else 30_000_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    rng = np.random.default_rng(0)
+    tree = SumTree(size)
+    print(f'capacity {size}, tree {tree._tree.nbytes / 2**20:.0f}MB')
+
+    start_time = time.perf_counter()
+    chunk = 1 << 20
+    for start in range(0, size, chunk):
+        indices = np.arange(start, min(start + chunk, size))
+        tree.update(indices, rng.random(len(indices)))
+    print(f'fill: {size / (time.perf_counter() - start_time):.0f} priorities/s')
+
+    n_single = 10_000
+    indices = rng.integers(0, size, size=n_single)
+    start_time = time.perf_counter()
+    for i in range(n_single):
+        tree.update(int(indices[i]), 1.0)
+    print(f'single update: {n_single / (time.perf_counter() - start_time):.0f} updates/s')
+
+    n_batches = 100
+    start_time = time.perf_counter()
+    for _ in range(n_batches):
+        sampled = tree.sample(batch_size, rng)
+    print(f'sample({batch_size}): {n_batches / (time.perf_counter() - start_time):.0f} batches/s')
+
+    start_time = time.perf_counter()
+    for _ in range(n_batches):
+        tree.update(sampled, rng.random(batch_size))
+    print(f'bulk update({batch_size}): {n_batches / (time.perf_counter() - start_time):.0f} batches/s')
+    assert np.isclose(tree.total, tree._tree[tree.capacity:].sum())
+
+    # 优先级正比于抽中频率
+    small = SumTree(4)
+    small.update(np.arange(4), [1, 2, 3, 4])
+    counts = np.bincount(small.sample(100_000, rng), minlength=4)
+    print(f'sampling frequencies for priorities 1:2:3:4 -> {np.round(counts / counts[0], 2).tolist()}')
@@ -1,18 +1,50 @@
 
 import re
-import numpy as np
+from typing import Any, Sequence, Union
+
 from agent import Agent
 
 class RandomMahjongAgent(Agent):
-    def __init__(self):
+
+    # 优先选择的动作：和、杠、碰、吃
+    _preferred_action_pattern = r'Hu|Gang|Peng|Chi'
+
+    def __init__(self, seed:Union[int, None]=None):
         super().__init__()
-    
+        self._seed = seed
+        self._rng = None
+        # 每个动作编号是否优先选择，第一次批量决策时生成
+        self._preferred = None
+
     def select_action(self, obs):
-        action_space = obs['action_space']
-        np.random.shuffle(action_space)
+        # numpy在第一次决策时才导入，缩短Botzone首回合的启动时间
+        import numpy as np
+        # 复制后再打乱，不修改观测中的动作空间；给出种子时使用自己的随机数生成器，否则使用numpy的全局随机数
+        action_space = list(obs['action_space'])
+        if self._seed is None:
+            np.random.shuffle(action_space)
+        else:
+            if self._rng is None:
+                self._rng = np.random.default_rng(self._seed)
+            self._rng.shuffle(action_space)
         selected_action = action_space[0]
         for action in action_space:
-            if re.search(r'Hu|Gang|Peng|Chi', action) is not None:
+            if re.search(self._preferred_action_pattern, action) is not None:
                 selected_action = action
                 break
-        return selected_action
\ No newline at end of file
+        return selected_action
+
+    # 与select_action相同的策略：在合法的优先动作中均匀选择，没有优先动作时在所有合法动作中均匀选择
+    # 整批只调用一次随机数生成：每个合法动作取[0, 1)的随机数，优先动作再加1，取最大者
+    def select_actions(self, obs_batch:Any, mask_batch:Any, observations:Union[Sequence[Any], None]=None) -> Any:
+        import numpy as np
+        if self._rng is None:
+            self._rng = np.random.default_rng(self._seed)
+        if self._preferred is None:
+            from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+            self._preferred = np.array([re.search(self._preferred_action_pattern, name) is not None for name in ChineseStandardMahjongEnv._action_names])
+        mask_batch = np.asarray(mask_batch, dtype=np.bool_)
+        keys = self._rng.random(mask_batch.shape)
+        keys += self._preferred
+        keys[~mask_batch] = -1
+        return keys.argmax(axis=1)
@@ -0,0 +1,178 @@
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from sample_pool import SamplePool
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+
+# 预分配的环形缓冲区样本池：每个字段是一个容量为size的数组，写满后覆盖最旧的样本
+# 插入只写数组的一行，不创建逐样本的Python对象；load_batch用向量化的gather写入复用的输出缓冲区
+class ChineseStandardMahjongRingBufferSamplePool(SamplePool):
+
+    # 样本：字段名 -> 数组，mask为bool[n_actions]，其余字段见_fields
+    SampleType = Dict[str, np.ndarray]
+    # 一批样本：字段名 -> 第一维为batch的数组
+    BatchType = Dict[str, np.ndarray]
+
+    _n_actions = ChineseStandardMahjongEncoder.n_actions
+    # 合法动作掩码按位打包存储
+    _packed_mask_bytes = (_n_actions + 7) // 8
+
+    # 存储的字段：(名称, 每个样本的形状, 类型)
+    _fields = (
+        ('observation', (ChineseStandardMahjongEncoder.observation_size,), ChineseStandardMahjongEncoder.observation_dtype),
+        ('mask', (_packed_mask_bytes,), np.uint8),
+        ('action', (), np.int16),
+        ('log_prob', (), np.float32),
+        ('reward', (), np.float32),
+        ('value', (), np.float32),
+        # GAE优势和回报（价值的训练目标），见advantage_estimator
+        ('advantage', (), np.float32),
+        ('return', (), np.float32),
+        # save_sample的tag的编号，见tag_names
+        ('tag', (), np.int16)
+    )
+
+    _default_size = 1 << 20
+
+    def __init__(self, config:Dict):
+        self.config = config
+        # np.zeros分配的内存在第一次写入时才真正占用
+        self._arrays = {name : np.zeros((self.size,) + shape, dtype=dtype) for name, shape, dtype in self._fields}
+        self._cursor = 0
+        self._n_inserted = 0
+        self._tag_ids = dict()
+        self._rng = np.random.default_rng(self.config.get('seed', None))
+        # load_batch复用的输出缓冲区，容量为见过的最大batch_size
+        self._batch_buffers = dict()
+
+    # 容量
+    @property
+    def size(self) -> int:
+        return self.config.get('size', self._default_size)
+
+    # 当前存储的样本数
+    @property
+    def n_samples(self) -> int:
+        return min(self._n_inserted, self.size)
+
+    # 累计插入的样本数
+    @property
+    def n_inserted(self) -> int:
+        return self._n_inserted
+
+    # tag编号到tag
+    @property
+    def tag_names(self) -> List[str]:
+        return list(self._tag_ids.keys())
+
+    def _tag_id(self, tag:str) -> int:
+        if tag not in self._tag_ids:
+            self._tag_ids[tag] = len(self._tag_ids)
+        return self._tag_ids[tag]
+
+    def save_sample(self, sample:SampleType, tag:str=''):
+        i = self._cursor
+        arrays = self._arrays
+        arrays['observation'][i] = sample['observation']
+        arrays['mask'][i] = np.packbits(sample['mask'])
+        arrays['action'][i] = sample['action']
+        arrays['log_prob'][i] = sample['log_prob']
+        arrays['reward'][i] = sample['reward']
+        arrays['value'][i] = sample['value']
+        arrays['advantage'][i] = sample['advantage']
+        arrays['return'][i] = sample['return']
+        arrays['tag'][i] = self._tag_id(tag)
+        self._cursor = (i + 1) % self.size
+        self._n_inserted += 1
+
+    # 批量插入一段轨迹，samples中每个字段的第一维为样本数
+    def save_samples(self, samples:BatchType, tag:str=''):
+        n = len(samples['action'])
+        # 超过容量时只保留最后size个
+        if n > self.size:
+            samples = {name : values[n - self.size:] for name, values in samples.items()}
+            self._n_inserted += n - self.size
+            self._cursor = (self._cursor + n - self.size) % self.size
+            n = self.size
+        indices = (self._cursor + np.arange(n)) % self.size
+        for name, _, _ in self._fields:
+            if name == 'mask':
+                values = np.packbits(samples['mask'], axis=1)
+            elif name == 'tag':
+                values = self._tag_id(tag)
+            else:
+                values = samples[name]
+            self._arrays[name][indices] = values
+        self._cursor = (self._cursor + n) % self.size
+        self._n_inserted += n
+
+    def _batch_buffer(self, name:str, batch_size:int) -> np.ndarray:
+        buffer = self._batch_buffers.get(name)
+        if buffer is None or len(buffer) < batch_size:
+            array = self._arrays[name]
+            buffer = self._batch_buffers[name] = np.empty((batch_size,) + array.shape[1:], dtype=array.dtype)
+        return buffer[:batch_size]
+
+    # 均匀随机抽取batch_size个样本
+    # 返回的数组是复用的输出缓冲区，下一次调用load_batch时会被覆盖，需要保留时应复制
+    def load_batch(self, batch_size:int) -> BatchType:
+        assert self.n_samples > 0
+        indices = self._rng.integers(0, self.n_samples, size=batch_size)
+        return self.gather(indices)
+
+    # 按样本位置取出一批样本，合法动作掩码解包为bool[n_actions]
+    def gather(self, indices:np.ndarray) -> BatchType:
+        batch = dict()
+        for name, array in self._arrays.items():
+            batch[name] = np.take(array, indices, axis=0, out=self._batch_buffer(name, len(indices)))
+        batch['mask'] = np.unpackbits(batch['mask'], axis=1, count=self._n_actions).view(np.bool_)
+        return batch
+
+# 随机生成的一条轨迹
+def _random_samples(n:int, rng:np.random.Generator) -> Dict[str, np.ndarray]:
+    encoder = ChineseStandardMahjongEncoder
+    return {
+        'observation' : rng.integers(0, 4, size=(n, encoder.observation_size), dtype=encoder.observation_dtype),
+        'mask' : rng.random((n, encoder.n_actions)) < 0.1,
+        'action' : rng.integers(0, encoder.n_actions, size=n, dtype=np.int16),
+        'log_prob' : rng.random(n, dtype=np.float32),
+        'reward' : rng.random(n, dtype=np.float32),
+        'value' : rng.random(n, dtype=np.float32),
+        'advantage' : rng.standard_normal(n, dtype=np.float32),
+        'return' : rng.random(n, dtype=np.float32)
+    }
+
+if __name__ == '__main__':
+    # 吞吐基准：python ring_buffer_sample_pool.py [容量] [插入样本数] [batch_size]
+    size = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10_000_000
+    n_inserts = int(float(sys.argv[2])) if len(sys.argv) > 2 else 1_000_000
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    rng = np.random.default_rng(0)
+    pool = ChineseStandardMahjongRingBufferSamplePool({'size' : size, 'seed' : 0})
+    record_bytes = sum(array[0].nbytes for array in pool._arrays.values())
+    print(f'capacity {size}, {record_bytes} bytes/sample, {size * record_bytes / 2**30:.2f}GB reserved')
+
+    n_single = min(n_inserts, 200_000)
+    samples = _random_samples(n_single, rng)
+    rows = [{name : values[i] for name, values in samples.items()} for i in range(n_single)]
+    start_time = time.perf_counter()
+    for row in rows:
+        pool.save_sample(row)
+    print(f'save_sample: {n_single / (time.perf_counter() - start_time):.0f} inserts/s')
+
+    trajectory_length = 100
+    trajectory = _random_samples(trajectory_length, rng)
+    start_time = time.perf_counter()
+    for _ in range(n_inserts // trajectory_length):
+        pool.save_samples(trajectory)
+    print(f'save_samples ({trajectory_length} per call): {n_inserts / (time.perf_counter() - start_time):.0f} inserts/s')
+
+    n_batches = 200
+    start_time = time.perf_counter()
+    for _ in range(n_batches):
+        pool.load_batch(batch_size)
+    elapsed = time.perf_counter() - start_time
+    print(f'load_batch({batch_size}) over {pool.n_samples} samples: {n_batches / elapsed:.1f} batches/s, {n_batches * batch_size / elapsed:.0f} samples/s')
@@ -0,0 +1,220 @@
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset
+
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+from advantage_estimator import ChineseStandardMahjongAdvantageEstimator
+from duplicate_evaluator import AgentFactoryType, _random_agent, _shanten_agent
+
+# 边对局边产生样本的数据集，用于torch.utils.data.DataLoader(dataset, batch_size=None)
+# 每个DataLoader worker（num_workers=0时为主进程）同时进行n_envs局，每个座位的agent由policy(player, seed)构造，没有给出policy时为RandomMahjongAgent
+# 同一时刻各局中同一座位的决策合并为一次select_actions；只有一个合法动作的决策直接执行，不作为样本
+# 一局结束后由ChineseStandardMahjongAdvantageEstimator按座位拆分并计算奖励，攒满batch_size个样本后返回一批张量
+# 每个worker的牌墙、风向和传给policy的种子由(seed, 全局分片号)决定，全局分片号 = shard * num_workers + worker编号，shard用于多个训练进程各自加载
+# 给出spill_path时同时把每一批写入ChineseStandardMahjongMmapSamplePool，每个分片是一个写入者
+class ChineseStandardMahjongSelfPlayDataset(IterableDataset):
+
+    # 一批样本：字段名 -> 第一维为batch_size的张量
+    BatchType = Dict[str, torch.Tensor]
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+    # 返回的字段；策略固定，log_prob和value为0，advantage和return为折扣后的最终奖励
+    _batch_fields = ('observation', 'mask', 'action', 'seat', 'reward', 'advantage', 'return')
+
+    _default_batch_size = 256
+    _default_n_envs = 16
+    _default_seed = 0
+    _default_shard = 0
+    _default_n_shards = 1
+    _default_spill_tag = 'selfplay'
+
+    def __init__(self, config:Union[Dict, None]=None, policy:Union[AgentFactoryType, None]=None):
+        super().__init__()
+        self.config = dict() if config is None else config
+        self.policy = policy
+
+    @property
+    def batch_size(self) -> int:
+        return self.config.get('batch_size', self._default_batch_size)
+
+    # 每个worker同时进行的对局数
+    @property
+    def n_envs(self) -> int:
+        return self.config.get('n_envs', self._default_n_envs)
+
+    @property
+    def seed(self) -> int:
+        return self.config.get('seed', self._default_seed)
+
+    # 当前训练进程的分片号和分片数，例如分布式训练的rank和world_size
+    @property
+    def shard(self) -> int:
+        return self.config.get('shard', self._default_shard)
+
+    @property
+    def n_shards(self) -> int:
+        return self.config.get('n_shards', self._default_n_shards)
+
+    # 每个worker进行的对局数，为None时不停止
+    @property
+    def max_games(self) -> Union[int, None]:
+        return self.config.get('max_games', None)
+
+    # ChineseStandardMahjongAdvantageEstimator的配置
+    @property
+    def estimator_config(self) -> Dict:
+        return self.config.get('estimator', dict())
+
+    # 样本另外写入的磁盘样本池目录，为None时不写入
+    @property
+    def spill_path(self) -> Union[str, None]:
+        return self.config.get('spill_path', None)
+
+    # (全局分片号, 全局分片数)
+    def _global_shard(self) -> Tuple[int, int]:
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, n_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        return self.shard * n_workers + worker_id, self.n_shards * n_workers
+
+    def __iter__(self) -> Iterator[BatchType]:
+        shard, _ = self._global_shard()
+        rng = np.random.default_rng(np.random.SeedSequence([self.seed, shard]))
+        spill_pool = None
+        if self.spill_path is not None:
+            from mmap_sample_pool import ChineseStandardMahjongMmapSamplePool
+            spill_pool = ChineseStandardMahjongMmapSamplePool({'path' : self.spill_path, 'producer' : f'selfplay-{self.seed}-{shard}'})
+        try:
+            for samples in self._sample_batches(rng):
+                if spill_pool is not None:
+                    spill_pool.save_samples(samples, tag=self._default_spill_tag)
+                yield {name : torch.from_numpy(samples[name]) for name in self._batch_fields}
+        finally:
+            if spill_pool is not None:
+                spill_pool.close()
+
+    # 不断对局，每攒满batch_size个样本返回一批numpy数组
+    def _sample_batches(self, rng:np.random.Generator) -> Iterator[Dict[str, np.ndarray]]:
+        encoder = ChineseStandardMahjongEncoder
+        estimator = ChineseStandardMahjongAdvantageEstimator(self.estimator_config)
+        policy = _random_agent if self.policy is None else self.policy
+        agents = [policy(player, int(rng.integers(1 << 31))) for player in range(self._n_players)]
+        envs = [None] * self.n_envs
+        steps = [None] * self.n_envs
+        n_started = 0
+        finished, n_finished_steps = list(), 0
+        leftover = None
+        while True:
+            # 推进每一局直到需要选择，结束的局换成新的一局
+            for i in range(self.n_envs):
+                while True:
+                    if envs[i] is None:
+                        if self.max_games is not None and n_started >= self.max_games:
+                            break
+                        envs[i] = ChineseStandardMahjongEnv({
+                            'seed' : int(rng.integers(1 << 31)),
+                            'prevalent_wind' : int(rng.integers(1, ChineseStandardMahjongEnv._n_winds + 1))
+                        })
+                        steps[i] = {'observation' : [], 'mask' : [], 'action' : [], 'seat' : []}
+                        n_started += 1
+                    env = envs[i]
+                    if env.done:
+                        finished.append(self._finish_game(steps[i], env.scores))
+                        n_finished_steps += len(steps[i]['action'])
+                        envs[i] = None
+                        continue
+                    action_space = env.action_space
+                    if len(action_space) > 1:
+                        break
+                    env.step(action_space[0])
+            active = [i for i in range(self.n_envs) if envs[i] is not None]
+
+            if n_finished_steps >= self.batch_size or (len(active) == 0 and len(finished) > 0):
+                samples = estimator.process(finished)
+                if leftover is not None:
+                    samples = {name : np.concatenate([leftover[name], samples[name]]) for name in samples}
+                finished, n_finished_steps = list(), 0
+                n = len(samples['action'])
+                for start in range(0, n - self.batch_size + 1, self.batch_size):
+                    yield self._with_policy_fields({name : values[start : start + self.batch_size] for name, values in samples.items()})
+                start = n - n % self.batch_size
+                leftover = {name : values[start:] for name, values in samples.items()}
+            if len(active) == 0:
+                if leftover is not None and len(leftover['action']) > 0:
+                    yield self._with_policy_fields(leftover)
+                return
+
+            # 各局中同一座位的决策合并为一次批量决策
+            players = np.array([envs[i].active_player for i in active])
+            observations = np.stack([encoder.encode_observation(envs[i]._observation, player) for i, player in zip(active, players)])
+            masks = np.stack([encoder.encode_action_mask(envs[i].action_space) for i in active])
+            actions = np.empty(len(active), dtype=np.int64)
+            for player in np.unique(players).tolist():
+                rows = np.flatnonzero(players == player)
+                actions[rows] = agents[player].select_actions(observations[rows], masks[rows], [envs[active[row]]._observation for row in rows.tolist()])
+            for row, i in enumerate(active):
+                game_steps = steps[i]
+                game_steps['observation'].append(observations[row])
+                game_steps['mask'].append(masks[row])
+                game_steps['action'].append(actions[row])
+                game_steps['seat'].append(players[row])
+                envs[i].step(ChineseStandardMahjongEnv.action_name(int(actions[row])))
+
+    # 一局结束后的记录，格式见ChineseStandardMahjongAdvantageEstimator.GameType
+    @staticmethod
+    def _finish_game(steps:Dict[str, List], scores:Tuple[int]) -> ChineseStandardMahjongAdvantageEstimator.GameType:
+        encoder = ChineseStandardMahjongEncoder
+        n = len(steps['action'])
+        return {
+            'observation' : np.array(steps['observation'], dtype=encoder.observation_dtype).reshape(n, encoder.observation_size),
+            'mask' : np.array(steps['mask'], dtype=np.bool_).reshape(n, encoder.n_actions),
+            'action' : np.array(steps['action'], dtype=np.int16),
+            'seat' : np.array(steps['seat'], dtype=np.int64),
+            'log_prob' : np.zeros(n, dtype=np.float32),
+            'value' : np.zeros(n, dtype=np.float32),
+            'scores' : np.array(scores)
+        }
+
+    # 补全样本池需要的字段，动作转为int64以便直接作为索引使用
+    @staticmethod
+    def _with_policy_fields(samples:Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        samples = dict(samples)
+        samples['action'] = samples['action'].astype(np.int64)
+        return samples
+
+if __name__ == '__main__':
+    # 吞吐基准：python selfplay_dataset.py [worker数] [batch数] [batch_size]
+    import tempfile
+    from torch.utils.data import DataLoader
+    from mmap_sample_pool import ChineseStandardMahjongMmapSamplePool
+
+    n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    n_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+
+    for name, policy in (('random', None), ('shanten', _shanten_agent)):
+        dataset = ChineseStandardMahjongSelfPlayDataset({'batch_size' : batch_size}, policy)
+        loader = DataLoader(dataset, batch_size=None, num_workers=n_workers)
+        start_time = time.perf_counter()
+        for i, batch in enumerate(loader):
+            assert batch['mask'][torch.arange(len(batch['action'])), batch['action']].all()
+            if i + 1 == n_batches:
+                break
+        print(f'{name} policy, {n_workers} workers: {n_batches * batch_size / (time.perf_counter() - start_time):.0f} samples/s')
+
+    # 不同分片的对局不同，同一分片可以复现
+    def first_batch(config:Dict) -> ChineseStandardMahjongSelfPlayDataset.BatchType:
+        return next(iter(ChineseStandardMahjongSelfPlayDataset(dict(config, batch_size=batch_size))))
+    assert torch.equal(first_batch({'shard' : 0})['observation'], first_batch({'shard' : 0})['observation'])
+    assert not torch.equal(first_batch({'shard' : 0})['observation'], first_batch({'shard' : 1})['observation'])
+
+    with tempfile.TemporaryDirectory() as path:
+        dataset = ChineseStandardMahjongSelfPlayDataset({'batch_size' : batch_size, 'max_games' : 20, 'spill_path' : path})
+        n_samples = sum(len(batch['action']) for batch in dataset)
+        pool = ChineseStandardMahjongMmapSamplePool({'path' : path})
+        pool.refresh()
+        print(f'20 games: {n_samples} samples, {pool.size} spilled to disk')
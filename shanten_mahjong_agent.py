@@ -0,0 +1,419 @@
+import sys
+import time
+from typing import Any, Sequence, Tuple, Union
+
+import numpy as np
+
+from agent import Agent
+from chinese_standard_mahjong_env import ChineseStandardMahjongEnv
+from chinese_standard_mahjong_encoder import ChineseStandardMahjongEncoder
+
+# 向听数（还差几张牌听牌，听牌为0，和牌为-1）的向量化计算
+# 一般型：8 - 2 * 面子数 - 搭子数 - 雀头，面子和搭子合计不超过4组，副露的吃碰杠计为面子
+# 手牌按花色分为字牌和万条饼四组，每组的牌数编码为5进制的键，查表得到该组用不超过j组块时2 * 面子数 + 搭子数的最大值（分有无雀头）
+# 四组的表项按组块数做max-plus卷积合并；没有副露时再与七对、十三幺取最小值（全不靠、组合龙不计算）
+# 决策时的候选手牌（打出、摸到、杠掉一种牌）只改变一组的键：预先合并另外三组的表项，每个候选只需查一组、合并一次
+
+_n_cards = len(ChineseStandardMahjongEnv._card_names)
+_max_blocks = 4
+# 不可能的组合
+_impossible = -64
+# 字牌、万、条、饼在牌编号中的范围
+_groups = ((0, 7, False), (7, 16, True), (16, 25, True), (25, 34, True))
+# 幺九牌和字牌
+_terminals = np.array([0, 1, 2, 3, 4, 5, 6, 7, 15, 16, 24, 25, 33])
+# 每种牌所在的组，以及在该组的键中的权重
+_tile_groups = np.concatenate([np.full(end - start, group) for group, (start, end, _) in enumerate(_groups)])
+_tile_powers = np.concatenate([5 ** np.arange(end - start, dtype=np.int64) for start, end, _ in _groups])
+# 字牌表和序数牌表拼接成一张表，序数牌的键加上字牌表的长度；手牌乘以_key_matrix再加_key_offsets得到四组的键
+_n_honor_keys = 5 ** (_groups[0][1] - _groups[0][0])
+_key_matrix = np.zeros((_n_cards, len(_groups)), dtype=np.int64)
+_key_matrix[np.arange(_n_cards), _tile_groups] = _tile_powers
+_key_offsets = np.array([0 if not sequences else _n_honor_keys for _, _, sequences in _groups], dtype=np.int64)
+# 表在第一次计算向听数时生成，生成约需1秒
+_block_tables = dict()
+
+# 生成一个花色的表：table[键][有无雀头][j] = 用不超过j组块时2 * 面子数 + 搭子数的最大值
+# 按牌数从少到多逐层计算：最小的一张牌要么单独剩下，要么作为雀头，要么与之后的牌组成刻子、顺子、对子、两面/边张/嵌张搭子
+def _build_block_table(n_tiles:int, sequences:bool) -> np.ndarray:
+    n_keys = 5 ** n_tiles
+    powers = 5 ** np.arange(n_tiles, dtype=np.int64)
+    keys = np.arange(n_keys, dtype=np.int64)
+    digits = (keys[:, None] // powers) % 5
+    counts = digits.sum(axis=1)
+    first = np.argmax(digits > 0, axis=1)
+    table = np.full((n_keys, 2, _max_blocks + 1), _impossible, dtype=np.int8)
+    table[0, 0] = 0
+    # 一手牌中同一花色最多14张
+    for n in range(1, 15):
+        layer = np.flatnonzero(counts == n)
+        rows = np.arange(len(layer))
+        layer_digits, i = digits[layer], first[layer]
+        best = np.full((len(layer), 2, _max_blocks + 1), _impossible, dtype=np.int16)
+
+        def option(valid:np.ndarray, removed:np.ndarray, value:int, block:bool, head:bool):
+            selected = np.flatnonzero(valid)
+            rest = table[layer[selected] - removed[selected]].astype(np.int16)
+            candidate = np.full_like(rest, _impossible)
+            if head:
+                candidate[:, 1] = rest[:, 0]
+            elif block:
+                candidate[:, :, 1:] = rest[:, :, :-1] + value
+            else:
+                candidate = rest
+            best[selected] = np.maximum(best[selected], candidate)
+
+        power, count = powers[i], layer_digits[rows, i]
+        option(np.ones(len(layer), dtype=np.bool_), power, 0, False, False)
+        option(count >= 2, 2 * power, 0, False, True)
+        option(count >= 2, 2 * power, 1, True, False)
+        option(count >= 3, 3 * power, 2, True, False)
+        if sequences:
+            has_next = i + 1 < n_tiles
+            has_next_2 = i + 2 < n_tiles
+            next_power = np.where(has_next, powers[np.minimum(i + 1, n_tiles - 1)], 0)
+            next_power_2 = np.where(has_next_2, powers[np.minimum(i + 2, n_tiles - 1)], 0)
+            next_count = np.where(has_next, layer_digits[rows, np.minimum(i + 1, n_tiles - 1)], 0)
+            next_count_2 = np.where(has_next_2, layer_digits[rows, np.minimum(i + 2, n_tiles - 1)], 0)
+            option((next_count > 0) & (next_count_2 > 0), power + next_power + next_power_2, 2, True, False)
+            option(next_count > 0, power + next_power, 1, True, False)
+            option(next_count_2 > 0, power + next_power_2, 1, True, False)
+        # 不超过j组块：对j取前缀最大值
+        best = np.maximum.accumulate(best, axis=2)
+        best[best < 0] = _impossible
+        table[layer] = best
+    return table
+
+def _tables() -> Tuple[np.ndarray, np.ndarray]:
+    if not _block_tables:
+        _block_tables['honor'] = _build_block_table(7, False)
+        _block_tables['suit'] = _build_block_table(9, True)
+        joint = np.concatenate([_block_tables['honor'], _block_tables['suit']]).astype(np.int16)
+        _block_tables['joint'] = joint
+        # 按组块数倒序并补上不可能的组合：第(_max_blocks - J + j)列为用J - j组块的表项，J - j < 0时不可能
+        _block_tables['reversed'] = np.concatenate([joint[:, :, ::-1], np.full_like(joint, _impossible)], axis=2)
+    return _block_tables['honor'], _block_tables['suit']
+
+def _joint_table() -> np.ndarray:
+    _tables()
+    return _block_tables['joint']
+
+def _reversed_table() -> np.ndarray:
+    _tables()
+    return _block_tables['reversed']
+
+# 合并两组表项时，每个输出(有无雀头, j)对应的(雀头在哪一组, 两组各用的组块数)，按展平后的下标给出，不足的用第一项补齐
+def _combine_indices() -> np.ndarray:
+    n = _max_blocks + 1
+    indices = [[[] for _ in range(n)] for _ in range(2)]
+    for head_a in range(2):
+        for head_b in range(2 - head_a):
+            for j_a in range(n):
+                for j_b in range(n - j_a):
+                    indices[head_a + head_b][j_a + j_b].append(((head_a * 2 + head_b) * n + j_a) * n + j_b)
+    width = max(len(cell) for row in indices for cell in row)
+    return np.array([[cell + cell[:1] * (width - len(cell)) for cell in row] for row in indices])
+
+_combine_index = _combine_indices()
+
+# a, b: (2, 5, N)，手牌维放在最后，按行取出时是连续的复制
+def _combine(a:np.ndarray, b:np.ndarray) -> np.ndarray:
+    sums = (a[:, None, :, None] + b[None, :, None, :]).reshape(-1, a.shape[-1])
+    return sums[_combine_index].max(axis=2)
+
+# hands: (N, 34)的手牌张数，n_melds: 每手牌副露（含暗杠）的组数，返回每手牌的向听数
+def shanten(hands:np.ndarray, n_melds:Union[np.ndarray, int]=0, special:bool=True) -> np.ndarray:
+    honor_table, suit_table = _tables()
+    hands = np.asarray(hands, dtype=np.int64)
+    if len(hands) == 0:
+        return np.zeros(0, dtype=np.int64)
+    n_melds = np.broadcast_to(np.asarray(n_melds, dtype=np.int64), len(hands))
+    values = list()
+    for start, end, sequences in _groups:
+        keys = hands[:, start:end] @ (5 ** np.arange(end - start, dtype=np.int64))
+        values.append((suit_table if sequences else honor_table)[keys].astype(np.int16).transpose(1, 2, 0))
+    combined = _combine(_combine(values[0], values[1]), _combine(values[2], values[3]))
+    rows = np.arange(len(hands))
+    blocks = _max_blocks - n_melds
+    result = 8 - 2 * n_melds - np.maximum(combined[0, blocks, rows], combined[1, blocks, rows] + 1)
+    if special:
+        concealed = n_melds == 0
+        # 七对：同样的四张可以算两对
+        seven_pairs = 6 - (hands // 2).sum(axis=1)
+        terminals = hands[:, _terminals]
+        thirteen_orphans = 13 - (terminals > 0).sum(axis=1) - (terminals >= 2).any(axis=1)
+        result = np.where(concealed, np.minimum(result, np.minimum(seven_pairs, thirteen_orphans)), result)
+    return result
+
+# 一批手牌，用于计算每手牌改变一种牌的张数后的向听数
+# 预先算出每手牌四组的键、每组之外另外三组合并后的表项，以及七对、十三幺用到的对子数、幺九种数、幺九对子数
+class _HandBatch:
+
+    def __init__(self, hands:np.ndarray, n_melds:np.ndarray):
+        table = _joint_table()
+        self.hands = hands
+        self.n_melds = n_melds
+        self.keys = hands @ _key_matrix + _key_offsets
+        # values[g]: (2, 5, N)
+        values = table[self.keys].transpose(1, 2, 3, 0)
+        low, high = _combine(values[0], values[1]), _combine(values[2], values[3])
+        # others: (N, 4, 2, 5)，按行取出候选对应的一组
+        self.others = np.stack([
+            _combine(values[1], high), _combine(values[0], high),
+            _combine(low, values[3]), _combine(low, values[2])
+        ]).transpose(3, 0, 1, 2)
+        self.pairs = (hands // 2).sum(axis=1)
+        terminals = hands[:, _terminals]
+        self.terminal_kinds = (terminals > 0).sum(axis=1)
+        self.terminal_pairs = (terminals >= 2).sum(axis=1)
+
+    # hands[rows]中tiles的张数加上deltas后的向听数，n_melds默认为原手牌的副露数
+    def shanten_after_change(self, rows:np.ndarray, tiles:np.ndarray, deltas:Union[np.ndarray, int], n_melds:Union[np.ndarray, None]=None) -> np.ndarray:
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if n_melds is None:
+            n_melds = self.n_melds[rows]
+        groups = _tile_groups[tiles]
+        others = self.others[rows, groups]
+        # 只需要合并结果中用blocks组块的两项：另外三组用j组块时，改变的一组用blocks - j组块
+        keys = self.keys[rows, groups] + deltas * _tile_powers[tiles]
+        blocks = _max_blocks - n_melds
+        columns = (_max_blocks - blocks)[:, None, None] + np.arange(_max_blocks + 1)
+        values = _reversed_table()[keys[:, None, None], np.arange(2)[:, None], columns]
+        no_head = (others[:, 0] + values[:, 0]).max(axis=1)
+        head = np.maximum(others[:, 0] + values[:, 1], others[:, 1] + values[:, 0]).max(axis=1)
+        result = 8 - 2 * n_melds - np.maximum(no_head, head + 1)
+        # 七对和十三幺只与改变的那种牌的张数有关
+        before = self.hands[rows, tiles]
+        after = before + deltas
+        seven_pairs = 6 - (self.pairs[rows] - before // 2 + after // 2)
+        is_terminal = _is_terminal[tiles]
+        kinds = self.terminal_kinds[rows] + is_terminal * ((after > 0).astype(np.int64) - (before > 0))
+        terminal_pairs = self.terminal_pairs[rows] + is_terminal * ((after >= 2).astype(np.int64) - (before >= 2))
+        thirteen_orphans = 13 - kinds - (terminal_pairs > 0)
+        return np.where(n_melds == 0, np.minimum(result, np.minimum(seven_pairs, thirteen_orphans)), result)
+
+    # 每手牌打出一张后的最小向听数
+    def best_discard_shanten(self) -> np.ndarray:
+        rows, tiles = np.nonzero(self.hands)
+        values = self.shanten_after_change(rows, tiles, -1)
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        return np.minimum.reduceat(values, starts)
+
+_is_terminal = np.zeros(_n_cards, dtype=np.int64)
+_is_terminal[_terminals] = 1
+
+# 贪心的牌效率agent：
+# 摸牌后打出使向听数最小的牌，向听数相同时选有效牌（使向听数减少的牌，按未见张数计）最多的；能和则和
+# 暗杠、补杠不增加向听数时杠；别人打出的牌，吃碰后（再打出最优的牌）向听数减少才吃碰，明杠不增加向听数时杠
+# 所有决策都在编码后的观测和合法动作掩码上批量计算，整批只调用一次随机数生成（用于打破平局）
+class ShantenMahjongAgent(Agent):
+
+    _n_players = ChineseStandardMahjongEnv._n_players
+    _offsets = ChineseStandardMahjongEncoder._offsets
+    _action_ids = ChineseStandardMahjongEnv._action_ids
+    _card_names = ChineseStandardMahjongEnv._card_names
+
+    # 每种动作在动作编号中的起始位置，以及吃牌动作对应的中间牌编号
+    _play_start = _action_ids['Play' + _card_names[0]]
+    _peng_start = _action_ids['Peng' + _card_names[0]]
+    _gang_start = _action_ids['Gang' + _card_names[0]]
+    _angang_start = _action_ids['AnGang' + _card_names[0]]
+    _bugang_start = _action_ids['BuGang' + _card_names[0]]
+    _chi_start = _action_ids['Chi' + ChineseStandardMahjongEnv._chiable_card_names[0]]
+    _chi_cards = np.array([ChineseStandardMahjongEnv._card_ids[card] for card in ChineseStandardMahjongEnv._chiable_card_names])
+
+    def __init__(self, seed:Union[int, None]=None):
+        super().__init__()
+        self._rng = np.random.default_rng(seed)
+
+    def select_action(self, obs:ChineseStandardMahjongEnv.ObservationType) -> ChineseStandardMahjongEnv.ActionNameType:
+        action_space = obs['action_space']
+        if len(action_space) == 1:
+            return action_space[0]
+        encoder = ChineseStandardMahjongEncoder
+        # 只用到自己的手牌和所有玩家的明牌之和，与编码视角无关
+        observation = encoder.encode_observation(obs, 0)
+        mask = encoder.encode_action_mask(action_space)
+        return ChineseStandardMahjongEnv.action_name(int(self.select_actions(observation[None], mask[None])[0]))
+
+    # 从编码后的观测中取出(自己的手牌, 自己的回合中摸到或别人打出的牌, 未见的每种牌的张数)
+    @classmethod
+    def _parse(cls, obs_batch:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        offsets = cls._offsets
+        hands = obs_batch[:, offsets['hand_card']:offsets['hand_card'] + _n_cards].astype(np.int64)
+        current = obs_batch[:, offsets['current_card']:offsets['current_card'] + _n_cards].astype(np.int64)
+        shown = obs_batch[:, offsets['shown_packs']:offsets['shown_packs'] + cls._n_players * _n_cards].reshape(-1, cls._n_players, _n_cards).sum(axis=1)
+        discarded = obs_batch[:, offsets['discard_histories']:offsets['discard_histories'] + cls._n_players * _n_cards].reshape(-1, cls._n_players, _n_cards).sum(axis=1)
+        hidden = obs_batch[:, offsets['hidden_pack']:offsets['hidden_pack'] + _n_cards]
+        unseen = np.maximum(4 - hands - current - shown - discarded - hidden, 0)
+        return hands, current, unseen
+
+    # 摸到后可能减少向听数的牌：同花色相差不超过2的序数牌、手中已有的字牌，没有副露时还有所有幺九牌（十三幺）
+    @staticmethod
+    def _relevant_draws(hands:np.ndarray, concealed:np.ndarray) -> np.ndarray:
+        present = hands > 0
+        relevant = present.copy()
+        suits = present[:, 7:].reshape(-1, 3, 9)
+        near = suits.copy()
+        for shift in (1, 2):
+            near[:, :, shift:] |= suits[:, :, :-shift]
+            near[:, :, :-shift] |= suits[:, :, shift:]
+        relevant[:, 7:] = near.reshape(-1, 27)
+        relevant[:, _terminals] |= concealed[:, None]
+        return relevant
+
+    def select_actions(self, obs_batch:Any, mask_batch:Any, observations:Union[Sequence[Any], None]=None) -> Any:
+        obs_batch = np.asarray(obs_batch)
+        mask_batch = np.asarray(mask_batch, dtype=np.bool_)
+        batch_size = len(obs_batch)
+        hands, current, unseen = self._parse(obs_batch)
+        # 打破平局用的随机数，小于分数的最小差值
+        noise = self._rng.random((batch_size, _n_cards)) * 0.5
+        # 默认选第一个合法动作
+        actions = mask_batch.argmax(axis=1)
+
+        can_hu = mask_batch[:, self._action_ids['Hu']]
+        plays = mask_batch[:, self._play_start:self._play_start + _n_cards]
+        own_turn = plays.any(axis=1) & ~can_hu
+        reaction = ~own_turn & ~can_hu & (mask_batch.sum(axis=1) > 1)
+        actions[can_hu] = self._action_ids['Hu']
+        if own_turn.any():
+            actions[own_turn] = self._select_own_turn(hands[own_turn], current[own_turn], unseen[own_turn], mask_batch[own_turn], noise[own_turn])
+        if reaction.any():
+            actions[reaction] = self._select_reaction(hands[reaction], current[reaction], mask_batch[reaction])
+        return actions
+
+    # 自己的回合：打牌、暗杠或补杠
+    def _select_own_turn(self, hands:np.ndarray, current:np.ndarray, unseen:np.ndarray, masks:np.ndarray, noise:np.ndarray) -> np.ndarray:
+        n = len(hands)
+        hands = hands + current
+        n_melds = (14 - hands.sum(axis=1)) // 3
+        plays = masks[:, self._play_start:self._play_start + _n_cards]
+
+        # 每种可打出的牌打出后的向听数
+        batch = _HandBatch(hands, n_melds)
+        rows, tiles = np.nonzero(plays)
+        discard_shanten = batch.shanten_after_change(rows, tiles, -1)
+        best = np.full(n, 99)
+        np.minimum.at(best, rows, discard_shanten)
+
+        # 向听数最小的打法的有效牌数：打出后的手牌作为新的一批，每种有效牌只改变一组
+        selected = np.flatnonzero(discard_shanten == best[rows])
+        selected_rows = rows[selected]
+        after_discard = hands[selected_rows]
+        after_discard[np.arange(len(selected)), tiles[selected]] -= 1
+        relevant = self._relevant_draws(hands, n_melds == 0) & (unseen > 0)
+        draw_rows, draws = np.nonzero(relevant[selected_rows])
+        after_draw_shanten = _HandBatch(after_discard, n_melds[selected_rows]).shanten_after_change(draw_rows, draws, 1)
+        improves = after_draw_shanten < best[selected_rows][draw_rows]
+        useful = np.bincount(draw_rows, weights=improves * unseen[selected_rows][draw_rows, draws], minlength=len(selected))
+
+        scores = np.full((n, _n_cards), -np.inf)
+        scores[rows, tiles] = -1000.0 * discard_shanten + noise[rows, tiles]
+        scores[rows[selected], tiles[selected]] += useful
+        actions = self._play_start + scores.argmax(axis=1)
+
+        # 杠后（补摸一张之前）的向听数不超过最优打法时杠
+        for start, removed, extra_meld in ((self._angang_start, 4, 1), (self._bugang_start, 1, 0)):
+            kong_rows, kong_tiles = np.nonzero(masks[:, start:start + _n_cards])
+            if len(kong_rows) == 0:
+                continue
+            keep = batch.shanten_after_change(kong_rows, kong_tiles, -removed, n_melds[kong_rows] + extra_meld) <= best[kong_rows]
+            actions[kong_rows[keep]] = start + kong_tiles[keep]
+        return actions
+
+    # 别人打出的牌：吃、碰、明杠或过
+    def _select_reaction(self, hands:np.ndarray, current:np.ndarray, masks:np.ndarray) -> np.ndarray:
+        n = len(hands)
+        n_melds = (13 - hands.sum(axis=1)) // 3
+        card = current.argmax(axis=1)
+        batch = _HandBatch(hands, n_melds)
+        now = batch.shanten_after_change(np.arange(n), card, 0)
+        actions = np.full(n, self._action_ids['Pass'])
+        best = now.copy()
+
+        # 明杠：不增加向听数时杠
+        gang_rows = np.flatnonzero(masks[np.arange(n), self._gang_start + card])
+        keep = batch.shanten_after_change(gang_rows, card[gang_rows], -3, n_melds[gang_rows] + 1) <= now[gang_rows]
+        actions[gang_rows[keep]] = self._gang_start + card[gang_rows[keep]]
+
+        # 吃碰：碰和每种吃法各是一个选项，选项后的向听数为再打出一张后的最小向听数，严格减少时选最小的
+        option_rows, option_actions, option_hands = list(), list(), list()
+        peng_rows = np.flatnonzero(masks[np.arange(n), self._peng_start + card])
+        after_peng = hands[peng_rows]
+        after_peng[np.arange(len(peng_rows)), card[peng_rows]] -= 2
+        option_rows.append(peng_rows)
+        option_actions.append(self._peng_start + card[peng_rows])
+        option_hands.append(after_peng)
+        chi_rows, chi_options = np.nonzero(masks[:, self._chi_start:self._chi_start + len(self._chi_cards)])
+        middles = self._chi_cards[chi_options]
+        after_chi = hands[chi_rows]
+        after_chi[np.arange(len(chi_rows)), card[chi_rows]] += 1
+        for offset in (-1, 0, 1):
+            after_chi[np.arange(len(chi_rows)), middles + offset] -= 1
+        option_rows.append(chi_rows)
+        option_actions.append(self._chi_start + chi_options)
+        option_hands.append(after_chi)
+
+        option_rows = np.concatenate(option_rows)
+        if len(option_rows) > 0:
+            option_actions = np.concatenate(option_actions)
+            option_shanten = _HandBatch(np.concatenate(option_hands), n_melds[option_rows] + 1).best_discard_shanten()
+            # 每行按向听数从大到小依次写入，最后留下最小的
+            for i in np.lexsort((-option_shanten, option_rows)):
+                row = option_rows[i]
+                if option_shanten[i] < best[row]:
+                    best[row] = option_shanten[i]
+                    actions[row] = option_actions[i]
+        return actions
+
+# 每个座位按agents中对应的agent进行一局游戏，返回各座位得分
+def _play_game(agents:Sequence[Agent], seed:int) -> Tuple[int]:
+    env = ChineseStandardMahjongEnv({'seed' : seed})
+    while not env.done:
+        env.step(agents[env.active_player].select_action(env.observation))
+    return env.scores
+
+if __name__ == '__main__':
+    # 速度和强度基准：python shanten_mahjong_agent.py [对局数]
+    from random_mahjong_agent import RandomMahjongAgent
+    from chinese_standard_mahjong_model import _generate_observations
+
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    start_time = time.perf_counter()
+    _tables()
+    print(f'table generation: {time.perf_counter() - start_time:.2f}s')
+
+    # 向听数的例子：九莲宝灯听牌、七对一向听、十三幺和牌
+    examples = {
+        '1112345678999W' : (np.bincount([7, 7, 7, 8, 9, 10, 11, 12, 13, 14, 15, 15, 15], minlength=_n_cards), 0),
+        'seven pairs 1-shanten' : (np.bincount([7, 7, 9, 9, 11, 11, 13, 13, 16, 16, 20, 25, 33], minlength=_n_cards), 1),
+        'thirteen orphans' : (np.bincount(list(_terminals) + [0], minlength=_n_cards), -1)
+    }
+    for name, (hand, expected) in examples.items():
+        value = int(shanten(hand[None])[0])
+        assert value == expected, (name, value)
+        print(f'{name}: shanten {value}')
+
+    agent = ShantenMahjongAgent(seed=0)
+    observations, masks = _generate_observations(n_games // 4)
+    # 只有一个合法动作的决策不需要agent，只统计有选择的决策
+    choices = masks.sum(axis=1) > 1
+    n_observations = len(observations)
+    observations, masks = observations[choices], masks[choices]
+    for batch_size in (1, 64, 1024):
+        start_time = time.perf_counter()
+        for i in range(0, len(observations), batch_size):
+            agent.select_actions(observations[i:i+batch_size], masks[i:i+batch_size])
+        elapsed = time.perf_counter() - start_time
+        print(f'batch {batch_size}: {len(observations) / elapsed:.0f} decisions/s ({len(observations)} of {n_observations} observations with a choice)')
+
+    n_players = ChineseStandardMahjongEnv._n_players
+    scores = list()
+    for game in range(n_games):
+        seat = game % n_players
+        agents = [agent if player == seat else RandomMahjongAgent() for player in range(n_players)]
+        scores.append(_play_game(agents, game)[seat])
+    scores = np.array(scores)
+    print(f'vs 3 RandomMahjongAgent over {n_games} games: mean score {scores.mean():.2f}, win rate {(scores > 0).mean() * 100:.1f}%')
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+from multiprocessing import shared_memory, resource_tracker
+from typing import Dict, List, Union
+
+import numpy as np
+import torch
+
+from folder_model_pool import ChineseStandardMahjongModelPool
+
+# 本进程创建的共享内存，连接时不应取消其在resource_tracker中的登记
+_created_segment_names = set()
+
+# 同一节点上learner到actor的权重广播：learner把每个新版本写入一次共享内存，actor直接从共享内存复制，不经过磁盘
+# 共享内存由一个控制段和n_slots个槽组成，版本v写入第v % n_slots个槽
+# 每个槽用seqlock保护：写入前后各将序号加1，读取前后序号相同且为偶数说明读取期间没有被改写
+# 所有版本仍然通过ChineseStandardMahjongModelPool保存到磁盘，已经被覆盖的版本从磁盘加载
+# 因此槽中的版本在异步写入磁盘完成之前不会被覆盖；发布的参数与磁盘上一样按storage_dtype存储，读取时恢复为float32
+class ChineseStandardMahjongSharedMemoryModelPool(ChineseStandardMahjongModelPool):
+
+    # 控制段头：槽数、每个槽的数据字节数、布局json的字节数、最新版本，之后是布局json
+    _control_header_format = '<4q'
+    # 槽头：序号、版本，之后是数据
+    _slot_header_format = '<2q'
+    _header_bytes = 64
+    # 读取时遇到正在写入的槽的重试次数
+    _max_read_retries = 3
+
+    def __init__(self, config:Dict):
+        super().__init__(config)
+        self._control = None
+        self._slots = list()
+        self._layout = None
+        self._slot_bytes = 0
+        # 创建共享内存的进程负责写入和最终删除
+        self._is_owner = False
+
+    # 共享内存的名称，默认由模型池路径决定，同一路径的learner和actor使用同一组共享内存
+    @property
+    def shm_name(self) -> str:
+        return self.config.get('shm_name', f'mahjong_model_pool_{zlib.crc32(os.path.abspath(self.path).encode()):08x}')
+
+    # 槽数，至少为size+1，写入新版本时不会覆盖采样窗口内的版本
+    @property
+    def n_slots(self) -> int:
+        return max(self.config.get('n_slots', self.size + 1), self.size + 1)
+
+    # 共享内存中的最新版本，只读取控制段中的一个整数；还没有版本时为None
+    @property
+    def latest_shared_version(self) -> Union[ChineseStandardMahjongModelPool.ModelHandlerType, None]:
+        if not self._attach():
+            return None
+        latest_version = struct.unpack_from(self._control_header_format, self._control.buf)[3]
+        return None if latest_version < 0 else latest_version
+
+    # 共享内存中可以读取的版本，从旧到新
+    def shared_versions(self) -> List[ChineseStandardMahjongModelPool.ModelHandlerType]:
+        if not self._attach():
+            return list()
+        versions = list()
+        for slot in self._slots:
+            seq, version = struct.unpack_from(self._slot_header_format, slot.buf)
+            if seq % 2 == 0 and version >= 0:
+                versions.append(version)
+        return sorted(versions)
+
+    # 保存到磁盘的同时发布到共享内存；异步保存时save_model立即返回，actor也能立即读到新版本
+    def save_model(self, model:ChineseStandardMahjongModelPool.ModelType, tag:str='') -> Union[ChineseStandardMahjongModelPool.ModelHandlerType, None]:
+        handler = super().save_model(model, tag)
+        if handler is not None:
+            self._publish(handler, model)
+        return handler
+
+    def _publish(self, handler:ChineseStandardMahjongModelPool.ModelHandlerType, model:ChineseStandardMahjongModelPool.ModelType):
+        storage_dtype = self.storage_dtype
+        if storage_dtype is not None:
+            model = self._cast_floating(model, getattr(torch, storage_dtype))
+        layout, n_bytes = self._blob_layout(model)
+        if self._control is None:
+            self._create(layout, n_bytes)
+        elif not self._is_owner:
+            raise RuntimeError(f'shared memory {self.shm_name} is owned by another process')
+        elif layout != self._layout:
+            raise ValueError('model layout differs from the layout of the shared memory')
+
+        slot = self._slots[handler % len(self._slots)]
+        seq, version = struct.unpack_from(self._slot_header_format, slot.buf)
+        # 槽中的旧版本还没有写入磁盘时，覆盖后读者将无处加载，等待写入完成；合并的保存覆盖的是同一版本，磁盘上最终也是这次的快照
+        if version >= 0 and version != handler:
+            with self._save_condition:
+                self._save_condition.wait_for(lambda : not self._is_pending(version))
+        struct.pack_into(self._slot_header_format, slot.buf, 0, seq + 1, -1)
+        for tensor in layout:
+            data = self._tensor_bytes(model[tensor['name']])
+            start = self._header_bytes + tensor['offset']
+            slot.buf[start : start + data.nbytes] = data
+        struct.pack_into(self._slot_header_format, slot.buf, 0, seq + 2, handler)
+        struct.pack_into('<q', self._control.buf, struct.calcsize('<3q'), handler)
+
+    # 创建控制段和所有槽，最后写入槽数，读者看到槽数不为0时所有段都已就绪
+    def _create(self, layout:List[Dict], n_bytes:int):
+        layout_json = json.dumps(layout).encode()
+        self._control = self._create_segment(self.shm_name, self._header_bytes + len(layout_json))
+        self._is_owner = True
+        self._slots = [self._create_segment(f'{self.shm_name}_{i}', self._header_bytes + max(n_bytes, 1)) for i in range(self.n_slots)]
+        for slot in self._slots:
+            struct.pack_into(self._slot_header_format, slot.buf, 0, 0, -1)
+        self._control.buf[self._header_bytes : self._header_bytes + len(layout_json)] = layout_json
+        self._layout = layout
+        self._slot_bytes = n_bytes
+        struct.pack_into(self._control_header_format, self._control.buf, 0, 0, n_bytes, len(layout_json), -1)
+        struct.pack_into('<q', self._control.buf, 0, self.n_slots)
+
+    # 之前的learner异常退出时留下的同名共享内存会被删除重建
+    @staticmethod
+    def _create_segment(name:str, size:int) -> shared_memory.SharedMemory:
+        try:
+            segment = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name, create=True, size=size)
+        _created_segment_names.add(name)
+        return segment
+
+    # 连接learner创建的共享内存，learner还没有发布过版本时返回False
+    def _attach(self) -> bool:
+        if self._control is not None:
+            return True
+        try:
+            control = self._attach_segment(self.shm_name)
+        except FileNotFoundError:
+            return False
+        n_slots, slot_bytes, layout_bytes, _ = struct.unpack_from(self._control_header_format, control.buf)
+        if n_slots == 0:
+            control.close()
+            return False
+        self._layout = json.loads(bytes(control.buf[self._header_bytes : self._header_bytes + layout_bytes]))
+        self._slots = [self._attach_segment(f'{self.shm_name}_{i}') for i in range(n_slots)]
+        self._slot_bytes = slot_bytes
+        self._control = control
+        return True
+
+    # 只连接的进程不应在退出时删除共享内存，取消resource_tracker的登记
+    @staticmethod
+    def _attach_segment(name:str) -> shared_memory.SharedMemory:
+        segment = shared_memory.SharedMemory(name)
+        if name not in _created_segment_names:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+    # 复制槽中的版本，版本已被覆盖或一直在写入时返回None
+    def _read_slot(self, handler:ChineseStandardMahjongModelPool.ModelHandlerType) -> Union[bytearray, None]:
+        slot = self._slots[handler % len(self._slots)]
+        for _ in range(self._max_read_retries):
+            seq, version = struct.unpack_from(self._slot_header_format, slot.buf)
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+            if version != handler:
+                return None
+            data = bytearray(slot.buf[self._header_bytes : self._header_bytes + self._slot_bytes])
+            if struct.unpack_from(self._slot_header_format, slot.buf) == (seq, version):
+                return data
+        return None
+
+    # 先查缓存，再从共享内存复制，最后从磁盘加载；量化版本由从共享内存读到的版本生成
+    def load_model(self, handler:ChineseStandardMahjongModelPool.ModelHandlerType, quantized:bool=False) -> ChineseStandardMahjongModelPool.ModelType:
+        if not quantized and handler not in self._cache and self._attach():
+            data = self._read_slot(handler)
+            if data is not None:
+                self._cache_misses += 1
+                blob = torch.frombuffer(data, dtype=torch.uint8) if self._slot_bytes > 0 else torch.empty(0, dtype=torch.uint8)
+                model = self._model_from_blob(blob, self._layout)
+                # 与从磁盘加载相同，以低精度发布的版本恢复为float32；读者的storage_dtype需与learner一致
+                if self.storage_dtype is not None:
+                    model = self._cast_floating(model, torch.float32)
+                self._add_to_cache(handler, model)
+                return model
+        return super().load_model(handler, quantized)
+
+    # 优先从共享内存中的版本采样，learner还没有发布时按磁盘上的索引采样
+    def sample_model(self, n:int, dist:ChineseStandardMahjongModelPool.DistributionType='latest') -> List[ChineseStandardMahjongModelPool.ModelHandlerType]:
+        versions = self.shared_versions()
+        if not versions:
+            return super().sample_model(n, dist)
+        return self._sample_versions(versions[-self.size:], n, dist)
+
+    # 断开共享内存，创建者同时删除共享内存
+    def close(self) -> None:
+        super().close()
+        for segment in [self._control] + self._slots if self._control is not None else list():
+            segment.close()
+            if self._is_owner:
+                segment.unlink()
+                _created_segment_names.discard(segment.name)
+        self._control = None
+        self._slots = list()
+
+# 子进程中等待并读取最新版本，返回从发布到读取完成的延迟
+def _benchmark_subscribe(args) -> Dict[str, float]:
+    path, handler, published_time = args
+    pool = ChineseStandardMahjongSharedMemoryModelPool({'path' : path, 'cache_bytes' : 0})
+    while pool.latest_shared_version != handler:
+        time.sleep(0.001)
+    pool.load_model(handler)
+    latency = time.time() - published_time
+    pool.close()
+    return {'latency' : latency}
+
+if __name__ == '__main__':
+    # 发布与读取延迟：python shared_memory_model_pool.py [模型参数量(M)] [进程数]
+    import tempfile
+    from collections import OrderedDict
+    from multiprocessing import Pool
+
+    n_params = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 10_000_000
+    n_processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    n_layers = 10
+    model = OrderedDict((f'layer{i}.weight', torch.randn(n_params // n_layers)) for i in range(n_layers))
+    with tempfile.TemporaryDirectory() as path:
+        pool = ChineseStandardMahjongSharedMemoryModelPool({'path' : path, 'size' : 2, 'async_save' : True})
+        with Pool(n_processes) as process_pool:
+            for i in range(3):
+                start_time = time.perf_counter()
+                published_time = time.time()
+                handler = pool.save_model(model)
+                publish_time = time.perf_counter() - start_time
+                results = process_pool.map(_benchmark_subscribe, [(path, handler, published_time)] * n_processes)
+                print(
+                    f'version {handler}: {n_params * 4 / 2**20:.0f}MB, publish {publish_time * 1000:.2f}ms, '
+                    f'latency to {n_processes} actors {np.median([r["latency"] for r in results]) * 1000:.2f}ms'
+                )
+        pool.close()
@@ -0,0 +1,327 @@
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from typing import Dict, List, Union
+
+import numpy as np
+
+from sample_pool import SamplePool
+from mmap_sample_pool import ChineseStandardMahjongMmapSamplePool
+
+# 同一节点上多个actor进程写入、learner读取的共享内存样本池
+# 共享内存中是容量为size的环形记录数组（记录格式同ChineseStandardMahjongMmapSamplePool），actor每次写入一整条轨迹：
+# 只在加锁时预留连续的槽位，写入在锁外进行；每个槽位的序号在写入前置为-1，写完后置为全局编号+1
+# learner直接从共享内存按批读取，不经过序列化；读取前后序号不变且大于0的记录才有效，被改写的记录重新抽取
+# learner创建样本池后作为参数传给actor进程，actor进程中自动连接同一块共享内存
+class ChineseStandardMahjongSharedMemorySamplePool(SamplePool):
+
+    SampleType = ChineseStandardMahjongMmapSamplePool.SampleType
+    BatchType = ChineseStandardMahjongMmapSamplePool.BatchType
+
+    _n_actions = ChineseStandardMahjongMmapSamplePool._n_actions
+    _fields = ChineseStandardMahjongMmapSamplePool._fields
+    _record_dtype = ChineseStandardMahjongMmapSamplePool._record_dtype
+
+    _default_size = 1 << 20
+    _default_max_producers = 64
+    _default_lock_timeout = 0.1
+    # 共享的tag表：最多的tag数和每个tag的最大字节数
+    _max_tags = 256
+    _tag_bytes = 32
+    # 控制段：写入位置、已登记的写入者数、已登记的tag数、创建时间（纳秒），之后是每个写入者和learner各一行计数
+    _control_fields = ('cursor', 'n_producers', 'n_tags', 'created_time_ns')
+    # 写入者的计数，最后一项为未被learner读取就被覆盖的记录数
+    _producer_counters = ('produced_trajectories', 'produced_records', 'dropped_trajectories', 'dropped_records', 'overwritten_records')
+    # learner的计数，最后一项为因正在改写而重新抽取的记录数
+    _consumer_counters = ('consumed_batches', 'consumed_records', 'torn_records')
+    # 抽到正在改写的记录时立即重新抽取的次数，之后每次重新抽取前等待，让写入者写完
+    _n_immediate_resamples = 8
+    _resample_wait = 0.001
+    # 一直读不到完整的一批（如写入者在写入中途退出且没有新的写入）时报错的等待时间（秒）
+    _resample_timeout = 10.0
+
+    def __init__(self, config:Dict):
+        self.config = config
+        self._lock = multiprocessing.get_context(self.start_method).Lock()
+        self._segments = None
+        # 以fork启动的actor进程中的副本不是创建者，也需要各自登记为写入者
+        self._owner_pid = os.getpid()
+        self._producer_id = None
+        self._producer_pid = None
+        self._tag_ids = dict()
+        self._rng = np.random.default_rng(self.config.get('seed', None))
+        self._batch_buffer = None
+        self._create()
+
+    @property
+    def size(self) -> int:
+        return self.config.get('size', self._default_size)
+
+    # 启动actor进程的方式（fork、spawn或forkserver），锁需要在同一方式下创建，为None时使用默认方式
+    @property
+    def start_method(self) -> Union[str, None]:
+        return self.config.get('start_method', None)
+
+    @property
+    def max_producers(self) -> int:
+        return self.config.get('max_producers', self._default_max_producers)
+
+    # actor等待预留槽位的锁的最长时间（秒），超时则丢弃这条轨迹，actor不会因为learner而阻塞
+    @property
+    def lock_timeout(self) -> float:
+        return self.config.get('lock_timeout', self._default_lock_timeout)
+
+    def _segment_sizes(self) -> Dict[str, int]:
+        n_rows = self.max_producers + 1
+        return {
+            'control' : 8 * (len(self._control_fields) + n_rows * len(self._producer_counters)),
+            'tags' : self._max_tags * self._tag_bytes,
+            'records' : self.size * self._record_dtype.itemsize,
+            'seqs' : self.size * 8,
+            'read' : self.size
+        }
+
+    def _create(self):
+        self._segments = {name : shared_memory.SharedMemory(create=True, size=size) for name, size in self._segment_sizes().items()}
+        self._map_arrays()
+        self._control[3] = time.time_ns()
+
+    # 传给actor进程时只传递配置、锁和共享内存的名称
+    def __getstate__(self) -> Dict:
+        return {
+            'config' : self.config,
+            'lock' : self._lock,
+            'segment_names' : {name : segment.name for name, segment in self._segments.items()},
+            'tracker_pid' : resource_tracker._resource_tracker._pid
+        }
+
+    def __setstate__(self, state:Dict):
+        self.config = state['config']
+        self._lock = state['lock']
+        self._segments = {name : self._attach_segment(segment_name, state['tracker_pid']) for name, segment_name in state['segment_names'].items()}
+        self._owner_pid = None
+        self._producer_id = None
+        self._producer_pid = None
+        self._tag_ids = dict()
+        self._rng = np.random.default_rng()
+        self._batch_buffer = None
+        self._map_arrays()
+
+    # 只连接的进程不应在退出时删除共享内存，连接时的登记需要取消
+    # fork、spawn、forkserver启动的子进程与创建者共用同一个resource_tracker（子进程中_pid为None或与创建者相同），
+    # 此时取消登记会同时取消创建者的登记，只有使用自己的resource_tracker的进程才取消
+    @staticmethod
+    def _attach_segment(name:str, creator_tracker_pid:Union[int, None]) -> shared_memory.SharedMemory:
+        segment = shared_memory.SharedMemory(name)
+        tracker_pid = resource_tracker._resource_tracker._pid
+        if tracker_pid is not None and tracker_pid != creator_tracker_pid:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+    def _map_arrays(self):
+        segments = self._segments
+        self._control = np.ndarray(len(self._control_fields), dtype=np.int64, buffer=segments['control'].buf)
+        self._counters = np.ndarray(
+            (self.max_producers + 1, len(self._producer_counters)), dtype=np.int64,
+            buffer=segments['control'].buf, offset=8 * len(self._control_fields)
+        )
+        self._tags = np.ndarray((self._max_tags, self._tag_bytes), dtype=np.uint8, buffer=segments['tags'].buf)
+        self._records = np.ndarray(self.size, dtype=self._record_dtype, buffer=segments['records'].buf)
+        self._seqs = np.ndarray(self.size, dtype=np.int64, buffer=segments['seqs'].buf)
+        self._read = np.ndarray(self.size, dtype=np.uint8, buffer=segments['read'].buf)
+
+    # 写入端
+
+    # 第一次写入时登记为一个写入者，之后只更新自己的一行计数
+    def _register_producer(self) -> int:
+        if self._producer_pid != os.getpid():
+            with self._lock:
+                assert self._control[1] < self.max_producers, 'too many producers'
+                self._producer_id = int(self._control[1])
+                self._control[1] += 1
+            self._producer_pid = os.getpid()
+            self._tag_ids = dict()
+        return self._producer_id
+
+    def _tag_id(self, tag:str) -> int:
+        if tag not in self._tag_ids:
+            name = tag.encode()
+            assert len(name) <= self._tag_bytes, f'tag too long: {tag}'
+            row = np.zeros(self._tag_bytes, dtype=np.uint8)
+            row[:len(name)] = np.frombuffer(name, dtype=np.uint8)
+            with self._lock:
+                n_tags = int(self._control[2])
+                matches = np.nonzero((self._tags[:n_tags] == row).all(axis=1))[0]
+                if len(matches) > 0:
+                    self._tag_ids[tag] = int(matches[0])
+                else:
+                    assert n_tags < self._max_tags, 'too many tags'
+                    self._tags[n_tags] = row
+                    self._control[2] += 1
+                    self._tag_ids[tag] = n_tags
+        return self._tag_ids[tag]
+
+    def save_sample(self, sample:SampleType, tag:str='') -> bool:
+        return self.save_samples({name : np.asarray(values)[None] for name, values in sample.items()}, tag)
+
+    # 写入一整条轨迹，返回是否写入；轨迹超过容量或等锁超时时丢弃
+    def save_samples(self, samples:BatchType, tag:str='') -> bool:
+        counters = self._counters[self._register_producer()]
+        n = len(samples['action'])
+        if n > self.size or not self._lock.acquire(timeout=self.lock_timeout):
+            counters[2] += 1
+            counters[3] += n
+            return False
+        try:
+            start = int(self._control[0])
+            self._control[0] += n
+        finally:
+            self._lock.release()
+
+        slots = (start + np.arange(n)) % self.size
+        # 槽位上还没有被learner读过的记录
+        counters[4] += int(np.count_nonzero((self._seqs[slots] > 0) & (self._read[slots] == 0)))
+        self._seqs[slots] = -1
+        records = np.empty(n, dtype=self._record_dtype)
+        for name, _, _ in self._fields:
+            if name == 'mask':
+                records['mask'] = np.packbits(samples['mask'], axis=1)
+            elif name == 'tag':
+                records['tag'] = self._tag_id(tag)
+            else:
+                records[name] = samples[name]
+        self._records[slots] = records
+        self._read[slots] = 0
+        self._seqs[slots] = start + np.arange(n) + 1
+        counters[0] += 1
+        counters[1] += n
+        return True
+
+    # 读取端
+
+    @property
+    def tag_names(self) -> List[str]:
+        return [bytes(row).rstrip(b'\0').decode() for row in self._tags[:int(self._control[2])]]
+
+    # 已经写入过的槽位数
+    @property
+    def n_samples(self) -> int:
+        return min(int(self._control[0]), self.size)
+
+    # 整个环形记录数组，不复制；其中正在写入的记录的序号为-1
+    def view(self) -> np.ndarray:
+        return self._records
+
+    # 均匀随机抽取batch_size条记录，返回的数组在下一次调用时会被覆盖
+    def load_batch(self, batch_size:int) -> BatchType:
+        assert self.n_samples > 0
+        counters = self._counters[self.max_producers]
+        if self._batch_buffer is None or len(self._batch_buffer) < batch_size:
+            self._batch_buffer = np.empty(batch_size, dtype=self._record_dtype)
+        records = self._batch_buffer[:batch_size]
+        indices = self._rng.integers(0, self.n_samples, size=batch_size)
+        positions = np.arange(batch_size)
+        start_time = time.perf_counter()
+        n_resamples = 0
+        while True:
+            seqs = self._seqs[indices]
+            records[positions] = self._records[indices]
+            valid = (seqs > 0) & (seqs == self._seqs[indices])
+            self._read[indices[valid]] = 1
+            if valid.all():
+                break
+            # 读取期间被改写或正在写入的记录重新抽取；刚开始写入时预留的槽位可能都还没有写完
+            counters[2] += int(np.count_nonzero(~valid))
+            n_resamples += 1
+            if n_resamples > self._n_immediate_resamples:
+                if time.perf_counter() - start_time > self._resample_timeout:
+                    raise RuntimeError('no consistent records to read from the sample pool')
+                time.sleep(self._resample_wait)
+            positions = positions[~valid]
+            indices = self._rng.integers(0, self.n_samples, size=len(positions))
+        counters[0] += 1
+        counters[1] += batch_size
+        batch = {name : records[name] for name in self._record_dtype.names}
+        batch['mask'] = np.unpackbits(batch['mask'], axis=1, count=self._n_actions).view(np.bool_)
+        return batch
+
+    # 所有写入者和learner的计数，以及从创建开始的平均吞吐（记录/秒）
+    def stats(self) -> Dict[str, Union[int, float]]:
+        elapsed = (time.time_ns() - int(self._control[3])) / 1e9
+        producer_totals = self._counters[:self.max_producers].sum(axis=0)
+        consumer = self._counters[self.max_producers]
+        stats = {'n_producers' : int(self._control[1])}
+        stats.update(zip(self._producer_counters, map(int, producer_totals)))
+        stats.update(zip(self._consumer_counters, map(int, consumer)))
+        stats['producer_records_per_second'] = stats['produced_records'] / elapsed
+        stats['consumer_records_per_second'] = stats['consumed_records'] / elapsed
+        return stats
+
+    # 断开共享内存，创建者同时删除共享内存
+    def close(self):
+        if self._segments is None:
+            return
+        self._control = self._counters = self._tags = self._records = self._seqs = self._read = None
+        for segment in self._segments.values():
+            segment.close()
+            if self._owner_pid == os.getpid():
+                segment.unlink()
+        self._segments = None
+
+# actor进程：持续写入长度为trajectory_length的轨迹，直到deadline
+def _actor(pool:ChineseStandardMahjongSharedMemorySamplePool, seed:int, trajectory_length:int, deadline:float):
+    from ring_buffer_sample_pool import _random_samples
+    trajectory = _random_samples(trajectory_length, np.random.default_rng(seed))
+    while time.time() < deadline:
+        pool.save_samples(trajectory, tag='selfplay')
+    pool.close()
+
+# 对照：actor通过multiprocessing.Queue发送pickle后的轨迹
+def _queue_actor(samples_queue:multiprocessing.Queue, seed:int, trajectory_length:int, deadline:float):
+    from ring_buffer_sample_pool import _random_samples
+    trajectory = _random_samples(trajectory_length, np.random.default_rng(seed))
+    while time.time() < deadline:
+        samples_queue.put(trajectory)
+    samples_queue.put(None)
+
+if __name__ == '__main__':
+    # 吞吐基准：python shared_memory_sample_pool.py [actor数] [运行秒数] [batch_size]
+    n_actors = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+    trajectory_length = 100
+
+    pool = ChineseStandardMahjongSharedMemorySamplePool({'size' : 1 << 20, 'seed' : 0})
+    deadline = time.time() + duration
+    actors = [multiprocessing.Process(target=_actor, args=(pool, i, trajectory_length, deadline)) for i in range(n_actors)]
+    for actor in actors:
+        actor.start()
+    while pool.n_samples == 0:
+        time.sleep(0.001)
+    while time.time() < deadline:
+        pool.load_batch(batch_size)
+    for actor in actors:
+        actor.join()
+    for name, value in pool.stats().items():
+        print(f'{name}: {value:.0f}' if isinstance(value, float) else f'{name}: {value}')
+    pool.close()
+
+    # 同样的actor通过队列发送轨迹，learner只接收不训练
+    samples_queue = multiprocessing.Queue(maxsize=1024)
+    deadline = time.time() + duration
+    actors = [multiprocessing.Process(target=_queue_actor, args=(samples_queue, i, trajectory_length, deadline)) for i in range(n_actors)]
+    for actor in actors:
+        actor.start()
+    n_received, n_finished = 0, 0
+    start_time = time.time()
+    while n_finished < n_actors:
+        trajectory = samples_queue.get()
+        if trajectory is None:
+            n_finished += 1
+        else:
+            n_received += len(trajectory['action'])
+    for actor in actors:
+        actor.join()
+    print(f'multiprocessing.Queue baseline: {n_received / (time.time() - start_time):.0f} records/s')
@@ -0,0 +1,274 @@
+import os
+import csv
+import sys
+import json
+import time
+import queue
+import threading
+import multiprocessing
+from array import array
+from collections import deque
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+
+# 训练过程的指标收集：record(name, value)记录一个数值，后台线程按时间窗口汇总后写入本地文件
+# 进程内的记录只向deque追加一个元组，deque.append在CPython中是原子操作，不需要加锁
+# 其他进程（actor、learner）通过channel()得到的MetricsChannel记录，按指标攒在进程内的数组中，每隔ship_interval秒整批放入共享队列
+# 后台线程每隔flush_interval秒取出这一窗口的所有记录，对每个指标输出个数、每秒个数、和、每秒的和、均值、最小值、最大值和分位数
+# 输出为JSONL或CSV（按path的后缀），文件超过max_bytes后轮换为path.1 ... path.{backup_count}
+class MetricsSink:
+
+    # 一个指标在一个窗口内的汇总
+    RowType = Dict[str, Any]
+
+    _default_path = './metrics.jsonl'
+    _default_flush_interval = 10.0
+    _default_max_bytes = 64 << 20
+    _default_backup_count = 4
+    _default_percentiles = (50, 90, 99)
+    _default_ship_interval = 1.0
+
+    def __init__(self, config:Union[Dict, None]=None):
+        self.config = dict() if config is None else config
+        self._records = deque()
+        # 其他进程送来的记录：指标名 -> 数值数组的list
+        self._shipped = dict()
+        # 写入文件前不汇总的行，见write
+        self._rows = deque()
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._window_start = time.time()
+
+    # 输出文件，后缀为.csv时输出CSV，否则输出JSONL
+    @property
+    def path(self) -> str:
+        return self.config.get('path', self._default_path)
+
+    # 汇总窗口的长度（秒）
+    @property
+    def flush_interval(self) -> float:
+        return self.config.get('flush_interval', self._default_flush_interval)
+
+    @property
+    def max_bytes(self) -> int:
+        return self.config.get('max_bytes', self._default_max_bytes)
+
+    @property
+    def backup_count(self) -> int:
+        return self.config.get('backup_count', self._default_backup_count)
+
+    @property
+    def percentiles(self) -> Tuple[int]:
+        return tuple(self.config.get('percentiles', self._default_percentiles))
+
+    # 其他进程的记录最多延迟多久送到
+    @property
+    def ship_interval(self) -> float:
+        return self.config.get('ship_interval', self._default_ship_interval)
+
+    @property
+    def start_method(self) -> Union[str, None]:
+        return self.config.get('start_method', None)
+
+    @property
+    def _columns(self) -> List[str]:
+        return ['time', 'window', 'name', 'count', 'rate', 'sum', 'sum_rate', 'mean', 'min', 'max'] + [f'p{p}' for p in self.percentiles]
+
+    # 记录一个数值；计数类的指标用默认值1，rate即为每秒次数
+    def record(self, name:str, value:float=1.0):
+        self._records.append((name, value))
+
+    # 不经汇总直接写入文件的一行，例如Trainer.write_log的内容
+    def write(self, row:RowType):
+        self._rows.append(row)
+
+    # 给其他进程使用的记录端，需要在创建子进程前调用并作为参数传入
+    def channel(self) -> 'MetricsChannel':
+        if self._queue is None:
+            self._queue = multiprocessing.get_context(self.start_method).Queue()
+        return MetricsChannel(self._queue, self.ship_interval)
+
+    def start(self):
+        assert self._thread is None
+        self._stop.clear()
+        self._window_start = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # 停止后台线程，写入剩余的记录
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(max(0.0, self._window_start + self.flush_interval - time.time())):
+            self.flush()
+
+    # 取出共享队列中其他进程送来的记录
+    def _drain_queue(self):
+        if self._queue is None:
+            return
+        while True:
+            try:
+                shipped = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            values_by_name, rows = shipped
+            self._rows.extend(rows)
+            for name, values in values_by_name.items():
+                self._shipped.setdefault(name, []).append(np.frombuffer(values, dtype=np.float64))
+
+    # 汇总当前窗口的记录并写入文件
+    def flush(self):
+        self._drain_queue()
+        now = time.time()
+        window = max(now - self._window_start, 1e-9)
+        self._window_start = now
+        records = self._records
+        # 只取出已有的记录，flush期间新增的记录属于下一个窗口
+        values = dict()
+        for _ in range(len(records)):
+            name, value = records.popleft()
+            values.setdefault(name, []).append(value)
+        arrays = {name : [np.array(metric_values, dtype=np.float64)] for name, metric_values in values.items()}
+        for name, metric_arrays in self._shipped.items():
+            arrays.setdefault(name, []).extend(metric_arrays)
+        self._shipped = dict()
+        rows = [self._row(now, window, name, np.concatenate(metric_arrays)) for name, metric_arrays in arrays.items()]
+        rows.extend(self._rows.popleft() for _ in range(len(self._rows)))
+        if len(rows) > 0:
+            self._write_rows(rows)
+
+    def _row(self, now:float, window:float, name:str, values:np.ndarray) -> RowType:
+        total = float(values.sum())
+        row = {
+            'time' : now,
+            'window' : window,
+            'name' : name,
+            'count' : len(values),
+            'rate' : len(values) / window,
+            'sum' : total,
+            'sum_rate' : total / window,
+            'mean' : total / len(values),
+            'min' : float(values.min()),
+            'max' : float(values.max())
+        }
+        for p, value in zip(self.percentiles, np.percentile(values, self.percentiles).tolist()):
+            row[f'p{p}'] = value
+        return row
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def _write_rows(self, rows:List[RowType]):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if self.path.endswith('.csv'):
+            new_file = not os.path.exists(self.path)
+            with open(self.path, 'a', encoding='utf-8', newline='') as f:
+                # write写入的行只保留与汇总行相同的列
+                writer = csv.DictWriter(f, fieldnames=self._columns, extrasaction='ignore')
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(row) + '\n' for row in rows)
+
+# 其他进程的记录端：每个指标的数值攒在进程内的array中，距上一次发送超过ship_interval秒时整批放入共享队列
+# write的行立即发送；读时钟比记录本身还慢，每_check_interval条记录才检查一次是否需要发送
+# 进程结束前应调用close，发送剩余的记录
+class MetricsChannel:
+
+    _check_interval = 16
+
+    def __init__(self, records_queue:Any, ship_interval:float):
+        self._queue = records_queue
+        self._ship_interval = ship_interval
+        self._values = dict()
+        self._rows = list()
+        self._ship_time = time.monotonic() + ship_interval
+        self._countdown = self._check_interval
+
+    def __getstate__(self) -> Dict:
+        return {'records_queue' : self._queue, 'ship_interval' : self._ship_interval}
+
+    def __setstate__(self, state:Dict):
+        self.__init__(**state)
+
+    def record(self, name:str, value:float=1.0):
+        try:
+            self._values[name].append(value)
+        except KeyError:
+            self._values[name] = array('d', (value,))
+        self._countdown -= 1
+        if self._countdown == 0:
+            self._countdown = self._check_interval
+            if time.monotonic() >= self._ship_time:
+                self.ship()
+
+    def write(self, row:MetricsSink.RowType):
+        self._rows.append(row)
+        self.ship()
+
+    def ship(self):
+        if len(self._values) > 0 or len(self._rows) > 0:
+            self._queue.put((self._values, self._rows))
+            self._values = dict()
+            self._rows = list()
+        self._ship_time = time.monotonic() + self._ship_interval
+
+    def close(self):
+        self.ship()
+
+# 子进程中记录n次并打印每次记录的耗时
+def _record_in_process(channel:MetricsChannel, n:int):
+    start_time = time.perf_counter()
+    for i in range(n):
+        channel.record('child_value', i)
+    elapsed = time.perf_counter() - start_time
+    channel.close()
+    print(f'MetricsChannel.record in a child process: {elapsed / n * 1e9:.0f} ns/record')
+
+if __name__ == '__main__':
+    # 记录开销基准：python telemetry.py [记录次数]
+    import tempfile
+
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as path:
+        sink = MetricsSink({'path' : os.path.join(path, 'metrics.jsonl'), 'flush_interval' : 0.5, 'max_bytes' : 4096, 'backup_count' : 2})
+        channel = sink.channel()
+        sink.start()
+        start_time = time.perf_counter()
+        for i in range(n):
+            sink.record('step_seconds', i)
+        print(f'MetricsSink.record with the flush thread running: {(time.perf_counter() - start_time) / n * 1e9:.0f} ns/record')
+
+        process = multiprocessing.Process(target=_record_in_process, args=(channel, n))
+        process.start()
+        process.join()
+        for i in range(40):
+            sink.record(f'metric_{i}', i)
+            time.sleep(0.05)
+        sink.stop()
+        counts = dict()
+        for file_name in sorted(os.listdir(path)):
+            with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f:
+                for row in map(json.loads, f):
+                    counts[row['name']] = counts.get(row['name'], 0) + row['count']
+        print(f'files: {sorted(os.listdir(path))}')
+        print(f"step_seconds: {counts.get('step_seconds', 0)}, child_value: {counts.get('child_value', 0)} records aggregated")